@@ -0,0 +1,327 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+import multiprocessing as mp
+import numpy as np
+import sys, os, io, json, time, resource, platform, subprocess, contextlib
+
+# make the plotting tools and the model DB import importable
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'plotting'))
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'create-model'))
+import synthetic_data as sd
+
+
+# Each benchmark runs in a fresh (spawned) process, so its peak memory is not distorted by the other
+# benchmarks. A benchmark prepares its inputs untimed, then times its hot path and returns the amount
+# of processed items; the throughput is items per second. The peak memory is the peak resident set size
+# of the timed hot path above the resident set size at its start (the imports and the untimed preparation
+# don't count). The results of each run are appended to a JSON history, a run fails if a metric regressed
+# past the threshold compared to the median of the previous runs (same benchmark, board and scale).
+# The board independent benchmarks read win rate logs generated independently of the boards.
+
+BENCHMARKS_PATH = Path(__file__).resolve().parent
+DEFAULT_DATA_PATH = BENCHMARKS_PATH / 'data'
+DEFAULT_HISTORY_PATH = BENCHMARKS_PATH / 'history.json'
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_BASELINE_RUNS = 5
+NUM_SAMPLED_STATES = 10000
+NUM_REPEATS = 20
+
+# boards (rows, columns, win_conn) and scales (random playouts, win rate log rows)
+BOARDS = {'4x5': (4, 5, 4), '5x6': (5, 6, 4), '6x7': (6, 7, 4)}
+SCALES = {'small': (1000, 1000), 'medium': (10000, 10000), 'large': (100000, 100000)}
+BOARD_INDEPENDENT = '-'
+
+ARG_BOARDS = '--boards'
+ARG_SCALES = '--scales'
+ARG_ONLY = '--only'
+ARG_HISTORY = '--history'
+ARG_DATA = '--data'
+ARG_THRESHOLD = '--threshold'
+ARG_NO_RECORD = '--no-record'
+ALL_ARG_SPECIFIERS = [ARG_BOARDS, ARG_SCALES, ARG_ONLY, ARG_HISTORY, ARG_DATA, ARG_THRESHOLD]
+
+
+def status_mib(field: str):
+    # read a memory field of /proc/self/status, given in KiB (None if unavailable, e.g. on macOS)
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith(field + ':'): return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def max_rss_mib():
+    # the max resident set size is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# resident set size at the start of the timed section of the running benchmark
+TIMED_SECTION = {'baseline_mib': 0.0}
+
+def start_timed_section():
+
+    # reset the peak resident set size to the current one (Linux), so only the timed hot path counts;
+    # without the reset, only the growth of the peak since the start is measured
+    try:
+        with open('/proc/self/clear_refs', 'w') as file: file.write('5')
+        TIMED_SECTION['baseline_mib'] = status_mib('VmRSS')
+    except OSError:
+        TIMED_SECTION['baseline_mib'] = None
+    if TIMED_SECTION['baseline_mib'] is None: TIMED_SECTION['baseline_mib'] = max_rss_mib()
+    return time.perf_counter()
+
+
+def timed_peak_mib():
+    peak_mib = status_mib('VmHWM')
+    return max((peak_mib if peak_mib is not None else max_rss_mib()) - TIMED_SECTION['baseline_mib'], 0.0)
+
+
+def initial_state(rows: int, cols: int):
+    import state_codec as sc
+    return str(sc.fields_to_hashes(np.zeros((1, rows, cols), dtype=np.uint8))[0])
+
+
+def sample_states(path_transitions: Path, num_states: int=NUM_SAMPLED_STATES):
+
+    # sample states with legal moves from the transitions (deterministically)
+    import pandas as pd
+    states = pd.read_csv(path_transitions, names=['before', 'after'], usecols=['before'])['before'].unique()
+    return np.random.default_rng(0).choice(states, min(num_states, len(states)), replace=False).tolist()
+
+
+def load_store_df(data_path: Path):
+    import winrate_store as ws
+    return ws.read_run(data_path / sd.WIN_RATES_LOG_PATH, 'benchmark')
+
+
+# ---------------- benchmarks: (data path) -> (timed seconds, processed items, unit) ----------------
+
+def bench_game_tree_build(data_path: Path):
+
+    # build the CSR index from the csv file (without cache)
+    from critical_path_detection import GameTree, CSR_CACHE_EXT
+    cache_path = data_path / ('transitions.csv' + CSR_CACHE_EXT)
+    if cache_path.exists(): cache_path.unlink()
+    start_time = start_timed_section()
+    game_tree = GameTree(str(data_path / 'transitions.csv'))
+    return time.perf_counter() - start_time, len(game_tree.targets), 'edges'
+
+
+def bench_game_tree_next_states(data_path: Path):
+    from critical_path_detection import GameTree
+    game_tree = GameTree(str(data_path / 'transitions.csv'))
+    states = sample_states(data_path / 'transitions.csv')
+    start_time = start_timed_section()
+    for state in states: game_tree.next_states(state)
+    return time.perf_counter() - start_time, len(states), 'calls'
+
+
+def bench_csv_agent_load(data_path: Path):
+    from critical_path_detection import CsvAgent
+    start_time = start_timed_section()
+    agent = CsvAgent(str(data_path / 'SimpleQL_A_1.csv'), None)
+    return time.perf_counter() - start_time, len(agent.policy_states), 'states'
+
+
+def bench_csv_agent_best_next_state(data_path: Path):
+
+    # query the states of the agent's own side
+    from critical_path_detection import GameTree, CsvAgent
+    import state_codec as sc
+    agent = CsvAgent(str(data_path / 'SimpleQL_A_1.csv'), GameTree(str(data_path / 'transitions.csv')))
+    states = sc.keys_to_hashes(agent.policy_states[np.random.default_rng(0).permutation(len(agent.policy_states))[:NUM_SAMPLED_STATES]])
+    start_time = start_timed_section()
+    for state in states: agent.best_next_state(state)
+    return time.perf_counter() - start_time, len(states), 'calls'
+
+
+def bench_critical_path(data_path: Path):
+    from critical_path_detection import GameTree, CsvAgent, get_critical_path
+    game_tree = GameTree(str(data_path / 'transitions.csv'))
+    agent_a = CsvAgent(str(data_path / 'SimpleQL_A_1.csv'), game_tree)
+    agent_b = CsvAgent(str(data_path / 'SimpleQL_B_1.csv'), game_tree)
+    rows, cols = (int(x) for x in data_path.name.split('_')[0].split('x'))
+    start_time = start_timed_section()
+    for _ in range(NUM_REPEATS): get_critical_path(game_tree, agent_a, agent_b, initial_state(rows, cols))
+    return time.perf_counter() - start_time, NUM_REPEATS, 'paths'
+
+
+def bench_winrate_csv(data_path: Path):
+    import data_helper as dh
+    start_time = start_timed_section()
+    for _ in range(NUM_REPEATS): winrate_df = dh.get_winrate_df_from_csv(data_path / sd.WIN_RATES_LOG_PATH)
+    return time.perf_counter() - start_time, NUM_REPEATS * len(winrate_df), 'rows'
+
+
+def bench_create_db_legacy(data_path: Path):
+    import InsertModelsIntoDB as im
+    db_path = data_path / 'benchmark_legacy.db'
+    models = [str(data_path / 'SimpleQL_A_1.csv'), str(data_path / 'SimpleQL_B_1.csv')]
+    start_time = start_timed_section()
+    im.create_db_from_models(str(db_path), models)
+    duration = time.perf_counter() - start_time
+    db_path.unlink()
+    return duration, sum(1 for model in models for _ in open(model)), 'rows'
+
+
+def bench_create_db_optimized(data_path: Path):
+    import InsertModelsIntoDB as im
+    db_path = data_path / 'benchmark_optimized.db'
+    models = [str(data_path / 'SimpleQL_A_1.csv'), str(data_path / 'SimpleQL_B_1.csv')]
+    start_time = start_timed_section()
+    im.create_optimized_db_from_models(str(db_path), models)
+    duration = time.perf_counter() - start_time
+    db_path.unlink()
+    return duration, sum(1 for model in models for _ in open(model)), 'rows'
+
+
+def bench_plot(data_path: Path, plot_name: str):
+
+    # render the plot from the win rate store format (the winrate plot only uses agent A's rows)
+    import data_helper as dh
+    import winrate_plotter, compare_winrate_plotter, convergence_speed_plotter
+    store_df = load_store_df(data_path)
+    plot_function, plot_df = {
+        'winrate': (winrate_plotter.plot_winrates, store_df[store_df[dh.SIDE] == dh.SIDE_A]),
+        'compare_winrate': (compare_winrate_plotter.plot_compare_winrates, store_df),
+        'convergence_speed': (convergence_speed_plotter.plot_convergence_speed, store_df)
+    }[plot_name]
+    image_path = data_path / 'benchmark_{}.png'.format(plot_name)
+    start_time = start_timed_section()
+    plot_function(plot_df, image_path)
+    return time.perf_counter() - start_time, 1, 'plots'
+
+
+# benchmark name -> (function, depends on the board size)
+BENCHMARKS = {
+    'game_tree_build': (bench_game_tree_build, True),
+    'game_tree_next_states': (bench_game_tree_next_states, True),
+    'csv_agent_load': (bench_csv_agent_load, True),
+    'csv_agent_best_next_state': (bench_csv_agent_best_next_state, True),
+    'critical_path': (bench_critical_path, True),
+    'create_db_legacy': (bench_create_db_legacy, True),
+    'create_db_optimized': (bench_create_db_optimized, True),
+    'winrate_csv': (bench_winrate_csv, False),
+    'plot_winrate': (lambda data_path: bench_plot(data_path, 'winrate'), False),
+    'plot_compare_winrate': (lambda data_path: bench_plot(data_path, 'compare_winrate'), False),
+    'plot_convergence_speed': (lambda data_path: bench_plot(data_path, 'convergence_speed'), False)
+}
+
+
+def run_benchmark(name: str, data_path: Path):
+
+    # silence the progress prints of the tools and measure the peak memory of the timed section
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, items, unit = BENCHMARKS[name][0](data_path)
+    return {'seconds': seconds, 'items': items, 'unit': unit,
+        'throughput': items / max(seconds, 1e-9), 'timed_peak_mib': timed_peak_mib()}
+
+
+def run_isolated(name: str, data_path: Path):
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn')) as pool:
+        return pool.submit(run_benchmark, name, data_path).result()
+
+
+def prepare_data(data_root: Path, board: str, scale: str):
+
+    # generate the synthetic inputs once per board and scale (deterministic, so they are re-used)
+    data_path = data_root / '{}_{}'.format(board, scale)
+    if not (data_path / 'SimpleQL_B_1.csv').exists():
+        rows, cols, win_conn = BOARDS[board]
+        num_games, _ = SCALES[scale]
+        sd.generate_dataset(data_path, rows, cols, win_conn, num_games)
+    return data_path
+
+
+def prepare_logs(data_root: Path, scale: str):
+
+    # generate the win rate logs of the board independent benchmarks once per scale
+    data_path = data_root / 'logs_{}'.format(scale)
+    if not (data_path / sd.WIN_RATES_LOG_PATH).exists():
+        _, num_log_rows = SCALES[scale]
+        sd.generate_logs(data_path, num_log_rows)
+    return data_path
+
+
+def find_regressions(results: list, history: list, threshold: float, num_baseline_runs: int=DEFAULT_BASELINE_RUNS):
+
+    # compare each metric with the median of the previous runs (lower throughput or higher peak memory is worse)
+    regressions = []
+    for result in results:
+        key = (result['benchmark'], result['board'], result['scale'])
+        previous = [r for run in history[-num_baseline_runs:] for r in run['results'] if (r['benchmark'], r['board'], r['scale']) == key]
+        if len(previous) == 0: continue
+        baseline_throughput = float(np.median([r['throughput'] for r in previous]))
+        if result['throughput'] < (1 - threshold) * baseline_throughput:
+            regressions.append('{} ({}, {}): throughput {:.1f} {}/s, baseline {:.1f} {}/s'.format(
+                *key, result['throughput'], result['unit'], baseline_throughput, result['unit']))
+
+        # (runs recorded before the timed peak memory was measured only hold the peak of the whole process)
+        previous_peaks = [r['timed_peak_mib'] for r in previous if 'timed_peak_mib' in r]
+        if len(previous_peaks) == 0: continue
+        baseline_peak = float(np.median(previous_peaks))
+        if result['timed_peak_mib'] > (1 + threshold) * baseline_peak:
+            regressions.append('{} ({}, {}): peak memory {:.1f} MiB, baseline {:.1f} MiB'.format(*key, result['timed_peak_mib'], baseline_peak))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_PATH,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_arg_list(arg: str, default: list):
+    return sys.argv[sys.argv.index(arg) + 1].split(',') if arg in sys.argv else default
+
+
+def main():
+
+    # parse script args
+    boards = get_arg_list(ARG_BOARDS, list(BOARDS))
+    scales = get_arg_list(ARG_SCALES, ['small'])
+    names = get_arg_list(ARG_ONLY, list(BENCHMARKS))
+    history_path = Path(sys.argv[sys.argv.index(ARG_HISTORY) + 1]) if ARG_HISTORY in sys.argv else DEFAULT_HISTORY_PATH
+    data_root = Path(sys.argv[sys.argv.index(ARG_DATA) + 1]) if ARG_DATA in sys.argv else DEFAULT_DATA_PATH
+    threshold = float(sys.argv[sys.argv.index(ARG_THRESHOLD) + 1]) if ARG_THRESHOLD in sys.argv else DEFAULT_THRESHOLD
+    for board, scale, name in [(b, None, None) for b in boards] + [(None, s, None) for s in scales] + [(None, None, n) for n in names]:
+        if board is not None and board not in BOARDS: raise ValueError('Invalid arguments! Unknown board {}, expected one of {}'.format(board, list(BOARDS)))
+        if scale is not None and scale not in SCALES: raise ValueError('Invalid arguments! Unknown scale {}, expected one of {}'.format(scale, list(SCALES)))
+        if name is not None and name not in BENCHMARKS: raise ValueError('Invalid arguments! Unknown benchmark {}, expected one of {}'.format(name, list(BENCHMARKS)))
+
+    # run the board dependent benchmarks for each board, the others once per scale
+    results = []
+    for scale in scales:
+        runs = [(name, board, prepare_data(data_root, board, scale)) for board in boards for name in names if BENCHMARKS[name][1]]
+        if any(not BENCHMARKS[name][1] for name in names):
+            logs_path = prepare_logs(data_root, scale)
+            runs += [(name, BOARD_INDEPENDENT, logs_path) for name in names if not BENCHMARKS[name][1]]
+        for name, board, data_path in runs:
+            result = run_isolated(name, data_path)
+            result.update({'benchmark': name, 'board': board, 'scale': scale})
+            results.append(result)
+            print('{:<26} {:>4} {:<7} {:>12.1f} {}/s {:>9.1f} MiB'.format(name, result['board'], scale,
+                result['throughput'], result['unit'], result['timed_peak_mib']))
+
+    # compare with the history, then append this run
+    history = json.loads(history_path.read_text()) if history_path.exists() else []
+    regressions = find_regressions(results, history, threshold)
+    if ARG_NO_RECORD not in sys.argv:
+        history.append({'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'commit': git_commit(),
+            'host': platform.node(), 'python': platform.python_version(), 'results': results})
+        history_path.write_text(json.dumps(history, indent=2))
+        print('wrote benchmark results to {}'.format(history_path))
+
+    # fail if any metric regressed
+    if len(regressions) > 0:
+        for regression in regressions: print('REGRESSION: ' + regression)
+        sys.exit(1)
+
+
+if __name__=='__main__':
+    main()
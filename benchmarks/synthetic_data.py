@@ -0,0 +1,100 @@
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import sys
+
+# make the shared state codec and game rules of the plotting tools importable
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'plotting'))
+import state_codec as sc
+import connect_n as cn
+
+
+# Synthetic inputs for the benchmarks. Exhaustive game trees are out of reach beyond small boards,
+# so the transitions are sampled from random playouts: every state visited by a playout is expanded
+# with all of its legal moves (won states are never expanded), which keeps the next states of all
+# expanded states complete, just like in the transitions.csv of the full game tree. The Q tables
+# hold one random Q value for each expanded state and action of their side, written in the format
+# of QTableSerializer (state before, state after, acting side, column, Q value).
+
+QTABLE_LEARNING_STEPS = 10000
+WIN_RATES_LOG_PATH = Path('logs') / 'SimpleQL_A_vs_SimpleQL_B' / 'win_rates.csv'
+
+
+def sample_edges(rows: int, cols: int, win_conn: int, num_games: int, rng: np.random.Generator):
+
+    # play all random games at once
+    fields = cn.initial_boards(num_games, rows, cols)
+    heights = np.zeros((num_games, cols), dtype=np.int64)
+    before, after, sides, columns = [], [], [], []
+
+    for turn in range(rows * cols):
+        side = cn.SIDE_A if turn % 2 == 0 else cn.SIDE_B
+
+        # expand each running board with all of its legal moves
+        legal = cn.legal_moves(fields)
+        board_ids, move_columns = np.nonzero(legal)
+        child_fields, child_heights = fields[board_ids], heights[board_ids]
+        cn.drop_stones(child_fields, child_heights, move_columns, side)
+        before.append(sc.fields_to_keys(fields)[board_ids])
+        after.append(sc.fields_to_keys(child_fields))
+        sides.append(np.full(len(board_ids), side, dtype=np.int8))
+        columns.append(move_columns.astype(np.int8))
+
+        # continue the games with a random move, only keep the boards that are neither won nor full
+        cn.drop_stones(fields, heights, cn.random_legal_columns(legal, rng), side)
+        is_running = ~cn.is_connect_n(fields, side, win_conn)
+        fields, heights = fields[is_running], heights[is_running]
+        if len(fields) == 0: break
+
+    # keep each (state, column) edge only once
+    before, after = np.concatenate(before), np.concatenate(after)
+    sides, columns = np.concatenate(sides), np.concatenate(columns)
+    raw = np.concatenate([sc.keys_to_bytes(before), columns.view(np.uint8)[:, None]], axis=1)
+    _, first_edges = np.unique(raw.view(('S', raw.shape[1])).ravel(), return_index=True)
+    first_edges = np.sort(first_edges)
+    return before[first_edges], after[first_edges], sides[first_edges], columns[first_edges]
+
+
+def write_transitions_csv(before, after, path: Path):
+    pd.DataFrame({'before': sc.keys_to_hashes(before), 'after': sc.keys_to_hashes(after)}).to_csv(path, header=False, index=False)
+
+
+def write_qtable_csv(before, after, sides, columns, side: int, path: Path, rng: np.random.Generator):
+
+    # one random Q value per state and action of the given side
+    is_side = sides == side
+    pd.DataFrame({'before': sc.keys_to_hashes(before[is_side]), 'after': sc.keys_to_hashes(after[is_side]),
+        'side': sides[is_side], 'column': columns[is_side],
+        'q_value': rng.uniform(-1, 1, int(is_side.sum()))}).to_csv(path, header=False, index=False)
+
+
+def write_win_rates_csv(num_rows: int, path: Path, rng: np.random.Generator):
+
+    # side A learns along a noisy saturation curve, the remaining games are split into losses and ties
+    progress = np.arange(1, num_rows + 1) / num_rows
+    win_rate_a = np.clip(0.95 - 0.6 * np.exp(-5 * progress) + rng.normal(0, 0.02, num_rows), 0, 1)
+    tie_rate = np.clip((1 - win_rate_a) * 0.2 + rng.normal(0, 0.005, num_rows), 0, 1 - win_rate_a)
+    pd.DataFrame({'steps': QTABLE_LEARNING_STEPS, 'a': win_rate_a, 'b': 1 - win_rate_a - tie_rate,
+        'ties': tie_rate}).to_csv(path, header=False, index=False)
+
+
+def generate_dataset(data_path: Path, rows: int, cols: int, win_conn: int, num_games: int, seed: int=0):
+
+    # lay the files out like a training: Q tables named {agent type}_{name}_{episode}.csv
+    rng = np.random.default_rng(seed)
+    data_path.mkdir(parents=True, exist_ok=True)
+    before, after, sides, columns = sample_edges(rows, cols, win_conn, num_games, rng)
+    write_transitions_csv(before, after, data_path / 'transitions.csv')
+    write_qtable_csv(before, after, sides, columns, cn.SIDE_A, data_path / 'SimpleQL_A_1.csv', rng)
+    write_qtable_csv(before, after, sides, columns, cn.SIDE_B, data_path / 'SimpleQL_B_1.csv', rng)
+    print('generated {} edges of a {}x{} board in {}'.format(len(before), rows, cols, data_path))
+    return len(before)
+
+
+def generate_logs(data_path: Path, num_log_rows: int, seed: int=0):
+
+    # the win rate log of a training in <A>_vs_<B> (independent of any board)
+    log_path = data_path / WIN_RATES_LOG_PATH
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    write_win_rates_csv(num_log_rows, log_path, np.random.default_rng(seed))
+    print('generated {} win rate log rows in {}'.format(num_log_rows, log_path))
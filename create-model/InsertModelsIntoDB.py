@@ -1,7 +1,16 @@
 
 from pathlib import Path
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-import sqlite3, sys
+import numpy as np
+import sqlite3, sys, os, re, time, resource, hashlib, tempfile
+
+# make the shared state hash codec of the plotting tools importable
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'plotting'))
+import state_codec as sc
+import binary_qtable as bq
+import instrumentation as ins
 
 
 # create AgentType dictionary
@@ -21,6 +30,149 @@ SQL_CREATE_SCHEMA = '''CREATE TABLE NwinsQtable(
     PRIMARY KEY (AgentType, HashBefore, Column)
 )'''
 
+# streaming import: load into an unkeyed table first, build the primary key index afterwards
+SQL_CREATE_UNKEYED_SCHEMA = '''CREATE TABLE NwinsQtable(
+    AgentType  INTEGER NOT NULL,
+    HashBefore CHAR(12) NOT NULL,
+    Column     INTEGER  NOT NULL,
+    QValue     DOUBLE   NOT NULL
+)'''
+SQL_CREATE_PRIMARY_INDEX = 'CREATE UNIQUE INDEX PK_NwinsQtable ON NwinsQtable (AgentType, HashBefore, Column)'
+SQL_INSERT_QTABLE = 'INSERT INTO NwinsQtable (AgentType, HashBefore, Column, QValue) VALUES (?, ?, ?, ?)'
+
+# import-time settings trading durability for speed (the database is rebuilt on failure anyway)
+SQL_IMPORT_PRAGMAS = [
+    'PRAGMA journal_mode = OFF',
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY'
+]
+
+# optimized layout: one clustered table per agent type holding only the best column of each state,
+# keyed by the raw hash bytes (as queried by QTableSQLite)
+SQL_CREATE_OPTIMIZED_SCHEMA = '''CREATE TABLE IF NOT EXISTS NwinsQtable_{}(
+    HashBefore BLOB    NOT NULL PRIMARY KEY,
+    Column     INTEGER NOT NULL,
+    QValue     DOUBLE  NOT NULL
+) WITHOUT ROWID'''
+SQL_INSERT_OPTIMIZED = 'INSERT INTO NwinsQtable_{} (HashBefore, Column, QValue) VALUES (?, ?, ?)'
+SQL_SELECT_OPTIMIZED = 'SELECT Column FROM NwinsQtable_{} WHERE HashBefore = ?'
+SQL_SELECT_LEGACY = 'SELECT Column FROM NwinsQtable WHERE AgentType = ? AND HashBefore = ? ORDER BY QValue DESC LIMIT 1'
+
+# compatibility view emulating the legacy NwinsQtable (Base64 text hashes) on top of the agent type tables;
+# SQLite has no Base64 function, so the hashes are encoded from their hex digits (boards up to 64 fields,
+# the limit of BitwiseGameState) and lookups by Base64 hash scan the tables instead of probing the keys
+BASE64_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+MAX_VIEW_HASH_BYTES = sc.num_hash_bytes(8, 8)
+
+
+def sql_base64(hex_column: str, length_column: str, max_bytes: int=MAX_VIEW_HASH_BYTES):
+
+    # encode each group of 3 bytes (6 hex digits) as 4 Base64 characters, digits beyond the end read as zeros
+    def digit(k): return "(instr('0123456789ABCDEF', substr({}, {}, 1)) - 1)".format(hex_column, k)
+    def char(sextet): return "substr('{}', {} + 1, 1)".format(BASE64_ALPHABET, sextet)
+    groups = []
+    for group in range((max_bytes + 2) // 3):
+        d = [digit(6 * group + k) for k in range(1, 7)]
+        sextets = [char('{} * 4 + {} / 4'.format(d[0], d[1])), char('{} % 4 * 16 + {}'.format(d[1], d[2])),
+            char('{} * 4 + {} / 4'.format(d[3], d[4])), char('{} % 4 * 16 + {}'.format(d[4], d[5]))]
+
+        # pad the last group with '=' characters (groups beyond the end are left out)
+        groups.append("CASE WHEN {0} > {1} THEN {3} || {4} || CASE WHEN {0} > {2} THEN {5} ELSE '=' END "
+            "|| CASE WHEN {0} > {6} THEN {7} ELSE '=' END ELSE '' END".format(
+            length_column, 3 * group, 3 * group + 1, sextets[0], sextets[1], sextets[2], 3 * group + 2, sextets[3]))
+    return ' || '.join(groups)
+
+
+SQL_DROP_COMPAT_VIEW = 'DROP VIEW IF EXISTS NwinsQtable'
+SQL_CREATE_COMPAT_VIEW = ('CREATE VIEW NwinsQtable (AgentType, HashBefore, Column, QValue) AS '
+    + 'SELECT AgentType, {}, Column, QValue FROM ('.format(sql_base64('HashHex', 'HashLength'))
+    + ' UNION ALL '.join('SELECT {0} AS AgentType, hex(HashBefore) AS HashHex, length(HashBefore) AS HashLength, '
+        'Column, QValue FROM NwinsQtable_{0}'.format(agent_type) for agent_type in agentTypes.values())
+    + ')')
+
+# parallel import: each worker writes the best actions of one model into its own shard database,
+# the shards are merged into the agent type tables afterwards (better Q value wins on conflicts)
+SQL_CREATE_SHARD_SCHEMA = '''CREATE TABLE Shard(
+    HashBefore BLOB    NOT NULL PRIMARY KEY,
+    Column     INTEGER NOT NULL,
+    QValue     DOUBLE  NOT NULL
+) WITHOUT ROWID'''
+SQL_INSERT_SHARD = 'INSERT INTO Shard (HashBefore, Column, QValue) VALUES (?, ?, ?)'
+SQL_MERGE_SHARD = '''INSERT INTO NwinsQtable_{0} (HashBefore, Column, QValue)
+    SELECT HashBefore, Column, QValue FROM shard.Shard WHERE true
+    ON CONFLICT (HashBefore) DO UPDATE SET Column = excluded.Column, QValue = excluded.QValue
+    WHERE excluded.QValue > NwinsQtable_{0}.QValue'''
+
+# incremental import: content hash of each imported model (slot) and the best action of each of its states;
+# the agent type tables hold the best action over all models of the type, recomputed for the touched states.
+# The import metadata lives in the sidecar database <outfile>.imports (attached as 'imports'), so the shipped
+# database keeps the size of the optimized layout
+IMPORTS_DB_SUFFIX = '.imports'
+SQL_ATTACH_IMPORTS = 'ATTACH DATABASE ? AS imports'
+SQL_CREATE_IMPORTS_SCHEMA = '''CREATE TABLE IF NOT EXISTS imports.NwinsModelImports(
+    ModelSlot   TEXT    NOT NULL PRIMARY KEY,
+    AgentType   INTEGER NOT NULL,
+    ModelFile   TEXT    NOT NULL,
+    ContentHash TEXT    NOT NULL,
+    NumStates   INTEGER NOT NULL,
+    ImportedAt  TEXT    NOT NULL
+)'''
+SQL_CREATE_MODEL_STATES_SCHEMA = '''CREATE TABLE IF NOT EXISTS imports.NwinsModelStates(
+    ModelSlot  TEXT    NOT NULL,
+    HashBefore BLOB    NOT NULL,
+    Column     INTEGER NOT NULL,
+    QValue     DOUBLE  NOT NULL,
+
+    PRIMARY KEY (ModelSlot, HashBefore)
+) WITHOUT ROWID'''
+SQL_CREATE_MODEL_STATES_INDEX = 'CREATE INDEX IF NOT EXISTS imports.IX_NwinsModelStates_HashBefore ON NwinsModelStates (HashBefore)'
+SQL_UPSERT_MODEL_STATE = '''INSERT INTO imports.NwinsModelStates (ModelSlot, HashBefore, Column, QValue) VALUES (?, ?, ?, ?)
+    ON CONFLICT (ModelSlot, HashBefore) DO UPDATE SET Column = excluded.Column, QValue = excluded.QValue'''
+SQL_DELETE_MODEL_STATE = 'DELETE FROM imports.NwinsModelStates WHERE ModelSlot = ? AND HashBefore = ?'
+SQL_SELECT_MODEL_STATES = 'SELECT HashBefore, Column, QValue FROM imports.NwinsModelStates WHERE ModelSlot = ?'
+SQL_CREATE_TOUCHED_SCHEMA = 'CREATE TEMP TABLE IF NOT EXISTS TouchedStates(HashBefore BLOB NOT NULL PRIMARY KEY) WITHOUT ROWID'
+SQL_CLEAR_TOUCHED = 'DELETE FROM temp.TouchedStates'
+SQL_INSERT_TOUCHED = 'INSERT OR IGNORE INTO temp.TouchedStates (HashBefore) VALUES (?)'
+SQL_DELETE_TOUCHED = 'DELETE FROM NwinsQtable_{} WHERE HashBefore IN (SELECT HashBefore FROM temp.TouchedStates)'
+# (SQLite takes the bare columns of a max() aggregate from the row with the max value)
+SQL_MERGE_TOUCHED = '''INSERT INTO NwinsQtable_{0} (HashBefore, Column, QValue)
+    SELECT States.HashBefore, States.Column, max(States.QValue) FROM imports.NwinsModelStates AS States
+    JOIN imports.NwinsModelImports AS Imports ON Imports.ModelSlot = States.ModelSlot
+    WHERE Imports.AgentType = {0} AND States.HashBefore IN (SELECT HashBefore FROM temp.TouchedStates)
+    GROUP BY States.HashBefore'''
+SQL_SELECT_IMPORT_HASH = 'SELECT ContentHash FROM imports.NwinsModelImports WHERE ModelSlot = ?'
+SQL_REPLACE_IMPORT = '''INSERT OR REPLACE INTO imports.NwinsModelImports
+    (ModelSlot, AgentType, ModelFile, ContentHash, NumStates, ImportedAt) VALUES (?, ?, ?, ?, ?, datetime('now'))'''
+
+# incremental updates run against a live database, so keep the rollback journal
+SQL_UPDATE_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -262144',
+    'PRAGMA temp_store = MEMORY'
+]
+
+QTABLE_CSV_HEADERS = ["HashBefore", "HashAfter", "ActingSide", "Column", "QValue"]
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def imports_db_filepath(db_filepath: str):
+    return db_filepath + IMPORTS_DB_SUFFIX
+
+
+def drop_model_objects(conn: sqlite3.Connection):
+
+    # drop all Q-table tables and views of both the legacy and the optimized layout
+    model_objects = conn.execute("SELECT type, name FROM sqlite_master "
+        + "WHERE type IN ('table', 'view') AND name LIKE 'Nwins%'").fetchall()
+    for object_type, name in model_objects:
+        conn.execute('DROP {} IF EXISTS {}'.format(object_type.upper(), name))
+    conn.commit()
+
+    # remove the incremental import metadata (invalid after a rebuild)
+    db_filepath = conn.execute('PRAGMA database_list').fetchone()[2]
+    if db_filepath and os.path.isfile(imports_db_filepath(db_filepath)): os.remove(imports_db_filepath(db_filepath))
+
 
 def create_db_from_models(db_filepath: str, csv_model_files: list):
 
@@ -31,7 +183,7 @@ def create_db_from_models(db_filepath: str, csv_model_files: list):
     cursor = conn.cursor()
 
     # drop WinsQtable.db table if it already exists
-    cursor.execute("DROP TABLE IF EXISTS nWinsQtable")
+    drop_model_objects(conn)
     print("Database cleanup performed........")
 
     # create the database schema
@@ -46,43 +198,436 @@ def create_db_from_models(db_filepath: str, csv_model_files: list):
     for model_csv in csv_model_files:
 
         # read dataframe from csv file
-        header_list = ["HashBefore", "HashAfter", "ActingSide", "Column", "QValue"]
-        qtable_df = pd.read_csv(model_csv, names=header_list)
+        with ins.phase("read csv"):
+            qtable_df = pd.read_csv(model_csv, names=QTABLE_CSV_HEADERS)
+            ins.add_rows(len(qtable_df))
 
         # drop HashAfter and ActingSide columns (not required, would just bloat the database)
         qtable_df = qtable_df.drop(columns=["HashAfter", "ActingSide"])
         print("Model read from csv")
 
         # add column with agent name
-        qtable_df["AgentType"] = agentTypes[model_csv.name.split('_')[0]]
+        qtable_df["AgentType"] = agentTypes[Path(model_csv).name.split('_')[0]]
 
-        # write only best actions in sql
-        qtable_df = qtable_df.sort_values("QValue", ascending=False).drop_duplicates(["AgentType", "HashBefore"])
-        qtable_df.to_sql('NwinsQtable', conn, if_exists='append', index=False)
+        # write only best actions in sql (group by packed integer state keys instead of hash strings)
+        with ins.phase("reduce best actions"):
+            state_keys = sc.hashes_to_keys(qtable_df["HashBefore"].to_numpy())
+            qtable_df = qtable_df.loc[qtable_df["QValue"].groupby(state_keys, sort=False).idxmax().values]
+        with ins.phase("insert rows"):
+            qtable_df.to_sql('NwinsQtable', conn, if_exists='append', index=False)
+            ins.add_rows(len(qtable_df))
         print("Model inserted into db")
 
     conn.close()
 
 
+def canonicalize_best_actions(best_actions: pd.DataFrame):
+
+    # map the states onto their canonical mirror images and remap the columns accordingly
+    if len(best_actions) == 0: return best_actions
+    state_keys, is_mirrored = sc.canonical_keys(best_actions["StateKey"].to_numpy())
+    columns = sc.mirror_columns(best_actions["Column"].to_numpy(), is_mirrored, sc.board_size(state_keys)[1])
+    best_actions = best_actions.assign(StateKey=state_keys, Column=columns)
+
+    # a state and its mirror image conflict on the same canonical state, the better Q value wins
+    return best_actions.loc[best_actions.groupby("StateKey", sort=False)["QValue"].idxmax().values]
+
+
+def reduce_best_actions(model_csv: str, chunk_size: int=DEFAULT_CHUNK_SIZE, canonical: bool=False):
+
+    # binary Q tables already store the best action of each state first (no parsing required)
+    if bq.is_binary_qtable(model_csv):
+        qtable = bq.BinaryQTable(model_csv)
+        state_keys, columns, q_values = qtable.policy()
+        best_actions = pd.DataFrame({"StateKey": state_keys, "Column": columns, "QValue": q_values})
+        if canonical: best_actions = canonicalize_best_actions(best_actions)
+        return best_actions, len(qtable.keys)
+
+    # stream the csv file in chunks, reduce each chunk to its best action per state
+    chunk_best_actions = []
+    num_rows = 0
+    chunks = pd.read_csv(model_csv, names=QTABLE_CSV_HEADERS, usecols=["HashBefore", "Column", "QValue"], chunksize=chunk_size)
+    for chunk in chunks:
+        num_rows += len(chunk)
+        chunk = pd.DataFrame({
+            "StateKey": sc.hashes_to_keys(chunk["HashBefore"].to_numpy()),
+            "Column": chunk["Column"].to_numpy(dtype=np.int64),
+            "QValue": chunk["QValue"].to_numpy(dtype=np.float64)
+        })
+        chunk = chunk.loc[chunk.groupby("StateKey", sort=False)["QValue"].idxmax().values]
+        chunk_best_actions.append(canonicalize_best_actions(chunk) if canonical else chunk)
+
+    # merge the chunk results (only states spanning several chunks occur more than once)
+    best_actions = pd.concat(chunk_best_actions, ignore_index=True)
+    best_actions = best_actions.loc[best_actions.groupby("StateKey", sort=False)["QValue"].idxmax().values]
+
+    return best_actions, num_rows
+
+
+def peak_memory_mib():
+    # the max resident set size is reported in KiB on Linux (children: largest worker process)
+    max_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return max_rss / 1024
+
+
+def create_db_from_models_streamed(db_filepath: str, csv_model_files: list, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    start_time = time.perf_counter()
+    rows_read = 0
+    rows_written = 0
+
+    # create SQLite database file (or just connect to it if it already exists)
+    conn = sqlite3.connect(db_filepath)
+    for pragma in SQL_IMPORT_PRAGMAS: conn.execute(pragma)
+
+    # recreate the table without primary key (the index is built after the load)
+    drop_model_objects(conn)
+    conn.execute(SQL_CREATE_UNKEYED_SCHEMA)
+    conn.commit()
+    print("Schema created successfully........")
+
+    # insert all models within a single transaction
+    with conn:
+        for model_csv in csv_model_files:
+
+            # reduce the model to its best actions without loading the whole csv file
+            with ins.phase("read csv"):
+                best_actions, num_rows = reduce_best_actions(model_csv, chunk_size)
+                ins.add_rows(num_rows)
+            print("Model read from csv")
+
+            # bulk insert the best actions
+            with ins.phase("insert rows"):
+                agent_type = agentTypes[Path(model_csv).name.split('_')[0]]
+                hashes = sc.keys_to_hashes(best_actions["StateKey"].to_numpy()).tolist()
+                columns = best_actions["Column"].tolist()
+                q_values = best_actions["QValue"].tolist()
+                conn.executemany(SQL_INSERT_QTABLE, zip(repeat(agent_type), hashes, columns, q_values))
+                ins.add_rows(len(best_actions))
+            print("Model inserted into db")
+
+            rows_read += num_rows
+            rows_written += len(best_actions)
+
+    # build the primary key index on the loaded data
+    with ins.phase("create index"), conn:
+        conn.execute(SQL_CREATE_PRIMARY_INDEX)
+    print("Primary key index created........")
+    conn.close()
+
+    # print import statistics
+    duration = time.perf_counter() - start_time
+    print("Imported {} csv rows ({} best actions) in {:.1f} s: {:.0f} rows/sec, peak memory {:.1f} MiB".format(
+        rows_read, rows_written, duration, rows_read / max(duration, 1e-9), peak_memory_mib()))
+
+
+def create_optimized_schema(conn: sqlite3.Connection):
+
+    # create the agent type tables (if they don't exist) and (re)create the compatibility view
+    with conn:
+        for agent_type in agentTypes.values():
+            conn.execute(SQL_CREATE_OPTIMIZED_SCHEMA.format(agent_type))
+        conn.execute(SQL_DROP_COMPAT_VIEW)
+        conn.execute(SQL_CREATE_COMPAT_VIEW)
+
+
+def create_optimized_db_from_models(db_filepath: str, csv_model_files: list, chunk_size: int=DEFAULT_CHUNK_SIZE, canonical: bool=False):
+
+    start_time = time.perf_counter()
+    rows_read = 0
+
+    # reduce all models to their best actions, grouped by agent type
+    best_actions_by_type = {}
+    for model_csv in csv_model_files:
+        with ins.phase("read csv"):
+            best_actions, num_rows = reduce_best_actions(model_csv, chunk_size, canonical)
+            ins.add_rows(num_rows)
+        agent_type = agentTypes[Path(model_csv).name.split('_')[0]]
+        best_actions_by_type.setdefault(agent_type, []).append(best_actions)
+        rows_read += num_rows
+        print("Model read from csv")
+
+    # create SQLite database file (or just connect to it if it already exists)
+    conn = sqlite3.connect(db_filepath)
+    for pragma in SQL_IMPORT_PRAGMAS: conn.execute(pragma)
+
+    # replace the existing tables with the optimized layout
+    drop_model_objects(conn)
+    create_optimized_schema(conn)
+    print("Schema created successfully........")
+
+    # insert the best actions of each agent type in key order (fastest for clustered tables)
+    rows_written = 0
+    with conn:
+        for agent_type, best_actions in best_actions_by_type.items():
+
+            # merge several models of the same agent type by their best Q value
+            with ins.phase("merge models"):
+                best_actions = pd.concat(best_actions, ignore_index=True)
+                best_actions = best_actions.loc[best_actions.groupby("StateKey", sort=True)["QValue"].idxmax().values]
+
+            with ins.phase("insert rows"):
+                blobs = sc.keys_to_blobs(best_actions["StateKey"].to_numpy())
+                rows = zip(blobs, best_actions["Column"].tolist(), best_actions["QValue"].tolist())
+                conn.executemany(SQL_INSERT_OPTIMIZED.format(agent_type), rows)
+                ins.add_rows(len(best_actions))
+            rows_written += len(best_actions)
+            print("Model inserted into db")
+
+    with ins.phase("vacuum"):
+        conn.execute("VACUUM")
+    conn.close()
+
+    # print import statistics
+    duration = time.perf_counter() - start_time
+    print("Imported {} csv rows ({} best actions) in {:.1f} s: {:.0f} rows/sec, peak memory {:.1f} MiB".format(
+        rows_read, rows_written, duration, rows_read / max(duration, 1e-9), peak_memory_mib()))
+
+
+def reduce_model_to_shard(model_csv: str, shard_filepath: str, chunk_size: int=DEFAULT_CHUNK_SIZE, canonical: bool=False):
+
+    # reduce the model to its best actions (runs in a worker process)
+    best_actions, num_rows = reduce_best_actions(model_csv, chunk_size, canonical)
+    best_actions = best_actions.sort_values("StateKey", kind="stable")
+
+    # write the best actions into the shard database in key order
+    conn = sqlite3.connect(shard_filepath)
+    for pragma in SQL_IMPORT_PRAGMAS: conn.execute(pragma)
+    with conn:
+        conn.execute(SQL_CREATE_SHARD_SCHEMA)
+        blobs = sc.keys_to_blobs(best_actions["StateKey"].to_numpy())
+        conn.executemany(SQL_INSERT_SHARD, zip(blobs, best_actions["Column"].tolist(), best_actions["QValue"].tolist()))
+    conn.close()
+
+    return num_rows, len(best_actions)
+
+
+def create_optimized_db_from_models_parallel(db_filepath: str, csv_model_files: list,
+        num_workers: int=os.cpu_count(), chunk_size: int=DEFAULT_CHUNK_SIZE, canonical: bool=False):
+
+    start_time = time.perf_counter()
+
+    # keep the shards next to the database, so the merge doesn't copy across file systems
+    db_dir = os.path.dirname(os.path.abspath(db_filepath))
+    with tempfile.TemporaryDirectory(dir=db_dir, prefix='.shards_') as shards_dir:
+
+        # reduce each model into its own shard using a process pool
+        shard_filepaths = [os.path.join(shards_dir, 'shard_{}.db'.format(i)) for i in range(len(csv_model_files))]
+        with ins.phase("reduce shards"), ProcessPoolExecutor(max_workers=num_workers) as pool:
+            shard_stats = list(pool.map(reduce_model_to_shard, csv_model_files, shard_filepaths, repeat(chunk_size), repeat(canonical)))
+            rows_read = sum(num_rows for num_rows, _ in shard_stats)
+            ins.add_rows(rows_read)
+        print("Models reduced into {} shards".format(len(shard_filepaths)))
+
+        # create SQLite database file (or just connect to it if it already exists)
+        conn = sqlite3.connect(db_filepath)
+        for pragma in SQL_IMPORT_PRAGMAS: conn.execute(pragma)
+
+        # replace the existing tables with the optimized layout
+        drop_model_objects(conn)
+        create_optimized_schema(conn)
+        print("Schema created successfully........")
+
+        # merge the shards in model order into the agent type tables
+        for model_csv, shard_filepath in zip(csv_model_files, shard_filepaths):
+            agent_type = agentTypes[Path(model_csv).name.split('_')[0]]
+            conn.execute("ATTACH DATABASE ? AS shard", (shard_filepath,))
+            with ins.phase("merge shards"), conn:
+                conn.execute(SQL_MERGE_SHARD.format(agent_type))
+            conn.execute("DETACH DATABASE shard")
+            print("Model inserted into db")
+
+        rows_written = sum(conn.execute('SELECT COUNT(*) FROM NwinsQtable_{}'.format(agent_type)).fetchone()[0]
+            for agent_type in agentTypes.values())
+        with ins.phase("vacuum"):
+            conn.execute("VACUUM")
+        conn.close()
+
+    # print import statistics
+    duration = time.perf_counter() - start_time
+    print("Imported {} csv rows ({} best actions) in {:.1f} s: {:.0f} rows/sec, peak memory {:.1f} MiB".format(
+        rows_read, rows_written, duration, rows_read / max(duration, 1e-9), peak_memory_mib()))
+
+
+def model_slot(model_csv: str):
+    # checkpoints of the same model are named {agent name}_{episode}.csv
+    return re.sub(r'_\d+$', '', Path(model_csv).stem)
+
+
+def file_content_hash(filepath: str, block_size: int=2**20, canonical: bool=False):
+
+    # hash the file content block by block (canonical imports differ from plain ones, so they are hashed differently)
+    content_hash = hashlib.sha256(b'canonical' if canonical else b'')
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            content_hash.update(block)
+    return content_hash.hexdigest()
+
+
+def update_db_from_models(db_filepath: str, csv_model_files: list, chunk_size: int=DEFAULT_CHUNK_SIZE, canonical: bool=False):
+
+    start_time = time.perf_counter()
+
+    # connect to the database and make sure that it uses the optimized layout
+    conn = sqlite3.connect(db_filepath)
+    for pragma in SQL_UPDATE_PRAGMAS: conn.execute(pragma)
+    tables = [name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if 'NwinsQtable' in tables: raise ValueError('Invalid database! Incremental imports require the optimized layout!')
+
+    # the best actions are merged from the stored states of all models, so the database must have been built incrementally
+    if not os.path.isfile(imports_db_filepath(db_filepath)) and any(conn.execute('SELECT 1 FROM {} LIMIT 1'.format(name)).fetchone() is not None
+            for name in tables if name.startswith('NwinsQtable_')):
+        raise ValueError('Invalid database! {} was not built by incremental imports, import all models with {} into a new database!'.format(db_filepath, ARG_INCREMENTAL))
+    create_optimized_schema(conn)
+    conn.execute(SQL_ATTACH_IMPORTS, (imports_db_filepath(db_filepath),))
+    with conn:
+        conn.execute(SQL_CREATE_IMPORTS_SCHEMA)
+        conn.execute(SQL_CREATE_MODEL_STATES_SCHEMA)
+        conn.execute(SQL_CREATE_MODEL_STATES_INDEX)
+    conn.execute(SQL_CREATE_TOUCHED_SCHEMA)
+
+    for model_csv in csv_model_files:
+
+        # skip models whose content was already imported
+        slot = model_slot(model_csv)
+        with ins.phase("hash model"):
+            content_hash = file_content_hash(model_csv, canonical=canonical)
+        imported = conn.execute(SQL_SELECT_IMPORT_HASH, (slot,)).fetchone()
+        if imported is not None and imported[0] == content_hash:
+            print("Model {} is unchanged, skipped".format(slot))
+            ins.count("skipped models")
+            continue
+
+        # reduce the model to its best actions
+        agent_type = agentTypes[Path(model_csv).name.split('_')[0]]
+        with ins.phase("read csv"):
+            best_actions, num_rows = reduce_best_actions(model_csv, chunk_size, canonical)
+            ins.add_rows(num_rows)
+        print("Model read from csv")
+
+        # compare the best actions with the ones of the model's previous import
+        # (the Q values count as well, they decide between the models of the same agent type)
+        with ins.phase("compare states"):
+            stored = conn.execute(SQL_SELECT_MODEL_STATES, (slot,)).fetchall()
+            stored = pd.DataFrame({
+                "StateKey": sc.blobs_to_keys([blob for blob, _, _ in stored]).astype(best_actions["StateKey"].dtype),
+                "StoredColumn": pd.array([column for _, column, _ in stored], dtype="Int64"),
+                "StoredQValue": np.array([q_value for _, _, q_value in stored], dtype=np.float64)
+            })
+            merged = best_actions.merge(stored, on="StateKey", how="outer", indicator=True)
+            is_changed = ((merged["Column"] != merged["StoredColumn"]).fillna(True).astype(bool)
+                | (merged["QValue"] != merged["StoredQValue"]))
+            changed = merged[(merged["_merge"] != "right_only") & is_changed]
+            removed = merged[merged["_merge"] == "right_only"]
+
+        # update the model's states, then recompute the best action over all models of the agent type
+        # for the touched states (states no model provides anymore are removed)
+        changed_blobs = sc.keys_to_blobs(changed["StateKey"].to_numpy())
+        removed_blobs = sc.keys_to_blobs(removed["StateKey"].to_numpy())
+        with ins.phase("upsert rows"), conn:
+            ins.add_rows(len(changed) + len(removed))
+            conn.execute(SQL_REPLACE_IMPORT, (slot, agent_type, str(model_csv), content_hash, len(best_actions)))
+            conn.executemany(SQL_UPSERT_MODEL_STATE,
+                zip(repeat(slot), changed_blobs, changed["Column"].astype(np.int64).tolist(), changed["QValue"].tolist()))
+            conn.executemany(SQL_DELETE_MODEL_STATE, zip(repeat(slot), removed_blobs))
+            conn.execute(SQL_CLEAR_TOUCHED)
+            conn.executemany(SQL_INSERT_TOUCHED, ((blob,) for blob in changed_blobs + removed_blobs))
+            conn.execute(SQL_DELETE_TOUCHED.format(agent_type))
+            conn.execute(SQL_MERGE_TOUCHED.format(agent_type))
+
+        print("Model {} updated: {} of {} states changed, {} states removed".format(
+            slot, len(changed), len(best_actions), len(removed)))
+
+    conn.close()
+    print("Incremental import finished in {:.1f} s, peak memory {:.1f} MiB".format(
+        time.perf_counter() - start_time, peak_memory_mib()))
+
+
+def measure_lookups(conn: sqlite3.Connection, queries: list):
+
+    # run each (sql, params) lookup once and record its latency in microseconds
+    latencies = []
+    for sql, params in queries:
+        start_time = time.perf_counter()
+        conn.execute(sql, params).fetchone()
+        latencies.append((time.perf_counter() - start_time) * 1e6)
+    return np.array(latencies)
+
+
+def report_layouts(legacy_db_filepath: str, optimized_db_filepath: str, num_lookups: int=10000):
+
+    # sample random states from the optimized tables
+    legacy_conn = sqlite3.connect(legacy_db_filepath)
+    optimized_conn = sqlite3.connect(optimized_db_filepath)
+    samples = []
+    for agent_type in agentTypes.values():
+        samples += [(agent_type, blob) for (blob,) in optimized_conn.execute(
+            'SELECT HashBefore FROM NwinsQtable_{} ORDER BY random() LIMIT ?'.format(agent_type), (num_lookups,))]
+    samples = [samples[i] for i in np.random.permutation(len(samples))[:num_lookups]]
+    if len(samples) == 0: raise ValueError('Cannot report on an empty model database!')
+
+    # look up the same states in both layouts
+    hashes = sc.keys_to_hashes(sc.blobs_to_keys([blob for _, blob in samples])).tolist()
+    legacy_latencies = measure_lookups(legacy_conn, [(SQL_SELECT_LEGACY, (agent_type, hash))
+        for (agent_type, _), hash in zip(samples, hashes)])
+    optimized_latencies = measure_lookups(optimized_conn, [(SQL_SELECT_OPTIMIZED.format(agent_type), (blob,))
+        for agent_type, blob in samples])
+    legacy_conn.close()
+    optimized_conn.close()
+
+    # print DB size and lookup latency of both layouts
+    print("layout     db size [MiB]  mean [us]  p50 [us]  p99 [us]")
+    for layout, db_filepath, latencies in [("legacy", legacy_db_filepath, legacy_latencies),
+            ("optimized", optimized_db_filepath, optimized_latencies)]:
+        print("{:<10} {:>13.2f}  {:>9.1f}  {:>8.1f}  {:>8.1f}".format(layout, os.path.getsize(db_filepath) / 2**20,
+            latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 99)))
+
+
 # define script args
 ARG_OUTFILE = '--outfile'
 ARG_CSV_MODELS = '--csv-models'
+ARG_STREAM = '--stream'
+ARG_LEGACY_LAYOUT = '--legacy-layout'
+ARG_REPORT = '--report'
+ARG_INCREMENTAL = '--incremental'
+ARG_JOBS = '--jobs'
+ARG_CANONICAL = '--canonical'
 ARG_HELP = '--help'
-ALL_ARG_SPECIFIERS = [ARG_OUTFILE, ARG_CSV_MODELS, ARG_HELP]
-USAGE_MESSAGE =
-'''
+ALL_ARG_SPECIFIERS = [ARG_OUTFILE, ARG_CSV_MODELS, ARG_STREAM, ARG_LEGACY_LAYOUT, ARG_REPORT, ARG_INCREMENTAL, ARG_JOBS, ARG_CANONICAL, ARG_HELP]
+USAGE_MESSAGE = '''
 SCRIPT USAGE:
 ================
 options:
   {}: the target SQLite database file
-  {}: the trained CSV models to be written to the database (as list, separated by white spaces)
-'''.format(ARG_OUTFILE, ARG_CSV_MODELS)
+  {}: the trained CSV models (or binary .nwq models) to be written to the database (as list, separated by white spaces)
+  {}: import the CSV models chunk by chunk (for models exceeding the available memory, always done by the optimized layout)
+  {}: write the single NwinsQtable table instead of the optimized per-agent-type tables
+  {}: compare DB size and lookup latency of the legacy and the optimized layout (requires the optimized layout)
+  {}: only import new or changed models and only upsert states whose best column changed (keeps the import metadata in <outfile>.imports)
+  {}: the amount of worker processes importing the models in parallel (defaults to the CPU count)
+  {}: only store one state of each pair of mirror images (QTableSQLite mirrors the lookups back)
+  {}: write the JSON run report (phase timings, row counts, peak memory) to the given file
+  {}: additionally capture a cProfile profile and the top tracemalloc allocation sites
+'''.format(ARG_OUTFILE, ARG_CSV_MODELS, ARG_STREAM, ARG_LEGACY_LAYOUT, ARG_REPORT, ARG_INCREMENTAL, ARG_JOBS, ARG_CANONICAL,
+    ins.ARG_RUN_REPORT, ins.ARG_PROFILE)
+
+
+def get_arg_values(arg: str):
+
+    # collect all script arguments following the given option (until the next option)
+    values = []
+    for value in sys.argv[sys.argv.index(arg) + 1:]:
+        if value in ALL_ARG_SPECIFIERS: break
+        values.append(value)
+    return values
 
 
 def main():
 
     # print usage info if --help option appears
-    if ARG_HELP in sys.argv: print(USAGE_MESSAGE)
+    if ARG_HELP in sys.argv:
+        print(USAGE_MESSAGE)
+        return
 
     # validate script arguments
     if len(sys.argv) < 5: raise ValueError('Invalid arguments! Insufficient script arguments specified! Use --help option for more information!')
@@ -90,17 +635,41 @@ def main():
     if ARG_CSV_MODELS not in sys.argv: raise ValueError('Invalid arguments! Script argument {} is missing!'.format(ARG_CSV_MODELS))
 
     # parse script arguments
-    sqlite_filepath = sys.argv[sys.argv.index(ARG_OUTFILE) + 1]
-    csv_filepaths = []
-    first_csv_model = sys.argv.index(ARG_CSV_MODELS) + 1
-    for i in range(first_csv_model, len(sys.argv)):
-        if sys.argv[i] not in ALL_ARG_SPECIFIERS: csv_filepaths.append(sys.argv[i])
+    outfile_values = get_arg_values(ARG_OUTFILE)
+    if len(outfile_values) != 1: raise ValueError('Invalid arguments! Script argument {} expects exactly one file!'.format(ARG_OUTFILE))
+    sqlite_filepath = outfile_values[0]
+    csv_filepaths = get_arg_values(ARG_CSV_MODELS)
+    if len(csv_filepaths) == 0: raise ValueError('Invalid arguments! Script argument {} expects at least one file!'.format(ARG_CSV_MODELS))
+    for csv_filepath in csv_filepaths:
+        if not os.path.isfile(csv_filepath): raise ValueError('Invalid arguments! CSV model {} could not be found!'.format(csv_filepath))
+    jobs_values = get_arg_values(ARG_JOBS) if ARG_JOBS in sys.argv else [str(os.cpu_count())]
+    if len(jobs_values) != 1 or not jobs_values[0].isdigit() or int(jobs_values[0]) < 1:
+        raise ValueError('Invalid arguments! Script argument {} expects exactly one positive worker count!'.format(ARG_JOBS))
+    num_workers = int(jobs_values[0])
+    canonical = ARG_CANONICAL in sys.argv
+    if canonical and ARG_LEGACY_LAYOUT in sys.argv: raise ValueError('Invalid arguments! {} requires the optimized layout!'.format(ARG_CANONICAL))
+    if ARG_REPORT in sys.argv and ARG_LEGACY_LAYOUT in sys.argv: raise ValueError('Invalid arguments! {} requires the optimized layout!'.format(ARG_REPORT))
 
     # create a SQLite database from trained Q-table CSV files
-    model_path = Path(Path().cwd().parents[0] / 'src' / 'nWins.Game' / 'model' / 'NwinsQtable.db')
-    csv_models_pattern = Path('models')
-    create_db_from_models(model_path, csv_models_pattern)
+    # (the optimized imports always read the CSV models chunk by chunk, so they accept the stream option as well)
+    if ARG_LEGACY_LAYOUT in sys.argv:
+        import_models = create_db_from_models_streamed if ARG_STREAM in sys.argv else create_db_from_models
+        import_models(sqlite_filepath, csv_filepaths)
+    elif ARG_INCREMENTAL in sys.argv:
+        update_db_from_models(sqlite_filepath, csv_filepaths, canonical=canonical)
+    elif num_workers > 1 and len(csv_filepaths) > 1:
+        create_optimized_db_from_models_parallel(sqlite_filepath, csv_filepaths, num_workers, canonical=canonical)
+    else:
+        create_optimized_db_from_models(sqlite_filepath, csv_filepaths, canonical=canonical)
+
+    # build the legacy layout for comparison (removed after the report)
+    if ARG_REPORT in sys.argv:
+        legacy_filepath = sqlite_filepath + '.legacy'
+        create_db_from_models_streamed(legacy_filepath, csv_filepaths)
+        report_layouts(legacy_filepath, sqlite_filepath)
+        os.remove(legacy_filepath)
 
 
 if __name__=='__main__':
-    main()
+    with ins.instrumented_run('InsertModelsIntoDB'):
+        main()
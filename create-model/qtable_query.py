@@ -0,0 +1,374 @@
+from pathlib import Path
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+import numpy as np
+import sqlite3, sys, os, time, json, queue, threading, base64, signal
+
+# make the shared state hash codec of the plotting tools importable
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'plotting'))
+import state_codec as sc
+from InsertModelsIntoDB import agentTypes
+import instrumentation as ins
+
+
+# Best move queries over the databases written by InsertModelsIntoDB.py (both layouts). The lookups
+# run on a pool of read-only connections. Each batch of states is resolved with a few IN queries whose
+# parameter counts are padded to powers of two, so sqlite3's statement cache re-uses a handful of
+# prepared statements. Canonical databases only store one state of each pair of mirror images,
+# so the missing states are looked up mirrored (like QTableSQLite.GetBestColumn does).
+
+SQL_SELECT_OPTIMIZED_BATCH = 'SELECT HashBefore, Column FROM NwinsQtable_{} WHERE HashBefore IN ({})'
+SQL_SELECT_LEGACY_BATCH = 'SELECT HashBefore, Column, QValue FROM NwinsQtable WHERE AgentType = ? AND HashBefore IN ({})'
+SQL_QUERY_PRAGMAS = [
+    'PRAGMA query_only = ON',
+    'PRAGMA mmap_size = 268435456'
+]
+MAX_BATCH_SIZE = 512
+DEFAULT_POOL_SIZE = 4
+DEFAULT_CACHE_SIZE = 100000
+LATENCY_WINDOW = 10000
+DEFAULT_PORT = 8765
+
+
+class LruCache(object):
+
+    def __init__(self, capacity: int=DEFAULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get_many(self, keys: list):
+
+        # return the cached values (None if missing), marking the found ones as recently used
+        values = []
+        with self.lock:
+            for key in keys:
+                value = self.entries.get(key)
+                if value is not None: self.entries.move_to_end(key)
+                values.append(value)
+        return values
+
+
+    def put_many(self, items: list):
+
+        # insert the values, evicting the least recently used entries beyond the capacity
+        if self.capacity <= 0: return
+        with self.lock:
+            for key, value in items:
+                self.entries[key] = value
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity: self.entries.popitem(last=False)
+
+
+class QueryStats(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.lookups = 0
+        self.hits = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+
+    def record(self, num_lookups: int, num_hits: int, latency: float):
+        with self.lock:
+            self.requests += 1
+            self.lookups += num_lookups
+            self.hits += num_hits
+            self.latencies.append(latency)
+
+
+    def report(self):
+
+        # latencies of the most recent requests in microseconds
+        with self.lock:
+            latencies = np.array(self.latencies) * 1e6
+            return {
+                'requests': self.requests,
+                'lookups': self.lookups,
+                'cache_hit_rate': self.hits / self.lookups if self.lookups > 0 else 0.0,
+                'p50_us': float(np.percentile(latencies, 50)) if len(latencies) > 0 else 0.0,
+                'p99_us': float(np.percentile(latencies, 99)) if len(latencies) > 0 else 0.0
+            }
+
+
+def decode_hashes(hashes: list):
+
+    # decode the Base64 hashes, checking their length against the board size in their header bytes
+    blobs = []
+    for hash in hashes:
+        if not isinstance(hash, str): raise ValueError('Invalid arguments! State hash {!r} is not a string!'.format(hash))
+        try:
+            blob = base64.b64decode(hash, validate=True)
+        except ValueError:
+            raise ValueError('Invalid arguments! State hash {} is not valid Base64!'.format(hash))
+        if len(blob) < 2 or blob[0] * blob[1] == 0 or len(blob) != sc.num_hash_bytes(blob[0], blob[1]):
+            raise ValueError('Invalid arguments! State hash {} does not match the board size in its header!'.format(hash))
+        blobs.append(blob)
+    return blobs
+
+
+def padded_size(num_params: int):
+    # round the parameter count up to a power of two (only a few distinct statements get prepared)
+    return min(1 << max(num_params - 1, 0).bit_length(), MAX_BATCH_SIZE)
+
+
+class QTableQuery(object):
+
+    def __init__(self, db_filepath: str, pool_size: int=DEFAULT_POOL_SIZE, cache_size: int=DEFAULT_CACHE_SIZE):
+
+        # open a pool of read-only connections (usable from any thread, but only by one at a time)
+        if not os.path.isfile(db_filepath): raise ValueError('Invalid arguments! Database {} could not be found!'.format(db_filepath))
+        self.db_filepath = db_filepath
+        self.pool = queue.Queue()
+        for _ in range(max(pool_size, 1)):
+            conn = sqlite3.connect('file:{}?mode=ro'.format(Path(db_filepath).resolve()), uri=True,
+                check_same_thread=False, cached_statements=64)
+            for pragma in SQL_QUERY_PRAGMAS: conn.execute(pragma)
+            self.pool.put(conn)
+
+        # the legacy layout stores all actions in a single NwinsQtable table (the optimized one only has a view)
+        with self.connection() as conn:
+            legacy_tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'NwinsQtable'").fetchall()
+        self.is_legacy = len(legacy_tables) > 0
+        self.cache = LruCache(cache_size)
+        self.stats = QueryStats()
+        print('opened {} database {} with {} connections'.format('legacy' if self.is_legacy else 'optimized', db_filepath, pool_size))
+
+
+    def connection(self):
+        return PooledConnection(self.pool)
+
+
+    def close(self):
+        while not self.pool.empty(): self.pool.get().close()
+
+
+    def query_batches(self, conn: sqlite3.Connection, agent_type: int, params: list):
+
+        # run the IN queries batch by batch (padding the parameters by repeating the last one)
+        for start in range(0, len(params), MAX_BATCH_SIZE):
+            batch = params[start:start + MAX_BATCH_SIZE]
+            size = padded_size(len(batch))
+            batch = batch + [batch[-1]] * (size - len(batch))
+            placeholders = ', '.join(['?'] * size)
+            if self.is_legacy:
+                yield from conn.execute(SQL_SELECT_LEGACY_BATCH.format(placeholders), [agent_type] + batch)
+            else:
+                yield from conn.execute(SQL_SELECT_OPTIMIZED_BATCH.format(agent_type, placeholders), batch)
+
+
+    def query_best_columns(self, conn: sqlite3.Connection, agent_type: int, hashes: list):
+
+        # reject malformed hashes before querying (only valid states get cached)
+        blobs = decode_hashes(hashes)
+
+        # the legacy layout is keyed by hash strings and holds all actions (the best Q value wins)
+        if self.is_legacy:
+            best = {}
+            for hash, column, q_value in self.query_batches(conn, agent_type, hashes):
+                if hash not in best or q_value > best[hash][1]: best[hash] = (column, q_value)
+            return [best[hash][0] if hash in best else -1 for hash in hashes]
+
+        # the optimized layout is keyed by the raw hash bytes and only holds the best column
+        found = dict(self.query_batches(conn, agent_type, blobs))
+        columns = [found.get(blob, -1) for blob in blobs]
+
+        # look up the missing states mirrored and mirror their columns back
+        # (grouped by board size, the codec reads the board size of all keys from the first one)
+        missing_by_size = {}
+        for i, column in enumerate(columns):
+            if column < 0: missing_by_size.setdefault(blobs[i][:2], []).append(i)
+        for missing in missing_by_size.values():
+            keys = sc.blobs_to_keys([blobs[i] for i in missing])
+            mirrored_blobs = sc.keys_to_blobs(sc.mirror_keys(keys))
+            found = dict(self.query_batches(conn, agent_type, mirrored_blobs))
+            mirrored_columns = [found.get(blob, -1) for blob in mirrored_blobs]
+            for i, column in zip(missing, sc.mirror_columns(mirrored_columns, True, sc.board_size(keys)[1]).tolist()):
+                columns[i] = column
+        return columns
+
+
+    def best_columns(self, agent_type, hashes: list):
+
+        # resolve agent type names (e.g. SimpleQL) to their ids
+        start_time = time.perf_counter()
+        agent_type = agentTypes[agent_type] if agent_type in agentTypes else int(agent_type)
+        if agent_type not in agentTypes.values(): raise ValueError('Invalid arguments! Unknown agent type {}!'.format(agent_type))
+
+        # serve the cached states, query the other ones (each distinct state only once)
+        cache_keys = [(agent_type, hash) for hash in hashes]
+        columns = self.cache.get_many(cache_keys)
+        num_hits = sum(1 for column in columns if column is not None)
+        missing = list(dict.fromkeys(hash for hash, column in zip(hashes, columns) if column is None))
+        if len(missing) > 0:
+            with self.connection() as conn:
+                queried = dict(zip(missing, self.query_best_columns(conn, agent_type, missing)))
+            self.cache.put_many([((agent_type, hash), column) for hash, column in queried.items()])
+            columns = [queried[hash] if column is None else column for hash, column in zip(hashes, columns)]
+
+        self.stats.record(len(hashes), num_hits, time.perf_counter() - start_time)
+        return columns
+
+
+class PooledConnection(object):
+
+    def __init__(self, pool: queue.Queue):
+        self.pool = pool
+
+
+    def __enter__(self):
+        # wait for a free connection of the pool
+        self.conn = self.pool.get()
+        return self.conn
+
+
+    def __exit__(self, *exc_info):
+        self.pool.put(self.conn)
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+
+    # the query service is shared by all handler instances of the server
+    def send_json(self, status: int, content: dict):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def do_GET(self):
+
+        # GET /stats: cache hit rate and latency percentiles
+        if self.path == '/stats': self.send_json(200, self.server.query.stats.report())
+        else: self.send_json(404, {'error': 'unknown endpoint {}'.format(self.path)})
+
+
+    def do_POST(self):
+
+        # POST /best-columns with {"agent_type": <id or name>, "states": [<hash>, ...]}
+        if self.path != '/best-columns':
+            self.send_json(404, {'error': 'unknown endpoint {}'.format(self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            columns = self.server.query.best_columns(request['agent_type'], list(request['states']))
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {'error': str(error)})
+            return
+        self.send_json(200, {'columns': columns})
+
+
+    def log_message(self, format, *args):
+        # don't log every request (Unix socket clients don't even have an address)
+        pass
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(query: QTableQuery, port: int=DEFAULT_PORT, socket_path: str=None):
+
+    # serve on a Unix socket if specified, otherwise on a local TCP port
+    if socket_path is not None:
+        if os.path.exists(socket_path): os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, QueryRequestHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', port), QueryRequestHandler)
+        address = 'http://127.0.0.1:{}'.format(port)
+    server.query = query
+
+    # stop gracefully on SIGTERM as well (e.g. 'docker stop')
+    def handle_sigterm(signum, frame): raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    print('serving best columns on {} (POST /best-columns, GET /stats)'.format(address))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path is not None and os.path.exists(socket_path): os.remove(socket_path)
+        print('stopped serving, stats: {}'.format(query.stats.report()))
+
+
+# define script args
+ARG_DB = '--db'
+ARG_SERVE = '--serve'
+ARG_PORT = '--port'
+ARG_SOCKET = '--socket'
+ARG_QUERY = '--query'
+ARG_AGENT_TYPE = '--agent-type'
+ARG_POOL = '--pool'
+ARG_CACHE = '--cache'
+ARG_HELP = '--help'
+ALL_ARG_SPECIFIERS = [ARG_DB, ARG_SERVE, ARG_PORT, ARG_SOCKET, ARG_QUERY, ARG_AGENT_TYPE, ARG_POOL, ARG_CACHE, ARG_HELP]
+USAGE_MESSAGE = '''
+SCRIPT USAGE:
+================
+options:
+  {}: the SQLite database written by InsertModelsIntoDB.py
+  {}: run the batch query service (POST /best-columns, GET /stats)
+  {}: the local TCP port of the service (defaults to {})
+  {}: serve on the given Unix socket instead of a TCP port
+  {}: print the best columns of the given state hashes (as list, separated by white spaces)
+  {}: the agent type of the queried states (id or name, e.g. SimpleQL)
+  {}: the amount of pooled read-only connections (defaults to {})
+  {}: the capacity of the LRU cache in states (defaults to {})
+'''.format(ARG_DB, ARG_SERVE, ARG_PORT, DEFAULT_PORT, ARG_SOCKET, ARG_QUERY, ARG_AGENT_TYPE,
+    ARG_POOL, DEFAULT_POOL_SIZE, ARG_CACHE, DEFAULT_CACHE_SIZE)
+
+
+def get_arg_values(arg: str):
+
+    # collect all script arguments following the given option (until the next option)
+    values = []
+    for value in sys.argv[sys.argv.index(arg) + 1:]:
+        if value in ALL_ARG_SPECIFIERS: break
+        values.append(value)
+    return values
+
+
+def main():
+
+    # print usage info if --help option appears
+    if ARG_HELP in sys.argv:
+        print(USAGE_MESSAGE)
+        return
+
+    # validate script arguments
+    if ARG_DB not in sys.argv or len(get_arg_values(ARG_DB)) != 1:
+        raise ValueError('Invalid arguments! Script argument {} expects exactly one file!'.format(ARG_DB))
+    if ARG_SERVE not in sys.argv and ARG_QUERY not in sys.argv:
+        raise ValueError('Invalid arguments! Either {} or {} is required! Use --help option for more information!'.format(ARG_SERVE, ARG_QUERY))
+
+    # parse script arguments
+    pool_size = int(get_arg_values(ARG_POOL)[0]) if ARG_POOL in sys.argv else DEFAULT_POOL_SIZE
+    cache_size = int(get_arg_values(ARG_CACHE)[0]) if ARG_CACHE in sys.argv else DEFAULT_CACHE_SIZE
+    query = QTableQuery(get_arg_values(ARG_DB)[0], pool_size, cache_size)
+
+    # print the best columns of the given states
+    if ARG_QUERY in sys.argv:
+        if ARG_AGENT_TYPE not in sys.argv: raise ValueError('Invalid arguments! Script argument {} is missing!'.format(ARG_AGENT_TYPE))
+        hashes = get_arg_values(ARG_QUERY)
+        for hash, column in zip(hashes, query.best_columns(get_arg_values(ARG_AGENT_TYPE)[0], hashes)):
+            print('{},{}'.format(hash, column))
+
+    # run the query service until it gets interrupted
+    if ARG_SERVE in sys.argv:
+        port = int(get_arg_values(ARG_PORT)[0]) if ARG_PORT in sys.argv else DEFAULT_PORT
+        socket_path = get_arg_values(ARG_SOCKET)[0] if ARG_SOCKET in sys.argv else None
+        serve(query, port, socket_path)
+    query.close()
+
+
+if __name__=='__main__':
+    with ins.instrumented_run('qtable_query'):
+        main()
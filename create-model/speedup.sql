@@ -1,9 +1,13 @@
 
+-- legacy speedup for databases written with InsertModelsIntoDB.py --legacy-layout
+-- (the default optimized layout already contains the NwinsQtable_{agentType} tables);
+-- the speedup tables keep the Base64 hashes, QTableSQLite detects them and binds the hashes as text
+
 -- drop speedup tables if they already exist
-DROP TABLE IF EXISTS NwinsQtable_1
-DROP TABLE IF EXISTS NwinsQtable_2
-DROP TABLE IF EXISTS NwinsQtable_3
-DROP TABLE IF EXISTS NwinsQtable_4
+DROP TABLE IF EXISTS NwinsQtable_1;
+DROP TABLE IF EXISTS NwinsQtable_2;
+DROP TABLE IF EXISTS NwinsQtable_3;
+DROP TABLE IF EXISTS NwinsQtable_4;
 
 -- create speedup tables (split Q-table entries by agent type)
 CREATE TABLE NwinsQtable_1 AS
@@ -0,0 +1,350 @@
+from datetime import datetime, timezone
+from pathlib import Path
+import itertools, json, os, random, shutil, signal, subprocess, sys, time
+
+# make the win rate tail of the plotting tools importable
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'plotting'))
+from winrate_tail import RunTail
+
+
+# Hyperparameter sweeps: a sweep file (JSON) names a base settings file and a grid of values, e.g.
+#   {
+#       "base_settings": "../experiment_06/settings/01_sl_lambda_80.json",
+#       "grid": {"lambda": [0.8, 0.9, 0.95], "alpha": [0.01, 0.1], "agent_a.params.decay_episodes": [0, 100000]},
+#       "budget": {"wall_seconds": 7200, "episodes": 20000000},
+#       "cores_per_run": 1,
+#       "command": ["dotnet", "/app/bin/nWins.Training.dll", "--settings", "{settings}"]
+#   }
+# Grid keys are dotted paths into the settings (e.g. agent_a.params.alpha); a plain key names a top-level
+# setting (training_interval) or the agent param of all trainable agents (alpha, gamma, lambda, start_epsilon,
+# min_epsilon, decay_episodes). The directory of the sweep file becomes the experiment: each grid point
+# gets its settings file in settings/ and trains into train/logs and train/models (via SETTINGS_ROOT,
+# LOGS_ROOT and MODELS_ROOT), so the plotters pick the runs up like any other experiment. The agents
+# are renamed to {type}_{label}_Side{A|B} to keep the runs apart. The console output is written to
+# train/logs/log_<label>_<YYYY-mm-dd_HH-MM-SS>.txt (like entrypoint.sh) for training_log_parser.py.
+# The runs are queued onto worker slots of cores_per_run CPU cores each (pinned with sched_setaffinity).
+# The trainer never stops by itself, so each run is stopped (SIGTERM, the trainer stores its final models)
+# when it exceeds its wall-clock or episode budget; the episodes are read from its win_rates.csv, so the
+# episode budget is checked once per training interval. The progress is kept in train/sweep_state.json:
+# a restarted sweep skips the finished runs and starts the interrupted ones over.
+
+DEFAULT_POLL_INTERVAL = 5.0
+DEFAULT_GRACE_SECONDS = 30.0
+DEFAULT_CORES_PER_RUN = 1
+STATE_FILE_NAME = 'sweep_state.json'
+LOG_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+SIDES = {'agent_a': 'SideA', 'agent_b': 'SideB'}
+STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED = 'pending', 'running', 'done', 'failed'
+
+ARG_JOBS = '--jobs'
+ARG_POLL = '--poll'
+ARG_GRACE = '--grace'
+ARG_DRY_RUN = '--dry-run'
+ARG_RETRY_FAILED = '--retry-failed'
+ARG_STUB_TRAINER = '--stub-trainer'
+ARG_EPOCH_SECONDS = '--epoch-seconds'
+ALL_ARG_SPECIFIERS = [ARG_JOBS, ARG_POLL, ARG_GRACE, ARG_EPOCH_SECONDS]
+
+
+def resolve_grid_paths(settings: dict, key: str):
+
+    # dotted paths address one setting, plain keys a top-level setting or the param of all trainable agents
+    if '.' in key: paths = [key.split('.')]
+    elif key in settings: paths = [[key]]
+    else: paths = [[side, 'params', key] for side in SIDES if settings[side].get('trainable', False)]
+
+    # only existing settings may be swept (catches typos before hours of training)
+    for path in paths:
+        node = settings
+        for name in path[:-1]: node = node.get(name, {}) if isinstance(node, dict) else {}
+        if not isinstance(node, dict) or path[-1] not in node:
+            raise ValueError('Invalid sweep! The grid key {} doesn\'t match the setting {}!'.format(key, '.'.join(path)))
+    if len(paths) == 0: raise ValueError('Invalid sweep! The grid key {} doesn\'t match any trainable agent\'s params!'.format(key))
+    return paths
+
+
+def run_label(grid_point: dict):
+    # e.g. lambda0.9-alpha0.01 (no underscores, they separate the parts of the agent names)
+    return '-'.join('{}{}'.format(key.split('.')[-1], value) for key, value in grid_point.items()).replace('_', '')
+
+
+def expand_grid(base_settings: dict, grid: dict):
+
+    # one settings dict per combination of the grid values (in the order of the grid keys)
+    paths = {key: resolve_grid_paths(base_settings, key) for key in grid}
+    runs = []
+    for values in itertools.product(*grid.values()):
+        grid_point = dict(zip(grid.keys(), values))
+        settings = json.loads(json.dumps(base_settings))
+        for key, value in grid_point.items():
+            for path in paths[key]:
+                node = settings
+                for name in path[:-1]: node = node[name]
+                node[path[-1]] = value
+
+        # give the agents of each run their own names (log and model directories are named after them)
+        label = run_label(grid_point)
+        for side, side_name in SIDES.items():
+            settings[side]['name'] = '{}_{}_{}'.format(settings[side]['type'], label, side_name)
+        runs.append((label, grid_point, settings))
+
+    if len(set(label for label, _, _ in runs)) != len(runs): raise ValueError('Invalid sweep! The grid contains duplicate values!')
+    return runs
+
+
+class Sweep(object):
+
+    def __init__(self, sweep_path: Path):
+
+        # load the sweep and the base settings (relative paths start at the sweep file)
+        self.path = sweep_path.resolve().parent
+        with open(sweep_path, 'r') as file:
+            spec = json.load(file)
+        with open(self.path / spec['base_settings'], 'r') as file:
+            base_settings = json.load(file)
+
+        self.budget = spec.get('budget', {})
+        if self.budget.get('wall_seconds') is None and self.budget.get('episodes') is None:
+            raise ValueError('Invalid sweep! The trainer runs until it is stopped, specify a wall_seconds or episodes budget!')
+        self.cores_per_run = int(spec.get('cores_per_run', DEFAULT_CORES_PER_RUN))
+        self.command = spec.get('command', ['dotnet', 'nWins.Training.dll', '--settings', '{settings}'])
+        self.runs = expand_grid(base_settings, spec['grid'])
+
+        # lay the sweep out like an experiment
+        self.settings_path = self.path / 'settings'
+        self.logs_path = self.path / 'train' / 'logs'
+        self.models_path = self.path / 'train' / 'models'
+        self.state_path = self.path / 'train' / STATE_FILE_NAME
+
+
+    def write_settings(self):
+        self.settings_path.mkdir(parents=True, exist_ok=True)
+        for label, _, settings in self.runs:
+            with open(self.settings_path / (label + '.json'), 'w') as file:
+                json.dump(settings, file, indent=4)
+
+
+    def load_state(self, retry_failed: bool=False):
+
+        # resume the previous progress (interrupted runs start over, runs added to the grid are pending)
+        state = {'runs': {}}
+        if self.state_path.exists():
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+        for label, grid_point, _ in self.runs:
+            run = state['runs'].setdefault(label, {'status': STATUS_PENDING, 'grid': grid_point})
+            if run['status'] == STATUS_RUNNING or (retry_failed and run['status'] == STATUS_FAILED):
+                run['status'] = STATUS_PENDING
+        self.state = state
+
+
+    def save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.state_path.with_suffix('.tmp')
+        with open(temp_path, 'w') as file:
+            json.dump(self.state, file, indent=4)
+        os.replace(temp_path, self.state_path)
+
+
+    def clear_outputs(self, settings: dict):
+
+        # the trainer appends to win_rates.csv and starts from episode 0, so a restarted run must not see old results
+        shutil.rmtree(self.logs_path / '{}_vs_{}'.format(settings['agent_a']['name'], settings['agent_b']['name']), ignore_errors=True)
+        for side in SIDES: shutil.rmtree(self.models_path / settings[side]['name'], ignore_errors=True)
+
+
+class RunningTraining(object):
+
+    def __init__(self, sweep: Sweep, label: str, settings: dict, cores: list):
+
+        # start the trainer pinned to the cores of its slot, with the experiment's directories as environment
+        self.label, self.cores = label, cores
+        self.settings_file = sweep.settings_path / (label + '.json')
+        placeholders = {'settings': str(self.settings_file), 'settings_name': self.settings_file.name,
+            'settings_root': str(sweep.settings_path), 'train_root': str(sweep.logs_path.parent),
+            'logs_root': str(sweep.logs_path), 'models_root': str(sweep.models_path),
+            'cores': ','.join(str(core) for core in cores), 'label': label,
+            'python': sys.executable, 'scheduler': str(Path(__file__).resolve())}
+        command = [arg.format(**placeholders) for arg in sweep.command]
+        environment = dict(os.environ, SETTINGS_ROOT=str(sweep.settings_path),
+            LOGS_ROOT=str(sweep.logs_path), MODELS_ROOT=str(sweep.models_path))
+
+        sweep.logs_path.mkdir(parents=True, exist_ok=True)
+        sweep.models_path.mkdir(parents=True, exist_ok=True)
+        self.log_path = sweep.logs_path / 'log_{}_{}.txt'.format(label, datetime.now().strftime(LOG_TIME_FORMAT))
+        self.log_file = open(self.log_path, 'ab')
+        self.process = subprocess.Popen(command, env=environment, stdout=self.log_file, stderr=subprocess.STDOUT,
+            start_new_session=True, preexec_fn=lambda: os.sched_setaffinity(0, cores))
+
+        # follow the win rates to count the trained episodes
+        self.tail = RunTail(sweep.logs_path / '{}_vs_{}'.format(settings['agent_a']['name'], settings['agent_b']['name']) / 'win_rates.csv')
+        self.start_time = time.monotonic()
+        self.stop_reason, self.stop_deadline = None, None
+
+
+    def elapsed_seconds(self):
+        return time.monotonic() - self.start_time
+
+
+    def stop(self, reason: str, grace_seconds: float):
+
+        # ask the trainer to store its models and exit (killed if it doesn't exit within the grace period)
+        if self.stop_reason is not None: return
+        self.stop_reason, self.stop_deadline = reason, time.monotonic() + grace_seconds
+        if self.process.poll() is None: self.process.send_signal(signal.SIGTERM)
+
+
+    def poll(self, budget: dict, grace_seconds: float):
+
+        # check the budgets, escalate overdue stops and return the exit code once the trainer exited
+        self.tail.poll()
+        if budget.get('episodes') is not None and self.tail.episode >= budget['episodes']:
+            self.stop('episodes', grace_seconds)
+        if budget.get('wall_seconds') is not None and self.elapsed_seconds() >= budget['wall_seconds']:
+            self.stop('wall_seconds', grace_seconds)
+        if self.stop_deadline is not None and time.monotonic() > self.stop_deadline and self.process.poll() is None:
+            self.process.kill()
+        return_code = self.process.poll()
+        if return_code is not None: self.log_file.close()
+        return return_code
+
+
+def run_sweep(sweep: Sweep, num_jobs: int=None, poll_interval: float=DEFAULT_POLL_INTERVAL, grace_seconds: float=DEFAULT_GRACE_SECONDS):
+
+    # split the usable cores into worker slots
+    cores = sorted(os.sched_getaffinity(0))
+    if sweep.cores_per_run > len(cores):
+        raise ValueError('Invalid sweep! {} cores per run requested, only {} cores available!'.format(sweep.cores_per_run, len(cores)))
+    slots = [cores[i:i + sweep.cores_per_run] for i in range(0, len(cores) - sweep.cores_per_run + 1, sweep.cores_per_run)]
+    slots = slots[:num_jobs] if num_jobs is not None else slots
+
+    queue = [(label, settings) for label, _, settings in sweep.runs if sweep.state['runs'][label]['status'] == STATUS_PENDING]
+    print('sweep of {} runs: {} pending, {} slots of {} cores'.format(len(sweep.runs), len(queue), len(slots), sweep.cores_per_run))
+    running, free_slots = {}, list(slots)
+
+    try:
+        while len(queue) > 0 or len(running) > 0:
+
+            # fill the free slots with the next pending runs
+            while len(queue) > 0 and len(free_slots) > 0:
+                label, settings = queue.pop(0)
+                sweep.clear_outputs(settings)
+                training = RunningTraining(sweep, label, settings, free_slots.pop(0))
+                running[label] = training
+                sweep.state['runs'][label].update({'status': STATUS_RUNNING, 'cores': training.cores,
+                    'started': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'log': training.log_path.name})
+                sweep.save_state()
+                print('started {} on cores {}'.format(label, training.cores))
+
+            # wait for the next poll, then collect the finished runs
+            time.sleep(poll_interval)
+            for label, training in list(running.items()):
+                return_code = training.poll(sweep.budget, grace_seconds)
+                if return_code is None: continue
+
+                # runs stopped by their budget are done, runs exiting by themselves only if they succeeded
+                is_done = training.stop_reason is not None or return_code == 0
+                sweep.state['runs'][label].update({'status': STATUS_DONE if is_done else STATUS_FAILED,
+                    'return_code': return_code, 'stop_reason': training.stop_reason, 'episodes': training.tail.episode,
+                    'seconds': round(training.elapsed_seconds(), 1), 'ended': datetime.now(timezone.utc).isoformat(timespec='seconds')})
+                sweep.save_state()
+                free_slots.append(training.cores)
+                del running[label]
+                print('{} {} after {} episodes ({})'.format('finished' if is_done else 'failed', label,
+                    training.tail.episode, training.stop_reason or 'exit code {}'.format(return_code)))
+
+    # stop the running trainings on interruption (they start over when the sweep is resumed)
+    except KeyboardInterrupt:
+        for training in running.values(): training.stop('interrupted', grace_seconds)
+        for label, training in running.items():
+            while training.poll({}, grace_seconds) is None: time.sleep(0.1)
+            sweep.state['runs'][label]['status'] = STATUS_PENDING
+        sweep.save_state()
+        print('sweep interrupted, {} runs will start over when it is resumed'.format(len(running)))
+        return
+
+    statuses = [run['status'] for run in sweep.state['runs'].values()]
+    print('sweep finished: {} done, {} failed'.format(statuses.count(STATUS_DONE), statuses.count(STATUS_FAILED)))
+
+
+def run_stub_trainer(settings_file: Path, epoch_seconds: float):
+
+    # mimic the outputs of the trainer (console log, win_rates.csv, models) without training anything
+    with open(settings_file, 'r') as file:
+        settings = json.load(file)
+    logs_path, models_path = Path(os.environ['LOGS_ROOT']), Path(os.environ['MODELS_ROOT'])
+    win_rates_path = logs_path / '{}_vs_{}'.format(settings['agent_a']['name'], settings['agent_b']['name']) / 'win_rates.csv'
+    trainable = [settings[side]['name'] for side in SIDES if settings[side].get('trainable', False)]
+    training_interval, inference_interval = settings.get('training_interval', 1000000), settings.get('inference_interval', 10000)
+
+    # store the final models when stopped (like the trainer on SIGTERM)
+    episode = 0
+    def on_stop(signum, frame):
+        for name in trainable: os.replace(models_path / name / '{}_0.csv'.format(name), models_path / name / '{}_{}.csv'.format(name, episode))
+        print('Exited training gracefully!', flush=True)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, on_stop)
+
+    rng = random.Random(str(settings_file))
+    print('Starting training', flush=True)
+    while True:
+        for name in trainable:
+            (models_path / name).mkdir(parents=True, exist_ok=True)
+            (models_path / name / '{}_0.csv'.format(name)).write_text('')
+        print('stored model to temp files', flush=True)
+        print('starting training episode {} - {}'.format(episode, episode + training_interval), flush=True)
+        time.sleep(epoch_seconds)
+        episode += training_interval
+        print('\rtraining progress: 100 %\n\rinference progress: 100 %', flush=True)
+
+        # the win rate of side A grows with the episodes
+        wins_a = int(inference_interval * min(0.95, 0.4 + 0.05 * episode / training_interval + rng.uniform(0, 0.05)))
+        wins_b = (inference_interval - wins_a) // 2
+        ties = inference_interval - wins_a - wins_b
+        print('inference results: {} games played, side A wins {}, side B wins {}, ties {}'.format(
+            inference_interval, wins_a, wins_b, ties), flush=True)
+        win_rates_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(win_rates_path, 'a') as file:
+            file.write('{},{},{},{}\n'.format(training_interval, wins_a / inference_interval, wins_b / inference_interval, ties / inference_interval))
+
+
+def main():
+
+    # stub trainer mode (e.g. "command": ["{python}", "{scheduler}", "--stub-trainer", "{settings}"])
+    if ARG_STUB_TRAINER in sys.argv:
+        epoch_seconds = float(sys.argv[sys.argv.index(ARG_EPOCH_SECONDS) + 1]) if ARG_EPOCH_SECONDS in sys.argv else 1.0
+        run_stub_trainer(Path(sys.argv[sys.argv.index(ARG_STUB_TRAINER) + 1]), epoch_seconds)
+        return
+
+    # make sure that the sweep file is specified
+    args = []
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        if not arg.startswith('--') and sys.argv[i - 1] not in ALL_ARG_SPECIFIERS: args.append(arg)
+    if len(args) < 1: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<sweep.json> [--jobs <max parallel runs>] [--poll <seconds>] [--grace <seconds>] [--dry-run] [--retry-failed]\n"
+        + "or as stub trainer for local tests: --stub-trainer <settings.json> [--epoch-seconds <seconds>]")
+
+    # parse script args
+    num_jobs = int(sys.argv[sys.argv.index(ARG_JOBS) + 1]) if ARG_JOBS in sys.argv else None
+    poll_interval = float(sys.argv[sys.argv.index(ARG_POLL) + 1]) if ARG_POLL in sys.argv else DEFAULT_POLL_INTERVAL
+    grace_seconds = float(sys.argv[sys.argv.index(ARG_GRACE) + 1]) if ARG_GRACE in sys.argv else DEFAULT_GRACE_SECONDS
+
+    # expand the grid into settings files and resume the previous progress
+    sweep = Sweep(Path(args[0]))
+    sweep.write_settings()
+    sweep.load_state(ARG_RETRY_FAILED in sys.argv)
+    print('wrote {} settings files to {}'.format(len(sweep.runs), sweep.settings_path))
+    if ARG_DRY_RUN in sys.argv:
+        for label, grid_point, _ in sweep.runs: print('{:<40} {}'.format(label, sweep.state['runs'][label]['status']))
+        return
+
+    # run the queue (stop gracefully on SIGTERM as well, e.g. 'docker stop')
+    def handle_sigterm(signum, frame): raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    sweep.save_state()
+    run_sweep(sweep, num_jobs, poll_interval, grace_seconds)
+
+
+ # run the main script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+
+import pandas as pd
+import numpy as np
+import sys, os, struct, tempfile
+
+import state_codec as sc
+import instrumentation as ins
+
+
+# Binary Q-table layout (little-endian, every section aligned to 8 bytes):
+#   header:    magic, version, rows, columns, key kind ('u' = uint64, 'S' = bytes), key width, states, records
+#   keys:      packed state key of each record
+#   columns:   int8 column of each record
+#   Q values:  float32 Q value of each record
+# The records are sorted by state key and by descending Q value within a state (ties keep the
+# order of the csv file), so the first record of each state is its greedy action.
+BINARY_QTABLE_EXT = '.nwq'
+BINARY_QTABLE_MAGIC = b'NWQTB'
+BINARY_QTABLE_VERSION = 1
+BINARY_QTABLE_HEADER = struct.Struct('<5sHBBcxIqq')
+QTABLE_CSV_HEADERS = ['state_before', 'state_after', 'acting_side', 'affected_column', 'q_value']
+DEFAULT_CHUNK_SIZE = 1000000
+
+
+def is_binary_qtable(path: str):
+    return str(path).endswith(BINARY_QTABLE_EXT)
+
+
+def sort_run(keys, columns, q_values):
+    # sort by state key, then by descending Q value (the stable sort keeps the file order of ties)
+    order = np.lexsort((-q_values, keys))
+    return keys[order], columns[order], q_values[order]
+
+
+def write_runs(path_csv: str, runs_dir: str, chunk_size: int):
+
+    # parse the csv file chunk by chunk and store each chunk as sorted run (only the compact columns)
+    runs = []
+    chunks = pd.read_csv(path_csv, names=QTABLE_CSV_HEADERS, usecols=['state_before', 'affected_column', 'q_value'], chunksize=chunk_size)
+    for i, chunk in enumerate(chunks):
+        arrays = sort_run(sc.hashes_to_keys(chunk['state_before'].to_numpy()),
+            chunk['affected_column'].to_numpy(dtype=np.int8), chunk['q_value'].to_numpy(dtype=np.float64))
+        paths = [os.path.join(runs_dir, 'run_{}_{}.npy'.format(i, name)) for name in ['keys', 'columns', 'q_values']]
+        for path, array in zip(paths, arrays): np.save(path, array)
+        runs.append([np.load(path, mmap_mode='r') for path in paths])
+    return runs
+
+
+def is_before(keys, neg_q_values, runs, positions, bound):
+    # compare the records with the bound record in the order (state key, -Q value, run, position in the run)
+    key, neg_q_value, run, position = bound
+    return (keys < key) | ((keys == key) & ((neg_q_values < neg_q_value) | ((neg_q_values == neg_q_value)
+        & ((runs < run) | ((runs == run) & (positions <= position))))))
+
+
+def merge_runs(runs: list, buffer_size: int):
+
+    # merge the sorted runs block by block: each run provides its next buffer of records and all buffered
+    # records up to the smallest last buffered record of the runs with further records are final
+    starts = [0] * len(runs)
+    while any(start < len(keys) for start, (keys, _, _) in zip(starts, runs)):
+        ends = [min(start + buffer_size, len(keys)) for start, (keys, _, _) in zip(starts, runs)]
+        bounds = [(keys[end - 1], -q_values[end - 1], i, end - 1) for i, ((keys, _, q_values), end)
+            in enumerate(zip(runs, ends)) if end < len(keys)]
+        bound = min(bounds) if len(bounds) > 0 else None
+
+        # collect the final records of each run's buffer
+        block = []
+        for i, ((keys, columns, q_values), start, end) in enumerate(zip(runs, starts, ends)):
+            if start == end: continue
+            keys, columns, q_values = np.asarray(keys[start:end]), np.asarray(columns[start:end]), np.asarray(q_values[start:end])
+            positions = np.arange(start, end)
+            num_final = end - start if bound is None else int(np.count_nonzero(
+                is_before(keys, -q_values, np.full(end - start, i), positions, bound)))
+            block.append((keys[:num_final], columns[:num_final], q_values[:num_final], np.full(num_final, i), positions[:num_final]))
+            starts[i] = start + num_final
+
+        # sort the final records of all runs (run and position restore the file order of ties)
+        keys, columns, q_values, run_ids, positions = (np.concatenate(arrays) for arrays in zip(*block))
+        order = np.lexsort((positions, run_ids, -q_values, keys))
+        yield keys[order], columns[order], q_values[order]
+
+
+def convert_csv_to_binary(path_csv: str, path_binary: str=None, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # convert the csv file in memory bounded by the chunk size: sort each chunk into a run file
+    # (next to the binary file), then merge the runs into the memory-mapped sections of the binary file
+    if path_binary is None: path_binary = os.path.splitext(path_csv)[0] + BINARY_QTABLE_EXT
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path_binary)), prefix='.runs_') as runs_dir:
+        runs = write_runs(path_csv, runs_dir, chunk_size)
+        num_records = sum(len(keys) for keys, _, _ in runs)
+        if num_records == 0: raise ValueError('Cannot convert an empty Q table!')
+
+        # lay out the header and the sections (each aligned to 8 bytes)
+        key_type = runs[0][0].dtype
+        offsets = [BINARY_QTABLE_HEADER.size + (-BINARY_QTABLE_HEADER.size % 8)]
+        for dtype in [key_type, np.dtype(np.int8), np.dtype(np.float32)]:
+            nbytes = num_records * dtype.itemsize
+            offsets.append(offsets[-1] + nbytes + (-nbytes % 8))
+        with open(path_binary, 'wb') as file:
+            file.truncate(offsets[-1])
+        sections = [np.memmap(path_binary, dtype=dtype, mode='r+', offset=offset, shape=(num_records,))
+            for dtype, offset in zip([key_type, np.int8, np.float32], offsets)]
+
+        # write the merged records, counting the states (a state may continue in the next block)
+        num_written, num_states, last_key = 0, 0, None
+        for keys, columns, q_values in merge_runs(runs, max(chunk_size // len(runs), 1024)):
+            end = num_written + len(keys)
+            sections[0][num_written:end], sections[1][num_written:end], sections[2][num_written:end] = keys, columns, q_values
+            num_states += int(np.count_nonzero(keys[1:] != keys[:-1])) + int(last_key is None or keys[0] != last_key)
+            num_written, last_key = end, keys[-1]
+        for section in sections: section.flush()
+        del sections, runs
+
+    # write the header
+    rows, cols = (int(x) for x in sc.keys_to_bytes(np.array([last_key], dtype=key_type))[0, :2])
+    header = BINARY_QTABLE_HEADER.pack(BINARY_QTABLE_MAGIC, BINARY_QTABLE_VERSION, rows, cols,
+        key_type.kind.encode('ascii'), key_type.itemsize, num_states, num_records)
+    with open(path_binary, 'r+b') as file:
+        file.write(header)
+
+    print('converted Q table {} to {}'.format(path_csv, path_binary))
+    return path_binary
+
+
+class BinaryQTable(object):
+
+    def __init__(self, path_binary: str):
+
+        # parse the header
+        with open(path_binary, 'rb') as file:
+            header = file.read(BINARY_QTABLE_HEADER.size)
+        if len(header) < BINARY_QTABLE_HEADER.size: raise ValueError('Invalid binary Q table {}!'.format(path_binary))
+        magic, version, rows, cols, key_kind, key_width, num_states, num_records = BINARY_QTABLE_HEADER.unpack(header)
+        if magic != BINARY_QTABLE_MAGIC or version != BINARY_QTABLE_VERSION:
+            raise ValueError('Invalid binary Q table {}! Unknown format or version.'.format(path_binary))
+        self.rows, self.cols, self.num_states = rows, cols, num_states
+
+        # memory-map the sections (pages are loaded lazily and shared across processes)
+        key_type = np.dtype(np.uint64) if key_kind == b'u' else np.dtype(('S', key_width))
+        offset = BINARY_QTABLE_HEADER.size + (-BINARY_QTABLE_HEADER.size % 8)
+        arrays = []
+        for dtype in [key_type, np.int8, np.float32]:
+            array = np.memmap(path_binary, dtype=dtype, mode='r', offset=offset, shape=(num_records,))
+            offset += array.nbytes + (-array.nbytes % 8)
+            arrays.append(array)
+        self.keys, self.columns, self.q_values = arrays
+
+
+    def state_ranges(self, keys):
+
+        # find the record range [start, end) of each state by binary search (empty if unknown)
+        keys = np.asarray(keys, dtype=self.keys.dtype)
+        return np.searchsorted(self.keys, keys, side='left'), np.searchsorted(self.keys, keys, side='right')
+
+
+    def lookup(self, key):
+
+        # get all (column, Q value) records of a single state, best action first
+        start, end = (int(x[0]) for x in self.state_ranges([key]))
+        return np.array(self.columns[start:end]), np.array(self.q_values[start:end])
+
+
+    def best_actions(self, keys):
+
+        # the first record of each state holds its greedy action (-1 / NaN for unknown states)
+        start, end = self.state_ranges(keys)
+        found = start < end
+        start = np.where(found, start, 0)
+        columns = np.where(found, self.columns[start], -1).astype(np.int64) if len(self.keys) > 0 else np.full(len(start), -1)
+        q_values = np.where(found, self.q_values[start], np.nan) if len(self.keys) > 0 else np.full(len(start), np.nan)
+        return columns, q_values
+
+
+    def policy(self):
+
+        # determine the greedy action of every state in one pass over the records
+        is_first = np.ones(len(self.keys), dtype=bool)
+        is_first[1:] = self.keys[1:] != self.keys[:-1]
+        return np.array(self.keys[is_first]), self.columns[is_first].astype(np.int64), self.q_values[is_first].astype(np.float64)
+
+
+    def second_best_policy(self):
+
+        # the second record of each state holds its second best action (states with a single action are left out)
+        is_second = np.zeros(len(self.keys), dtype=bool)
+        is_second[1:] = self.keys[1:] == self.keys[:-1]
+        is_second[2:] &= self.keys[1:-1] != self.keys[:-2]
+        return np.array(self.keys[is_second]), self.columns[is_second].astype(np.int64)
+
+
+def main():
+
+    # make sure that the Q table csv file is specified
+    if len(sys.argv) < 2: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<path_qtable.csv>, [<path_qtable.nwq>]\n"
+        + "The second argument is optional and defaults to the csv path with {} extension.\n".format(BINARY_QTABLE_EXT)
+        + "The conversion holds about {} csv rows in memory at once (sorted runs are merged on disk).".format(DEFAULT_CHUNK_SIZE))
+
+    # parse script args
+    path_csv = sys.argv[1]
+    path_binary = sys.argv[2] if len(sys.argv) > 2 else None
+    if not os.path.exists(path_csv) or not os.path.isfile(path_csv): raise ValueError("Q-Table could not be found!")
+
+    convert_csv_to_binary(path_csv, path_binary)
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('binary_qtable'):
+        main()
@@ -1,103 +1,71 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import errno
 import os
 from pathlib import Path
 
 import data_helper as dh
+import experiment_index as ei
+import winrate_store as ws
+import instrumentation as ins
 
-if __name__=='__main__':
-    # Create path to experiments directory
-    experiments_path = Path(Path().cwd().parents[0] / 'experiments')
-
-    # Loop through all training directories
-    for train_directory_path in experiments_path.rglob("*"):
-        # check if train_directory_path is directory
-        if not train_directory_path.is_dir():
-            continue
-        
-        # Loop through experiment directories
-        for experiment_directory_path in train_directory_path.rglob("*"):
-            # check if experiment_directory_path is directory
-            if not experiment_directory_path.is_dir():
-                continue
-
-            # Create path to train/logs
-            logs_path = experiment_directory_path / 'train/logs'
-
-            # Check path to train/logs is available
-            if not logs_path.exists():
-                    continue
-            
-            # Create new plot for each experiment
-            plt.figure()
-
-            # loop through win rates directories in logs
-            for content_path in sorted(logs_path.rglob("*")):
-                # check if content is directory
-                if not content_path.is_dir():
-                    continue
-
-                # Create file path to win_rates.csv
-                win_rates_path = content_path / 'win_rates.csv'
-
-                # Check if win rate csv exists
-                if not win_rates_path.exists():
-                    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), win_rates_path)
 
-                # Read dataframe from csv file
-                winrate_df = dh.get_winrate_df_from_csv(win_rates_path)
+def plot_compare_winrates(experiment_df, image_path):
+    # Create new plot for each experiment
+    figure = plt.figure()
 
-                # Get directory name
-                directory_name = content_path.name
-                # Split directory name into agent names
-                agent_names = directory_name.split('_vs_')
+    # loop through the agents of all runs (sorted by run, agent A first)
+    for (run, side), winrate_df in experiment_df.groupby([dh.RUN, dh.SIDE], observed=True, sort=True):
+        # Get agent name
+        agent = winrate_df[dh.AGENT].iloc[0]
 
-                # Iterate over both agents
-                for agent in agent_names:
-                    # Plot only winrates for not-random agents
-                    if 'Random' in agent:
-                        continue
-
-                    # Get side of agent
-                    side = dh.WINRATE_A if agent.split('_')[-1] == 'SideA' else dh.WINRATE_B
-
-                    # Plot winrate of agent
-                    plt.plot(winrate_df[dh.EPISODE], winrate_df[side], label=agent)
-
-            # Set ylim between 0 and 1
-            plt.ylim(0.0, 1.0)
-
-            # Set xlim left 0
-            plt.xlim(left=0)
+        # Plot only winrates for not-random agents
+        if 'Random' in agent:
+            continue
 
-            # Set the x and y axis label
-            plt.xlabel(dh.EPISODE)
-            plt.ylabel('win rate')
+        # Plot winrate of agent
+        plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.WIN_RATE], label=agent)
 
-            # Show legend
-            plt.legend()
+    # Set ylim between 0 and 1
+    plt.ylim(0.0, 1.0)
 
-            # Create path to plots directory
-            plots_path = experiment_directory_path /'plots'
+    # Set xlim left 0
+    plt.xlim(left=0)
 
-            # Check plot directory is available
-            if not plots_path.exists():
-                    os.mkdir(plots_path)
+    # Set the x and y axis label
+    plt.xlabel(dh.EPISODE)
+    plt.ylabel('win rate')
 
-            # Create path to compare_winrate directory
-            compare_winrates_path = Path(plots_path / 'compare_winrate')
+    # Show legend
+    plt.legend()
 
-            # Check compare_winrate directory is available
-            if not compare_winrates_path.exists():
-                    os.mkdir(compare_winrates_path)
+    # Save plot as image and release the figure
+    plt.savefig(image_path)
+    plt.close(figure)
 
-            # Get image name from source directroy
-            image_name = 'compare_winrates.png'
 
+if __name__=='__main__':
+    with ins.instrumented_run('compare_winrate_plotter'):
+        # Create path to experiments directory
+        experiments_path = Path(Path().cwd().parents[0] / 'experiments')
+
+        # Collect the plots to be rendered (one plot per experiment)
+        jobs = []
+        experiments = ei.build_experiment_index(experiments_path)
+        for experiment in experiments:
             # Create image path
-            image_path = compare_winrates_path / image_name
+            image_path = experiment.plot_path('compare_winrate', 'compare_winrates.png')
+
+            # Only render plots that are older than one of their win rates
+            if ei.needs_rendering(image_path, experiment.win_rates_paths()):
+                jobs.append((experiment.name, image_path))
 
-            # Save plot as image
-            plt.savefig(image_path)
+        # Read the win rates of the outdated experiments from the win rate store
+        if len(jobs) > 0:
+            store = ws.load_winrate_store(experiments_path, experiments)
+            experiment_dfs = dict(tuple(store.groupby(dh.EXPERIMENT, observed=True)))
+            jobs = [(experiment_dfs.get(name, store.iloc[:0]), image_path) for name, image_path in jobs]
 
+        # Render all outdated plots in parallel
+        ei.render_plots(plot_compare_winrates, jobs)
@@ -0,0 +1,77 @@
+
+import numpy as np
+
+
+# Vectorized Connect-N game rules for whole batches of boards, stored as uint8 field
+# arrays of shape (n, rows, columns) with 0 = none, 1 = side A, 2 = side B (row 0 at the bottom),
+# i.e. the same layout as the field arrays of state_codec.
+
+SIDE_A = 1
+SIDE_B = 2
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+def initial_boards(num_boards: int, rows: int, cols: int):
+    return np.zeros((num_boards, rows, cols), dtype=np.uint8)
+
+
+def column_heights(fields):
+    # the stones of a column are stacked from the bottom, so the height equals the amount of stones
+    return np.count_nonzero(fields, axis=1)
+
+
+def legal_moves(fields):
+    # a column is playable as long as its top field is still free
+    return fields[:, -1, :] == 0
+
+
+def drop_stones(fields, heights, columns, sides):
+
+    # put each stone onto the lowest free field of its column (in-place)
+    boards = np.arange(len(fields))
+    if (heights[boards, columns] >= fields.shape[1]).any(): raise ValueError('Invalid actions! Column is already entirely occupied!')
+    fields[boards, heights[boards, columns], columns] = sides
+    heights[boards, columns] += 1
+
+
+def is_connect_n(fields, sides, win_conn: int):
+
+    # mask the stones of the given side on each board
+    stones = fields == np.asarray(sides, dtype=np.uint8).reshape(-1, 1, 1)
+    num_boards, rows, cols = stones.shape
+    wins = np.zeros(num_boards, dtype=bool)
+
+    # AND together win_conn shifted copies of the board for each line direction
+    for row_step, col_step in DIRECTIONS:
+        height, width = rows - (win_conn - 1) * row_step, cols - (win_conn - 1) * abs(col_step)
+        if height <= 0 or width <= 0: continue
+        col_offset = (win_conn - 1) if col_step < 0 else 0
+        lines = np.ones((num_boards, height, width), dtype=bool)
+        for i in range(win_conn):
+            row, col = i * row_step, col_offset + i * col_step
+            lines &= stones[:, row:row + height, col:col + width]
+        wins |= lines.reshape(num_boards, -1).any(axis=1)
+
+    return wins
+
+
+def win_lines(rows: int, cols: int, win_conn: int):
+
+    # enumerate the field indices (row * columns + column) of all lines of win_conn fields
+    lines = []
+    for row_step, col_step in DIRECTIONS:
+        for row in range(rows - (win_conn - 1) * row_step):
+            for col in range(cols):
+                end_col = col + (win_conn - 1) * col_step
+                if end_col < 0 or end_col >= cols: continue
+                lines.append([(row + i * row_step) * cols + col + i * col_step for i in range(win_conn)])
+
+    return np.array(lines, dtype=np.int64).reshape(-1, win_conn)
+
+
+def random_legal_columns(legal, rng: np.random.Generator):
+
+    # draw a uniformly random legal column per board (illegal columns never get the highest score)
+    scores = rng.random(legal.shape)
+    scores[~legal] = -1
+    return np.argmax(scores, axis=1)
@@ -0,0 +1,106 @@
+
+import pandas as pd
+import numpy as np
+import sys
+from pathlib import Path
+
+import data_helper as dh
+import winrate_store as ws
+import instrumentation as ins
+
+
+# The first episode at which an agent's win rate exceeds a threshold is found for all thresholds
+# and all agents of all runs at once: the running maximum of each agent's win rates is shifted by
+# 2 * agent index (win rates are within [0; 1]), so all agents form one ascending array that a
+# single searchsorted call resolves for the whole threshold grid.
+
+DEFAULT_THRESHOLDS = [0.60, 0.70, 0.80, 0.85, 0.90, 0.95, 0.97, 0.99]
+GROUP_COLUMNS = [dh.EXPERIMENT, dh.RUN, dh.SIDE]
+THRESHOLD = 'threshold'
+WINDOW = 'window'
+REACHED = 'reached'
+
+ARG_THRESHOLDS = '--thresholds'
+ARG_WINDOWS = '--windows'
+
+
+def group_bounds(store: pd.DataFrame):
+
+    # sort the rows by agent and episode (stable, so rows logged at the same episode keep their order)
+    store = store.sort_values(GROUP_COLUMNS + [dh.EPISODE], kind='stable').reset_index(drop=True)
+
+    # assign each row its agent's index (ascending, as the rows are sorted) and the agent's first and last row
+    group_ids = store.groupby(GROUP_COLUMNS, observed=True, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.diff(group_ids, prepend=-1) != 0)
+    ends = np.append(starts[1:], len(store))
+    return store, group_ids, starts, ends
+
+
+def rolling_means(values, group_ids, starts, window: int):
+
+    # trailing mean over the last window rows of the same agent (via differences of the cumulative sum)
+    if window <= 1: return values
+    positions = np.arange(len(values))
+    window_starts = np.maximum(positions - window + 1, starts[group_ids])
+    cumsum = np.concatenate([[0.0], np.cumsum(values)])
+    return (cumsum[positions + 1] - cumsum[window_starts]) / (positions + 1 - window_starts)
+
+
+def first_crossings(store: pd.DataFrame, thresholds: list=DEFAULT_THRESHOLDS, windows: list=[1]):
+
+    # one row per agent of each run with its (optionally smoothed) running maximum win rate
+    store, group_ids, starts, ends = group_bounds(store)
+    agents = store.loc[starts, [dh.EXPERIMENT, dh.RUN, dh.AGENT, dh.SIDE]].reset_index(drop=True)
+    win_rates = store[dh.WIN_RATE].fillna(0).to_numpy(dtype=np.float64)
+    episodes = store[dh.EPISODE].to_numpy()
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+
+    results = []
+    for window in windows:
+
+        # running maximum per agent, shifted into one globally ascending array
+        smoothed = pd.Series(rolling_means(win_rates, group_ids, starts, window))
+        running_max = smoothed.groupby(group_ids).cummax().to_numpy() + 2.0 * group_ids
+
+        # find the first row strictly exceeding each threshold for each agent in one pass
+        targets = (thresholds[None, :] + 2.0 * np.arange(len(starts))[:, None]).ravel()
+        positions = np.searchsorted(running_max, targets, side='right')
+        is_reached = positions < np.repeat(ends, len(thresholds))
+        crossing_episodes = np.where(is_reached, episodes[np.minimum(positions, len(episodes) - 1)], np.nan)
+
+        # tidy table: one row per agent, window and threshold
+        result = agents.loc[agents.index.repeat(len(thresholds))].reset_index(drop=True)
+        result[WINDOW] = window
+        result[THRESHOLD] = np.tile(thresholds, len(starts))
+        result[dh.EPISODE] = crossing_episodes
+        result[REACHED] = is_reached
+        results.append(result)
+
+    return pd.concat(results, ignore_index=True) if len(results) > 0 else pd.DataFrame()
+
+
+def main():
+
+    # make sure that the experiments directory and the output file are specified
+    if len(sys.argv) < 3: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<experiments_dir> <convergence_metrics.csv> [--thresholds <t1,t2,...>] [--windows <w1,w2,...>]\n"
+        + "The windows are trailing smoothing windows in logged inference rows (1 = no smoothing).")
+
+    # parse script args
+    experiments_path, output_path = Path(sys.argv[1]), sys.argv[2]
+    thresholds = [float(value) for value in sys.argv[sys.argv.index(ARG_THRESHOLDS) + 1].split(',')] \
+        if ARG_THRESHOLDS in sys.argv else DEFAULT_THRESHOLDS
+    windows = [int(value) for value in sys.argv[sys.argv.index(ARG_WINDOWS) + 1].split(',')] \
+        if ARG_WINDOWS in sys.argv else [1]
+
+    # compute the first crossings of all agents of all experiments and export them
+    crossings = first_crossings(ws.load_winrate_store(experiments_path), thresholds, windows)
+    crossings.to_csv(output_path, index=False)
+    print('wrote convergence metrics of {} agents to {}'.format(
+        len(crossings) // max(len(thresholds) * len(windows), 1), output_path))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('convergence_metrics'):
+        main()
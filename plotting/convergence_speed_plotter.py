@@ -1,166 +1,101 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import errno
 import os
 import numpy as np
 from pathlib import Path
 
 import data_helper as dh
+import experiment_index as ei
+import winrate_store as ws
+import instrumentation as ins
+import convergence_metrics as cm
 
 
-# Counts the number of learning agents in one log path
-def count_learning_agents_in_logs_path(logs_path):
-    count = 0
+# Counts the number of learning agents in one experiment
+def count_learning_agents(experiment_df):
+    # Get the distinct agents of all runs
+    agents = experiment_df[[dh.RUN, dh.AGENT]].drop_duplicates()
 
-    # loop through win rates directories in logs
-    for content_path in logs_path.rglob("*"):
-        # check if content is directory
-        if not content_path.is_dir():
-            continue
+    # Count only not-random agents
+    return int((~agents[dh.AGENT].astype(str).str.contains('Random')).sum())
 
-        # Create file path to win_rates.csv
-        win_rates_path = content_path / 'win_rates.csv'
 
-        # Check if win rate csv exists
-        if not win_rates_path.exists():
-            continue
+def plot_convergence_speed(experiment_df, image_path):
+    # Create new plot for each experiment
+    figure = plt.figure()
 
-        # Get directory name
-        directory_name = content_path.name
-        # Split directory name into agent names
-        agent_names = directory_name.split('_vs_')
+    # Current agent number
+    i = 0
 
-        # Iterate over both agents
-        for agent in agent_names:
-            # Plot only winrates for not-random agents
-            if 'Random' in agent:
-                continue
+    # Number of learning agents in this experiment
+    n = count_learning_agents(experiment_df)
 
-            count = count + 1
+    # Create list with winrates to investigate
+    winrate_bars = cm.DEFAULT_THRESHOLDS
 
-    return count
+    # the label locations
+    label_locations = np.arange(len(winrate_bars))
+    width = 0.175
 
+    # Get episodes, when the winrates are reached (0 if never reached)
+    crossings = cm.first_crossings(experiment_df, winrate_bars)
 
-if __name__=='__main__':
-    # Create path to experiments directory
-    experiments_path = Path(Path().cwd().parents[0] / 'experiments')
+    # loop through the agents of all runs (sorted by run, agent A first)
+    for (run, side), agent_crossings in crossings.groupby([dh.RUN, dh.SIDE], observed=True, sort=True):
+        # Get agent name
+        agent = agent_crossings[dh.AGENT].iloc[0]
 
-    # Loop through all training directories
-    for train_directory_path in experiments_path.rglob("*"):
-        # check if train_directory_path is directory
-        if not train_directory_path.is_dir():
+        # Plot only winrates for not-random agents
+        if 'Random' in agent:
             continue
-        
-        # Loop through experiment directories
-        for experiment_directory_path in train_directory_path.rglob("*"):
-            # check if experiment_directory_path is directory
-            if not experiment_directory_path.is_dir():
-                continue
-
-            # Create path to train/logs
-            logs_path = experiment_directory_path / 'train/logs'
-
-            # Check path to train/logs is available
-            if not logs_path.exists():
-                    continue
-            
-            # Create new plot for each experiment
-            plt.figure()
-
-            # Current agent number
-            i = 0
-
-            # Number of learning agents in this experiment
-            n = count_learning_agents_in_logs_path(logs_path)
-
-            # loop through win rates directories in logs
-            for content_path in sorted(logs_path.rglob("*")):
-                # check if content is directory
-                if not content_path.is_dir():
-                    continue
-
-                # Create file path to win_rates.csv
-                win_rates_path = content_path / 'win_rates.csv'
-
-                # Check if win rate csv exists
-                if not win_rates_path.exists():
-                    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), win_rates_path)
-
-                # Read dataframe from csv file
-                winrate_df = dh.get_winrate_df_from_csv(win_rates_path)
 
-                # Get directory name
-                directory_name = content_path.name
-                # Split directory name into agent names
-                agent_names = directory_name.split('_vs_')
+        # Get episode marks of the agent
+        episodes_for_winrate = agent_crossings[dh.EPISODE].fillna(0).to_numpy()
 
-                # Iterate over both agents
-                for agent in agent_names:
-                    # Plot only winrates for not-random agents
-                    if 'Random' in agent:
-                        continue
+        # Plot winrate of agent
+        plt.bar(label_locations - ((n - 1)/2 * width) + i * width, episodes_for_winrate, width, label=agent)
 
-                    # Get side of agent
-                    side = dh.WINRATE_A if agent.split('_')[-1] == 'SideA' else dh.WINRATE_B
+        i = i + 1
 
-                    # Create list with winrates to investigate
-                    winrate_bars = [0.60, 0.70, 0.80, 0.85, 0.90, 0.95, 0.97, 0.99]
 
-                    # Create empty list for episode marks
-                    episodes_for_winrate = []
+    # Set tick labels
+    plt.xticks(label_locations, winrate_bars)
 
-                    # Get episodes, when the winrates are reached
-                    for winrate in winrate_bars:
-                        found_episode = False
-                        for index, row in winrate_df.iterrows():               
-                            if row[side] > winrate and not found_episode:
-                                episodes_for_winrate.append(row[dh.EPISODE])
-                                found_episode = True
-                                break
+    # Set the x and y axis label
+    plt.xlabel('win rate')
+    plt.ylabel(dh.EPISODE)
 
-                        if not found_episode:
-                            episodes_for_winrate.append(0)
+    # Show legend
+    plt.legend()
 
-                    width = 0.175
+    # Save plot as image and release the figure
+    plt.savefig(image_path)
+    plt.close(figure)
 
-                    # the label locations
-                    label_locations = np.arange(len(winrate_bars))  
 
-                    # Plot winrate of agent
-                    plt.bar(label_locations - ((n - 1)/2 * width) + i * width, episodes_for_winrate, width, label=agent)
-
-                    i = i + 1
-
-            
-            # Set tick labels
-            plt.xticks(label_locations, winrate_bars)
-  
-            # Set the x and y axis label
-            plt.xlabel('win rate')
-            plt.ylabel(dh.EPISODE)         
-
-            # Show legend
-            plt.legend()
-
-            # Create path to plots directory
-            plots_path = experiment_directory_path /'plots'
-
-            # Check plot directory is available
-            if not plots_path.exists():
-                    os.mkdir(plots_path)
-
-            # Create path to convergence_speed directory
-            convergence_speed_path = Path(plots_path / 'convergence_speed')
-
-            # Check convergence_speed directory is available
-            if not convergence_speed_path.exists():
-                    os.mkdir(convergence_speed_path)
+if __name__=='__main__':
+    with ins.instrumented_run('convergence_speed_plotter'):
+        # Create path to experiments directory
+        experiments_path = Path(Path().cwd().parents[0] / 'experiments')
+
+        # Collect the plots to be rendered (one plot per experiment)
+        jobs = []
+        experiments = ei.build_experiment_index(experiments_path)
+        for experiment in experiments:
+            # Create image path
+            image_path = experiment.plot_path('convergence_speed', 'convergence_speed.png')
 
-            # Get image name from source directroy
-            image_name = 'convergence_speed.png'
+            # Only render plots that are older than one of their win rates
+            if ei.needs_rendering(image_path, experiment.win_rates_paths()):
+                jobs.append((experiment.name, image_path))
 
-            # Create image path
-            image_path = convergence_speed_path / image_name
+        # Read the win rates of the outdated experiments from the win rate store
+        if len(jobs) > 0:
+            store = ws.load_winrate_store(experiments_path, experiments)
+            experiment_dfs = dict(tuple(store.groupby(dh.EXPERIMENT, observed=True)))
+            jobs = [(experiment_dfs.get(name, store.iloc[:0]), image_path) for name, image_path in jobs]
 
-            # Save plot as image
-            plt.savefig(image_path)
+        # Render all outdated plots in parallel
+        ei.render_plots(plot_convergence_speed, jobs)
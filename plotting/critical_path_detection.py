@@ -1,74 +1,309 @@
 
 import pandas as pd
 import numpy as np
-import sys, os, glob
+import sys, os, glob, struct
+
+import state_codec as sc
+import binary_qtable as bq
+import state_space_generator as ssg
+import instrumentation as ins
 
 
 class GameTree(object):
 
-    def __init__(self, path_transitions: str):
+    def __init__(self, path_transitions: str, canonical: bool=False):
+
+        # the transitions are either a csv file or a directory of edge shards (see state_space_generator.py)
+        path_source = os.path.join(path_transitions, ssg.EDGE_SHARDS_INDEX) if os.path.isdir(path_transitions) else path_transitions
 
-        # load the transitions csv file
-        self.trans_headers = ['state_before', 'state_after']
-        self.transitions = pd.read_csv(path_transitions, names=self.trans_headers)
+        # canonical game trees store each pair of mirror images only once, their CSR targets
+        # hold the child's id * 2 + 1 if the child is mirrored relative to the canonical parent
+        self.canonical = canonical
+
+        # load the CSR index from its binary cache (rebuild it when the transitions changed)
+        self.path_cache = path_transitions.rstrip('/') + (CANONICAL_CSR_CACHE_EXT if canonical else CSR_CACHE_EXT)
+        with ins.phase('load game tree'):
+            if not load_csr_cache(self, self.path_cache, path_source):
+                with ins.phase('build csr index'):
+                    build_csr_index(self, path_transitions, canonical)
+                write_csr_cache(self, self.path_cache, path_source)
+                print('wrote game tree index to {}'.format(self.path_cache))
+            ins.add_rows(len(self.targets))
 
         print('created game tree from {}'.format(path_transitions))
 
 
+    def state_ids(self, keys):
+
+        # look up the states' ids by binary search on the sorted state keys (-1 if unknown)
+        keys = np.asarray(keys, dtype=self.state_keys.dtype)
+        ids = np.searchsorted(self.state_keys, keys)
+        ids[ids == len(self.state_keys)] = 0
+        found = self.state_keys[ids] == keys if len(self.state_keys) > 0 else np.zeros(len(keys), dtype=bool)
+        return np.where(found, ids, -1)
+
+
+    def state_id(self, state: str):
+        keys = sc.hashes_to_keys([state])
+        return int(self.state_ids(sc.canonical_keys(keys)[0] if self.canonical else keys)[0])
+
+
+    def next_state_ids(self, state_id: int):
+
+        # all following states are stored consecutively in the CSR targets
+        return self.targets[self.offsets[state_id]:self.offsets[state_id + 1]]
+
+
     def next_states(self, state: str):
 
-        # get all following states from transitions
-        next_states = self.transitions[self.transitions['state_before'] == state]
-        next_states = next_states[['state_after']].values.tolist()
-        next_states = [a[0] for a in next_states]
+        # get all following states from the CSR index
+        state_id = self.state_id(state)
+        if state_id < 0: return []
+        next_ids = self.next_state_ids(state_id)
+        if not self.canonical:
+            return sc.keys_to_hashes(self.state_keys[next_ids]).tolist()
+
+        # mirror the canonical children back into the orientation of the given state
+        is_mirrored = sc.canonical_keys(sc.hashes_to_keys([state]))[1][0]
+        next_keys = self.state_keys[next_ids >> 1]
+        next_mirrored = ((next_ids & 1) == 1) ^ is_mirrored
+        next_keys = np.where(next_mirrored, sc.mirror_keys(next_keys), next_keys)
+        next_states = sc.keys_to_hashes(next_keys).tolist()
 
         return next_states
 
 
     def is_terminal(self, state: str):
-        return len(self.next_states(state)) == 0
+        state_id = self.state_id(state)
+        return state_id < 0 or self.offsets[state_id] == self.offsets[state_id + 1]
+
+
+# binary CSR cache layout: header, sorted state keys, offsets (int64), targets (int64), each section aligned to 8 bytes
+CSR_CACHE_EXT = '.csr'
+CANONICAL_CSR_CACHE_EXT = '.canonical.csr'
+CSR_CACHE_MAGIC = b'NWCSR'
+CSR_CACHE_VERSION = 3
+CSR_CACHE_HEADER = struct.Struct('<5sHcxIqqqq')
+
+
+def build_csr_index(game_tree: GameTree, path_transitions: str, canonical: bool=False):
+
+    # load the edge shards or the transitions csv file and convert the hashes to packed keys
+    if os.path.isdir(path_transitions):
+        shards = list(ssg.read_edge_shards(path_transitions))
+        before = np.concatenate([shard[0] for shard in shards])
+        after = np.concatenate([shard[1] for shard in shards])
+        del shards
+    else:
+        trans_headers = ['state_before', 'state_after']
+        transitions = pd.read_csv(path_transitions, names=trans_headers)
+        before = sc.hashes_to_keys(transitions['state_before'].to_numpy())
+        after = sc.hashes_to_keys(transitions['state_after'].to_numpy())
+        del transitions
+
+    # map both states of each edge onto their canonical states (remembering the relative mirroring)
+    if canonical:
+        before, before_mirrored = sc.canonical_keys(before)
+        after, after_mirrored = sc.canonical_keys(after)
+
+    # assign integer ids to all states (ids follow the sorted key order)
+    state_keys, state_ids = np.unique(np.concatenate([before, after]), return_inverse=True)
+    before_ids, after_ids = state_ids[:len(before)], state_ids[len(before):]
+
+    # the edges of a state and its mirror image coincide after the canonicalization (keep the first one),
+    # symmetric children look the same in both orientations, so they are never marked as mirrored
+    if canonical:
+        is_symmetric = sc.mirror_keys(after) == after
+        after_ids = after_ids * 2 + ((before_mirrored ^ after_mirrored) & ~is_symmetric)
+        _, first_edges = np.unique(before_ids * (2 * len(state_keys)) + after_ids, return_index=True)
+        first_edges = np.sort(first_edges)
+        before_ids, after_ids = before_ids[first_edges], after_ids[first_edges]
+
+    # group the edges by their source state (stable sort keeps the csv order of children)
+    order = np.argsort(before_ids, kind='stable')
+    counts = np.bincount(before_ids, minlength=len(state_keys))
+
+    game_tree.state_keys = state_keys
+    game_tree.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    game_tree.targets = after_ids[order].astype(np.int64)
+
+
+def write_csr_cache(game_tree: GameTree, path_cache: str, path_transitions: str):
+
+    # remember the source file's size and modification time for cache invalidation
+    source_stat = os.stat(path_transitions)
+    key_type = game_tree.state_keys.dtype
+    header = CSR_CACHE_HEADER.pack(CSR_CACHE_MAGIC, CSR_CACHE_VERSION, key_type.kind.encode('ascii'), key_type.itemsize,
+        len(game_tree.state_keys), len(game_tree.targets), source_stat.st_size, source_stat.st_mtime_ns)
+
+    # write all arrays aligned to 8 bytes, so they can be memory-mapped in place
+    with open(path_cache, 'wb') as file:
+        file.write(header)
+        file.write(b'\0' * (-len(header) % 8))
+        for array in [game_tree.state_keys, game_tree.offsets, game_tree.targets]:
+            file.write(array.tobytes())
+            file.write(b'\0' * (-array.nbytes % 8))
+
+
+def load_csr_cache(game_tree: GameTree, path_cache: str, path_transitions: str):
+
+    # make sure that the cache exists and still belongs to the transitions file
+    if not os.path.isfile(path_cache): return False
+    with open(path_cache, 'rb') as file:
+        header = file.read(CSR_CACHE_HEADER.size)
+    if len(header) < CSR_CACHE_HEADER.size: return False
+    magic, version, key_kind, key_width, num_states, num_edges, source_size, source_mtime = CSR_CACHE_HEADER.unpack(header)
+    source_stat = os.stat(path_transitions)
+    if magic != CSR_CACHE_MAGIC or version != CSR_CACHE_VERSION: return False
+    if source_size != source_stat.st_size or source_mtime != source_stat.st_mtime_ns: return False
+
+    # memory-map the arrays (no csv parsing required)
+    key_type = np.dtype(np.uint64) if key_kind == b'u' else np.dtype(('S', key_width))
+    offset = CSR_CACHE_HEADER.size + (-CSR_CACHE_HEADER.size % 8)
+    arrays = []
+    for dtype, count in [(key_type, num_states), (np.int64, num_states + 1), (np.int64, num_edges)]:
+        array = np.memmap(path_cache, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        offset += array.nbytes + (-array.nbytes % 8)
+        arrays.append(array)
+
+    game_tree.state_keys, game_tree.offsets, game_tree.targets = arrays
+    print('loaded game tree index from {}'.format(path_cache))
+    return True
 
 
 class CsvAgent(object):
 
-    def __init__(self, path_qtable: str, game_tree: GameTree):
+    def __init__(self, path_qtable: str, game_tree: GameTree, canonical: bool=False):
 
         # assign transitions dataframe
         self.game_tree = game_tree
-
-        # load Q table from csv file
-        self.qtable_headers = ['state_before', 'state_after', 'acting_side', 'affected_column', 'q_value']
-        self.qtable = pd.read_csv(path_qtable, names=self.qtable_headers)
+        self.canonical = canonical
+
+        # canonical policies store each pair of mirror images only once (merged by best Q value)
+        if canonical:
+            self.policy_states, self.policy_columns, second_states, second_columns = canonical_policy(path_qtable)
+
+        # binary Q tables are memory-mapped and already hold the greedy actions first
+        elif bq.is_binary_qtable(path_qtable):
+            binary_qtable = bq.BinaryQTable(path_qtable)
+            self.policy_states, self.policy_columns, _ = binary_qtable.policy()
+            second_states, second_columns = binary_qtable.second_best_policy()
+
+        else:
+            # load Q table from csv file
+            self.qtable_headers = ['state_before', 'state_after', 'acting_side', 'affected_column', 'q_value']
+            with ins.phase('read csv'):
+                qtable = pd.read_csv(path_qtable, names=self.qtable_headers)
+                ins.add_rows(len(qtable))
+
+            # precompute the greedy action of each state (ties resolve to the first action in the file)
+            best_rows = qtable.groupby('state_before', sort=False)['q_value'].idxmax()
+            best_actions = qtable.loc[best_rows.values]
+
+            # precompute the second best action of each state (used for semi-greedy play)
+            other_actions = qtable.drop(index=best_rows.values)
+            second_rows = other_actions.groupby('state_before', sort=False)['q_value'].idxmax()
+            second_states = sc.hashes_to_keys(other_actions.loc[second_rows.values, 'state_before'].to_numpy())
+            second_columns = other_actions.loc[second_rows.values, 'affected_column'].to_numpy(dtype=np.int64)
+            del qtable, other_actions
+
+            # key the policy on packed integer states, sorted for binary search
+            policy_states = sc.hashes_to_keys(best_actions['state_before'].to_numpy())
+            order = np.argsort(policy_states, kind='stable')
+            self.policy_states = policy_states[order]
+            self.policy_columns = best_actions['affected_column'].to_numpy(dtype=np.int64)[order]
+
+        # align the second best actions with the policy states (-1 if a state has only one action)
+        self.policy_second_columns = np.full(len(self.policy_states), -1, dtype=np.int64)
+        self.policy_second_columns[self.policy_index(second_states)] = second_columns
 
         print('created agent from {}'.format(path_qtable))
 
 
-    def best_next_state(self, state: str):
+    def policy_index(self, keys):
+
+        # look up the policy rows of the given state keys by binary search (-1 if unknown)
+        keys = np.asarray(keys, dtype=self.policy_states.dtype)
+        rows = np.searchsorted(self.policy_states, keys)
+        rows[rows == len(self.policy_states)] = 0
+        found = self.policy_states[rows] == keys if len(self.policy_states) > 0 else np.zeros(len(keys), dtype=bool)
+        return np.where(found, rows, -1)
 
-        # get all Q values from the Q table
-        next_states = self.game_tree.next_states(state)
-        q_values = self.qtable[self.qtable['state_after'].isin(next_states)]
 
-        q_values = q_values['q_value']
+    def lookup_columns(self, keys, policy_columns):
 
-        # determine the action with the best Q value
-        crit_state_index = q_values.idxmax()
+        # canonical policies are looked up by the canonical states, the columns are mirrored back
+        if not self.canonical:
+            rows = self.policy_index(keys)
+            return np.where(rows >= 0, policy_columns[rows], -1)
+        keys, is_mirrored = sc.canonical_keys(keys)
+        rows = self.policy_index(keys)
+        columns = np.where(rows >= 0, policy_columns[rows], -1)
+        return sc.mirror_columns(columns, is_mirrored, sc.board_size(keys)[1]) if len(keys) > 0 else columns
 
-        critical_state = self.qtable.iloc[crit_state_index][['state_after']]
 
-        critical_column = self.qtable.iloc[crit_state_index][['affected_column']]
+    def best_columns_from_keys(self, keys):
+        # determine the greedy columns for a batch of state keys (-1 for states not in the Q table)
+        return self.lookup_columns(keys, self.policy_columns)
 
-        critical_state = critical_state.values.tolist()[0]
 
-        critical_column = critical_column.values.tolist()[0]
+    def second_best_columns_from_keys(self, keys):
+        # determine the second best columns for a batch of state keys (-1 if there is no second action)
+        return self.lookup_columns(keys, self.policy_second_columns)
+
+
+    def best_columns(self, states: list):
+        return self.best_columns_from_keys(sc.hashes_to_keys(states))
+
+
+    def best_next_state(self, state: str):
+
+        # look up the precomputed greedy action of the state
+        critical_column = int(self.best_columns_from_keys(sc.hashes_to_keys([state]))[0])
+        if critical_column < 0: raise ValueError('State {} is not contained in the Q table!'.format(state))
+
+        # apply the greedy action to get the following state
+        next_fields = sc.apply_actions(sc.hashes_to_fields([state]), [critical_column])
+        critical_state = str(sc.fields_to_hashes(next_fields)[0])
 
         return critical_state, critical_column
 
 
-def get_critical_path(game_tree: GameTree, agent_a: CsvAgent, agent_b: CsvAgent):
+def canonical_policy(path_qtable: str):
+
+    # load all actions of the Q table
+    if bq.is_binary_qtable(path_qtable):
+        qtable = bq.BinaryQTable(path_qtable)
+        keys, columns, q_values = np.array(qtable.keys), qtable.columns.astype(np.int64), qtable.q_values.astype(np.float64)
+    else:
+        qtable_headers = ['state_before', 'state_after', 'acting_side', 'affected_column', 'q_value']
+        qtable = pd.read_csv(path_qtable, names=qtable_headers, usecols=['state_before', 'affected_column', 'q_value'])
+        keys = sc.hashes_to_keys(qtable['state_before'].to_numpy())
+        columns, q_values = qtable['affected_column'].to_numpy(dtype=np.int64), qtable['q_value'].to_numpy(dtype=np.float64)
+    del qtable
+    if len(keys) == 0: return keys, columns, keys, columns
 
-    # initialize the critical path walk
-    initial_state = 'BAUAAAAAAA=='
+    # map the actions of mirrored states onto their canonical states
+    keys, is_mirrored = sc.canonical_keys(keys)
+    columns = sc.mirror_columns(columns, is_mirrored, sc.board_size(keys)[1])
+
+    # rank the actions by state and descending Q value (stable, so ties keep their file order),
+    # an action occuring for both mirror images only keeps its better Q value
+    order = np.lexsort((-q_values, keys))
+    keys, columns = keys[order], columns[order]
+    is_unique = ~pd.DataFrame({'key': keys, 'column': columns}).duplicated().to_numpy()
+    keys, columns = keys[is_unique], columns[is_unique]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:] != keys[:-1]
+    ranks = np.arange(len(keys)) - np.maximum.accumulate(np.where(is_first, np.arange(len(keys)), 0))
+
+    # the first two actions of each state are its best and second best action
+    return keys[ranks == 0], columns[ranks == 0], keys[ranks == 1], columns[ranks == 1]
+
+
+def get_critical_path(game_tree: GameTree, agent_a: CsvAgent, agent_b: CsvAgent, initial_state: str='BAUAAAAAAA=='):
+
+    # initialize the critical path walk (the initial state defaults to the empty 4x5 board)
     crit_path = [initial_state]
     crit_columns_path = []
     is_player_a_acting = True
@@ -88,34 +323,46 @@ def get_critical_path(game_tree: GameTree, agent_a: CsvAgent, agent_b: CsvAgent)
     return crit_path, crit_columns_path
 
 
+ARG_CANONICAL = '--canonical'
+
+
 def main():
 
     # make sure that the Q tables for players A and B are specified
-    if len(sys.argv) < 3: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
-        + "<path_qtable_a.csv>, <path_qtable_b.csv>, [<transitions.csv>]\n"
-        + "The third argument is optional and defaults to './transitions.csv'.")
+    args = [arg for arg in sys.argv[1:] if arg != ARG_CANONICAL]
+    if len(args) < 2: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<path_qtable_a.csv>, <path_qtable_b.csv>, [<transitions.csv>], [--canonical]\n"
+        + "The transitions can also be a directory of edge shards written by state_space_generator.py.\n"
+        + "The third argument is optional and defaults to './transitions.csv'.\n"
+        + "The --canonical option merges the mirror images of all states (half the memory).")
 
     # parse script args
-    path_qtable_a = sys.argv[1]
-    path_qtable_b = sys.argv[2]
-    path_transitions = sys.argv[3]
+    path_qtable_a = args[0]
+    path_qtable_b = args[1]
+    path_transitions = args[2] if len(args) > 2 else './transitions.csv'
+    canonical = ARG_CANONICAL in sys.argv
 
     # make sure that the given files exist before trying to load them
     if not os.path.exists(path_qtable_a) or not os.path.isfile(path_qtable_a): raise ValueError("Q-Table A could not be found!")
     if not os.path.exists(path_qtable_b) or not os.path.isfile(path_qtable_b): raise ValueError("Q-Table B could not be found!")
-    if not os.path.exists(path_transitions) or not os.path.isfile(path_transitions): raise ValueError("Transitions could not be found!")
+    if not os.path.exists(path_transitions): raise ValueError("Transitions could not be found!")
 
     # create game tree and agents
-    game_tree = GameTree(path_transitions)
-    agent_a = CsvAgent(path_qtable_a, game_tree)
-    agent_b = CsvAgent(path_qtable_b, game_tree)
+    game_tree = GameTree(path_transitions, canonical)
+    with ins.phase('load agents'):
+        agent_a = CsvAgent(path_qtable_a, game_tree, canonical)
+        agent_b = CsvAgent(path_qtable_b, game_tree, canonical)
+        ins.add_rows(len(agent_a.policy_states) + len(agent_b.policy_states))
 
     # walk the critical path
-    crit_path, crit_columns_path = get_critical_path(game_tree, agent_a, agent_b)
+    with ins.phase('walk critical path'):
+        crit_path, crit_columns_path = get_critical_path(game_tree, agent_a, agent_b)
+        ins.add_rows(len(crit_columns_path))
     print('critical path:', crit_path)
     print('crit critical path:', crit_columns_path)
 
 
  # run the main script
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    with ins.instrumented_run('critical_path_detection'):
+        main()
\ No newline at end of file
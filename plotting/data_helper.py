@@ -13,10 +13,32 @@ def get_winrate_df_from_csv(winrates_path):
     winrate_df = pd.read_csv(winrates_path, names=header_list)
 
     # Add Column with summed episodes
-    winrate_df[EPISODE] = 0
-    episode_sum = 0
-    for index, row in winrate_df.iterrows():
-        episode_sum += row[LEARNING_STEPS]
-        winrate_df.at[index, EPISODE] = int(episode_sum)
+    winrate_df[EPISODE] = winrate_df[LEARNING_STEPS].cumsum().astype('int64')
 
     return winrate_df
+
+
+# Constants for the columns of the win rate store (written by winrate_store.py)
+EXPERIMENT = 'experiment'
+RUN = 'run'
+AGENT = 'agent'
+SIDE = 'side'
+WIN_RATE = 'winRate'
+SIDE_A = 'A'
+SIDE_B = 'B'
+
+
+# Constants for the Q table convergence metrics (written by qtable_convergence.py)
+CONVERGENCE_CSV = 'qtable_convergence.csv'
+EPISODE_FROM = 'episodeFrom'
+STATES = 'states'
+NEW_STATES = 'newStates'
+POLICY_CHANGES = 'policyChanges'
+POLICY_CHANGE_RATE = 'policyChangeRate'
+MEAN_ABS_DQ = 'meanAbsDeltaQ'
+MAX_ABS_DQ = 'maxAbsDeltaQ'
+CONVERGENCE_HEADERS = [AGENT, EPISODE_FROM, EPISODE, STATES, NEW_STATES, POLICY_CHANGES, POLICY_CHANGE_RATE, MEAN_ABS_DQ, MAX_ABS_DQ]
+
+def get_convergence_df_from_csv(convergence_path):
+    # Read dataframe from csv file
+    return pd.read_csv(convergence_path)
@@ -0,0 +1,76 @@
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import os
+
+import instrumentation as ins
+
+
+# Experiments are laid out as <experiment>/train/logs/<agent A>_vs_<agent B>/win_rates.csv
+# (at any depth below the experiments directory). The index is built in a single directory scan.
+
+WIN_RATES_CSV = 'win_rates.csv'
+
+# output directories never contain training logs, so the scan doesn't descend into them
+SKIPPED_DIRS = ['plots', 'models', 'settings']
+
+
+class Experiment(object):
+
+    def __init__(self, path: Path, name: str):
+        self.path = path
+        self.name = name
+        self.logs_path = path / 'train' / 'logs'
+        self.run_paths = []
+
+
+    def win_rates_paths(self):
+        return [run_path / WIN_RATES_CSV for run_path in self.run_paths]
+
+
+    def plot_path(self, plot_kind: str, image_name: str):
+
+        # create the plots/<plot kind> directory of the experiment (if it doesn't exist yet)
+        plots_path = self.path / 'plots' / plot_kind
+        plots_path.mkdir(parents=True, exist_ok=True)
+        return plots_path / image_name
+
+
+def build_experiment_index(experiments_path: Path):
+
+    # walk the experiments directory once, registering each train/logs directory with its runs
+    experiments = {}
+    for dir_path, dir_names, _ in os.walk(experiments_path):
+        path = Path(dir_path)
+        dir_names[:] = sorted(name for name in dir_names if name not in SKIPPED_DIRS)
+
+        # each directory within train/logs is a run of two agents
+        if path.name == 'logs' and path.parent.name == 'train':
+            experiment_path = path.parents[1]
+            experiment = experiments.setdefault(experiment_path,
+                Experiment(experiment_path, experiment_path.relative_to(experiments_path).as_posix()))
+            experiment.run_paths = [path / name for name in dir_names]
+            dir_names[:] = []
+
+    return [experiments[path] for path in sorted(experiments)]
+
+
+def needs_rendering(image_path: Path, source_paths: list):
+
+    # render missing plots and plots older than one of their sources (missing sources raise FileNotFoundError)
+    source_mtime = max((os.stat(source_path).st_mtime for source_path in source_paths), default=0)
+    return not image_path.exists() or image_path.stat().st_mtime < source_mtime
+
+
+def render_plots(render_function, jobs: list, num_workers: int=os.cpu_count()):
+
+    # render the plots in a process pool (each job is a tuple of render function arguments)
+    with ins.phase('render plots'):
+        if len(jobs) > 1 and num_workers > 1:
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                list(pool.map(render_function, *zip(*jobs)))
+        else:
+            for job in jobs: render_function(*job)
+        ins.add_rows(len(jobs))
+
+    print('rendered {} plots'.format(len(jobs)))
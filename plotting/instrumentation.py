@@ -0,0 +1,200 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+import sys, os, io, json, time, resource, platform
+
+
+# Lightweight instrumentation of the analysis scripts. The hot paths are split into named phases
+# (e.g. 'read csv', 'insert rows', 'render plots'); each phase accumulates its calls, wall time,
+# processed rows and the peak memory when it ended. Named counters hold any other amounts. A phase
+# costs two clock reads and one getrusage call, so the phases are placed around whole steps (never
+# inside per-state loops) and stay enabled in production.
+# Scripts wrap their main function with instrumented_run(), which writes a JSON report when the run
+# ends (also on errors): run_reports/<script>_<YYYY-mm-dd_HH-MM-SS>_<pid>.json or the path given
+# with --run-report <path>. The --profile option additionally captures a cProfile profile (stored
+# next to the report) and the top allocation sites of tracemalloc, which slows the run down.
+# Both options are removed from sys.argv before the script parses its own arguments.
+
+ARG_PROFILE = '--profile'
+ARG_RUN_REPORT = '--run-report'
+DEFAULT_REPORTS_PATH = Path('run_reports')
+REPORT_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+NUM_PROFILE_FUNCTIONS = 30
+NUM_ALLOCATION_SITES = 20
+
+
+def peak_rss_mib(who=resource.RUSAGE_SELF):
+    # the max resident set size is reported in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+class PhaseRecord(object):
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.peak_rss_mib = 0.0
+
+
+    def add_rows(self, num_rows: int):
+        self.rows += int(num_rows)
+
+
+    def to_dict(self):
+        return {'name': self.name, 'calls': self.calls, 'seconds': self.seconds, 'rows': self.rows,
+            'rows_per_second': self.rows / self.seconds if self.rows > 0 and self.seconds > 0 else None,
+            'peak_rss_mib': self.peak_rss_mib}
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.active = []
+
+
+    @contextmanager
+    def phase(self, name: str):
+
+        # nested phases are named after their parents (e.g. 'import model/read csv')
+        full_name = '/'.join([record.name for record in self.active] + [name])
+        record = self.phases.get(full_name)
+        if record is None: record = self.phases[full_name] = PhaseRecord(full_name)
+        self.active.append(record)
+        start_time = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.seconds += time.perf_counter() - start_time
+            record.calls += 1
+            record.peak_rss_mib = peak_rss_mib()
+            self.active.pop()
+
+
+    def count(self, name: str, amount: int=1):
+        self.counters[name] = self.counters.get(name, 0) + int(amount)
+
+
+    def add_rows(self, num_rows: int):
+        # attribute rows to the innermost active phase (ignored outside of phases)
+        if len(self.active) > 0: self.active[-1].add_rows(num_rows)
+
+
+# the recorder of this process (the scripts' phases are always recorded, reports are only written by instrumented_run)
+RECORDER = Recorder()
+
+def phase(name: str):
+    return RECORDER.phase(name)
+
+def count(name: str, amount: int=1):
+    RECORDER.count(name, amount)
+
+def add_rows(num_rows: int):
+    RECORDER.add_rows(num_rows)
+
+
+def pop_run_args(argv: list):
+
+    # remove the instrumentation options from the script arguments
+    is_profiling = ARG_PROFILE in argv
+    report_path = None
+    if ARG_RUN_REPORT in argv:
+        i = argv.index(ARG_RUN_REPORT)
+        if i + 1 >= len(argv): raise ValueError('Invalid arguments! Script argument {} expects a file path!'.format(ARG_RUN_REPORT))
+        report_path = Path(argv[i + 1])
+        del argv[i:i + 2]
+    argv[:] = [arg for arg in argv if arg != ARG_PROFILE]
+    return is_profiling, report_path
+
+
+def profile_stats(profiler, profile_path: Path):
+
+    # store the full profile (e.g. for snakeviz) and summarize the most expensive functions
+    import pstats
+    profiler.dump_stats(profile_path)
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    functions = []
+    for (file_name, line, function), (_, num_calls, total_time, cumulative_time, _) in stats.stats.items():
+        functions.append({'function': '{}:{}({})'.format(file_name, line, function), 'calls': num_calls,
+            'total_seconds': total_time, 'cumulative_seconds': cumulative_time})
+    functions.sort(key=lambda entry: entry['cumulative_seconds'], reverse=True)
+    return {'path': str(profile_path), 'top_functions': functions[:NUM_PROFILE_FUNCTIONS]}
+
+
+def allocation_stats(snapshot, peak_bytes: int):
+
+    # the allocation sites holding the most memory at the end of the run
+    sites = []
+    for statistic in snapshot.statistics('lineno')[:NUM_ALLOCATION_SITES]:
+        frame = statistic.traceback[0]
+        sites.append({'location': '{}:{}'.format(frame.filename, frame.lineno),
+            'size_mib': statistic.size / 2**20, 'blocks': statistic.count})
+    return {'peak_traced_mib': peak_bytes / 2**20, 'top_allocations': sites}
+
+
+def build_report(script_name: str, argv: list, started: datetime, wall_seconds: float, status: str, error: str=None):
+    cpu_times = os.times()
+    return {
+        'script': script_name,
+        'argv': argv,
+        'started': started.isoformat(timespec='seconds'),
+        'status': status,
+        'error': error,
+        'wall_seconds': wall_seconds,
+        'cpu_seconds': cpu_times.user + cpu_times.system,
+        'children_cpu_seconds': cpu_times.children_user + cpu_times.children_system,
+        'peak_rss_mib': peak_rss_mib(),
+        'children_peak_rss_mib': peak_rss_mib(resource.RUSAGE_CHILDREN),
+        'phases': [record.to_dict() for record in RECORDER.phases.values()],
+        'counters': dict(RECORDER.counters),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'pid': os.getpid()
+    }
+
+
+@contextmanager
+def instrumented_run(script_name: str):
+
+    # parse the instrumentation options (before the script parses its own arguments)
+    argv = list(sys.argv)
+    is_profiling, report_path = pop_run_args(sys.argv)
+    started = datetime.now(timezone.utc)
+    if report_path is None:
+        report_path = DEFAULT_REPORTS_PATH / '{}_{}_{}.json'.format(script_name, started.astimezone().strftime(REPORT_TIME_FORMAT), os.getpid())
+
+    # start the optional profilers
+    profiler = None
+    if is_profiling:
+        import cProfile, tracemalloc
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    # run the script (the report is also written if it fails)
+    start_time = time.perf_counter()
+    status, error = 'ok', None
+    try:
+        yield RECORDER
+    except BaseException as ex:
+        status, error = ('interrupted', None) if isinstance(ex, KeyboardInterrupt) else ('failed', '{}: {}'.format(type(ex).__name__, ex))
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - start_time
+        report = build_report(script_name, argv, started, wall_seconds, status, error)
+
+        # summarize the profiles
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        if profiler is not None:
+            profiler.disable()
+            snapshot, (_, peak_bytes) = tracemalloc.take_snapshot(), tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report['profile'] = profile_stats(profiler, report_path.with_suffix('.prof'))
+            report['memory'] = allocation_stats(snapshot, peak_bytes)
+
+        with open(report_path, 'w') as file:
+            json.dump(report, file, indent=2)
+        print('wrote run report to {}'.format(report_path))
@@ -0,0 +1,190 @@
+
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import sys, os
+
+import state_codec as sc
+import connect_n as cn
+from critical_path_detection import GameTree, CsvAgent
+import instrumentation as ins
+
+
+# The game-theoretic value of each state is stored from the perspective of the side to move
+# (1 = win, 0 = tie, -1 = loss). All states of a depth (= amount of stones) only lead to states
+# of the next depth, so the values are solved exactly by a retrograde pass from the deepest
+# states up to the initial state (negamax over the complete game tree, no search or pruning required).
+
+WIN = 1
+TIE = 0
+LOSS = -1
+# the values depend on the amount of stones to connect, so the persisted arrays are named after it
+VALUES_EXT = '.w{}.values.npy'
+DEPTHS_EXT = '.w{}.depths.npy'
+CLASSIFY_CHUNK_SIZE = 1000000
+DEFAULT_NUM_WORST = 20
+
+ARG_JOBS = '--jobs'
+ARG_WORST = '--worst'
+ARG_WORST_CSV = '--worst-csv'
+ALL_ARG_SPECIFIERS = [ARG_JOBS, ARG_WORST, ARG_WORST_CSV]
+
+
+def classify_states(keys, is_terminal, win_conn: int):
+
+    # count the stones of each state and check whether the last acting side connected win_conn stones
+    fields = sc.keys_to_fields(keys)
+    depths = np.count_nonzero(fields.reshape(len(fields), -1), axis=1)
+    last_sides = np.where(depths % 2 == 1, cn.SIDE_A, cn.SIDE_B)
+    is_win = np.zeros(len(keys), dtype=bool)
+    if is_terminal.any():
+        is_win[is_terminal] = cn.is_connect_n(fields[is_terminal], last_sides[is_terminal], win_conn)
+
+    # terminal states are lost for the side to move if the opponent won, otherwise they are a tie
+    return depths.astype(np.int16), np.where(is_win, LOSS, TIE).astype(np.int8)
+
+
+def solve_game_tree(game_tree: GameTree, win_conn: int, num_workers: int=os.cpu_count()):
+
+    # the retrograde pass relies on the plain successor states of the CSR index
+    if game_tree.canonical: raise ValueError('Invalid arguments! The oracle requires a game tree without canonicalization!')
+    num_states = len(game_tree.state_keys)
+    offsets = np.asarray(game_tree.offsets)
+    is_terminal = offsets[1:] == offsets[:-1]
+
+    # classify the states chunk by chunk in parallel (depth, terminal value)
+    bounds = list(range(0, num_states, CLASSIFY_CHUNK_SIZE))
+    key_chunks = [np.asarray(game_tree.state_keys[i:i + CLASSIFY_CHUNK_SIZE]) for i in bounds]
+    terminal_chunks = [is_terminal[i:i + CLASSIFY_CHUNK_SIZE] for i in bounds]
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        results = list(pool.map(classify_states, key_chunks, terminal_chunks, [win_conn] * len(bounds)))
+    del key_chunks
+    depths = np.concatenate([chunk_depths for chunk_depths, _ in results]) if len(results) > 0 else np.zeros(0, dtype=np.int16)
+    values = np.concatenate([chunk_values for _, chunk_values in results]) if len(results) > 0 else np.zeros(0, dtype=np.int8)
+
+    # solve the non-terminal states depth by depth, starting at the deepest states
+    for depth in range(int(depths.max(initial=0)), -1, -1):
+        state_ids = np.flatnonzero((depths == depth) & ~is_terminal)
+        if len(state_ids) == 0: continue
+
+        # gather the edges of all states at this depth (consecutive per state in the CSR targets)
+        starts, counts = offsets[state_ids], offsets[state_ids + 1] - offsets[state_ids]
+        group_starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        edge_ids = np.repeat(starts - group_starts, counts) + np.arange(counts.sum())
+
+        # negamax: a state is worth the best negated value of its successor states
+        child_values = -values[game_tree.targets[edge_ids]]
+        values[state_ids] = np.maximum.reduceat(child_values, group_starts)
+
+    return values, depths
+
+
+def load_or_solve_values(game_tree: GameTree, win_conn: int, num_workers: int=os.cpu_count()):
+
+    # re-use the persisted values as long as they are newer than the game tree index
+    path_values = game_tree.path_cache + VALUES_EXT.format(win_conn)
+    path_depths = game_tree.path_cache + DEPTHS_EXT.format(win_conn)
+    cache_mtime = os.path.getmtime(game_tree.path_cache)
+    if all(os.path.isfile(path) and os.path.getmtime(path) >= cache_mtime for path in [path_values, path_depths]):
+        values, depths = np.load(path_values, mmap_mode='r'), np.load(path_depths, mmap_mode='r')
+        if len(values) == len(game_tree.state_keys):
+            print('loaded state values from {}'.format(path_values))
+            return values, depths
+
+    # solve the game tree and persist the values as memory-mappable arrays
+    values, depths = solve_game_tree(game_tree, win_conn, num_workers)
+    np.save(path_values, values)
+    np.save(path_depths, depths)
+    print('wrote state values to {}'.format(path_values))
+    return np.load(path_values, mmap_mode='r'), np.load(path_depths, mmap_mode='r')
+
+
+def score_policy(game_tree: GameTree, values, depths, agent: CsvAgent):
+
+    # evaluate all non-terminal states of the game tree that are covered by the Q table
+    offsets = game_tree.offsets
+    state_ids = np.flatnonzero(agent.policy_index(game_tree.state_keys) >= 0)
+    state_ids = state_ids[offsets[state_ids + 1] > offsets[state_ids]]
+    state_keys = np.asarray(game_tree.state_keys[state_ids])
+    columns = agent.best_columns_from_keys(state_keys)
+
+    # apply the greedy actions and look up the values of the resulting states
+    fields = sc.keys_to_fields(state_keys)
+    is_legal = fields[np.arange(len(fields)), -1, columns] == 0
+    next_ids = np.full(len(state_ids), -1)
+    if is_legal.any():
+        next_keys = sc.fields_to_keys(sc.apply_actions(fields[is_legal], columns[is_legal]))
+        next_ids[is_legal] = game_tree.state_ids(next_keys)
+    is_valid = next_ids >= 0
+
+    # compare the achieved values with the optimal values (invalid moves count as losses)
+    optimal = np.asarray(values[state_ids], dtype=np.int8)
+    achieved = np.where(is_valid, -np.asarray(values)[np.maximum(next_ids, 0)], LOSS).astype(np.int8)
+    return pd.DataFrame({
+        'state': sc.keys_to_hashes(state_keys),
+        'depth': np.asarray(depths[state_ids]),
+        'column': columns,
+        'optimal_value': optimal,
+        'achieved_value': achieved,
+        'value_loss': (optimal - achieved).astype(np.int8),
+        'valid_move': is_valid
+    })
+
+
+def report_scores(path_qtable: str, scores: pd.DataFrame, num_worst: int=DEFAULT_NUM_WORST):
+
+    # print the overall fraction of optimal moves
+    num_states = len(scores)
+    is_blunder = scores['value_loss'] > 0
+    print('{}: {} states scored, {:.2%} optimal moves, {} blunders, {} invalid moves'.format(
+        path_qtable, num_states, 1 - is_blunder.mean() if num_states > 0 else 0, int(is_blunder.sum()), int((~scores['valid_move']).sum())))
+
+    # print the blunders by depth
+    by_depth = scores.groupby('depth').agg(states=('value_loss', 'size'), blunders=('value_loss', lambda loss: int((loss > 0).sum())))
+    by_depth['blunder_rate'] = by_depth['blunders'] / by_depth['states']
+    print(by_depth.to_string())
+
+    # the worst states lose the most value as early as possible
+    worst = scores[is_blunder].sort_values(['value_loss', 'depth'], ascending=[False, True], kind='stable').head(num_worst)
+    print(worst.to_string(index=False))
+    return worst
+
+
+def main():
+
+    # make sure that the game tree, win_conn and at least one Q table are specified
+    args = []
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        if arg not in ALL_ARG_SPECIFIERS and sys.argv[i - 1] not in ALL_ARG_SPECIFIERS: args.append(arg)
+    if len(args) < 3: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<transitions.csv | edge shards dir> <win_conn> <path_qtable.csv> [<path_qtable.csv> ...] "
+        + "[--jobs <workers>] [--worst <count>] [--worst-csv <path.csv>]")
+
+    # parse script args
+    path_transitions, win_conn, paths_qtable = args[0], int(args[1]), args[2:]
+    num_workers = int(sys.argv[sys.argv.index(ARG_JOBS) + 1]) if ARG_JOBS in sys.argv else os.cpu_count()
+    num_worst = int(sys.argv[sys.argv.index(ARG_WORST) + 1]) if ARG_WORST in sys.argv else DEFAULT_NUM_WORST
+    if not os.path.exists(path_transitions): raise ValueError("Transitions could not be found!")
+    for path_qtable in paths_qtable:
+        if not os.path.isfile(path_qtable): raise ValueError("Q-Table {} could not be found!".format(path_qtable))
+
+    # solve the game tree once, then score each Q table against it
+    game_tree = GameTree(path_transitions)
+    values, depths = load_or_solve_values(game_tree, win_conn, num_workers)
+    if len(values) > 0: print('initial state value: {}'.format(int(values[np.argmin(depths)])))
+    all_worst = []
+    for path_qtable in paths_qtable:
+        worst = report_scores(path_qtable, score_policy(game_tree, values, depths, CsvAgent(path_qtable, game_tree)), num_worst)
+        all_worst.append(worst.assign(qtable=path_qtable))
+
+    # export the worst states of all Q tables
+    if ARG_WORST_CSV in sys.argv:
+        path_worst = sys.argv[sys.argv.index(ARG_WORST_CSV) + 1]
+        pd.concat(all_worst, ignore_index=True).to_csv(path_worst, index=False)
+        print('wrote worst states to {}'.format(path_worst))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('optimality_oracle'):
+        main()
@@ -0,0 +1,146 @@
+
+import pandas as pd
+import numpy as np
+import sys, os, re
+from pathlib import Path
+
+import binary_qtable as bq
+import data_helper as dh
+import instrumentation as ins
+
+
+# the training session overwrites {agent name}_0.csv after every training interval and only renames it to
+# {agent name}_{episode}.csv on exit, so a training run leaves a single episode-tagged checkpoint unless the
+# training settings set a checkpoint_interval (e.g. equal to the training_interval) to keep a copy of
+# each interval; only the episode-tagged checkpoints are snapshots of a fixed training progress
+CHECKPOINT_PATTERN = re.compile(r'^(?P<agent>.+)_(?P<episode>\d+)\.(csv|nwq)$')
+DEFAULT_BLOCK_SIZE = 1000000
+
+
+def find_checkpoints(models_path: Path):
+
+    # collect the episode-tagged checkpoints of an agent (binary files are preferred over csv files)
+    checkpoints = {}
+    for model_path in sorted(models_path.iterdir()):
+        match = CHECKPOINT_PATTERN.match(model_path.name)
+        if match is None or int(match.group('episode')) == 0: continue
+        episode = int(match.group('episode'))
+        if episode not in checkpoints or bq.is_binary_qtable(model_path):
+            checkpoints[episode] = model_path
+
+    return sorted(checkpoints.items())
+
+
+def open_checkpoint(model_path: Path, binary_path: Path=None):
+
+    # convert csv checkpoints once into a binary Q table (re-used as long as it is newer than the csv),
+    # stored next to the csv file unless another path is given
+    if bq.is_binary_qtable(model_path): return bq.BinaryQTable(str(model_path))
+    if binary_path is None: binary_path = model_path.with_suffix(bq.BINARY_QTABLE_EXT)
+    if not binary_path.exists() or binary_path.stat().st_mtime < model_path.stat().st_mtime:
+        bq.convert_csv_to_binary(str(model_path), str(binary_path))
+    return bq.BinaryQTable(str(binary_path))
+
+
+def block_boundaries(old: bq.BinaryQTable, new: bq.BinaryQTable, block_size: int):
+
+    # sample boundary keys from both tables, so no block holds more than ~block_size records of each table
+    sample_keys = np.unique(np.concatenate([old.keys[::block_size], new.keys[::block_size]]))
+    old_bounds = np.concatenate([[0], np.searchsorted(old.keys, sample_keys[1:]), [len(old.keys)]])
+    new_bounds = np.concatenate([[0], np.searchsorted(new.keys, sample_keys[1:]), [len(new.keys)]])
+    return zip(old_bounds[:-1], old_bounds[1:], new_bounds[:-1], new_bounds[1:])
+
+
+def first_records(keys):
+    # the first record of each state holds its greedy action
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = keys[1:] != keys[:-1]
+    return is_first
+
+
+def compare_checkpoints(old: bq.BinaryQTable, new: bq.BinaryQTable, block_size: int=DEFAULT_BLOCK_SIZE):
+
+    metrics = {'states_old': 0, 'states_new': 0, 'new_states': 0, 'common_states': 0,
+        'policy_changes': 0, 'common_actions': 0, 'sum_abs_dq': 0.0, 'max_abs_dq': 0.0}
+
+    # sort-merge-join both checkpoints block by block (both are sorted by state key)
+    for old_start, old_end, new_start, new_end in block_boundaries(old, new, block_size):
+        old_block = pd.DataFrame({'key': np.asarray(old.keys[old_start:old_end]),
+            'column': np.asarray(old.columns[old_start:old_end]), 'q': np.asarray(old.q_values[old_start:old_end], dtype=np.float64)})
+        new_block = pd.DataFrame({'key': np.asarray(new.keys[new_start:new_end]),
+            'column': np.asarray(new.columns[new_start:new_end]), 'q': np.asarray(new.q_values[new_start:new_end], dtype=np.float64)})
+
+        # compare the greedy actions of the states contained in both checkpoints
+        old_best = old_block[first_records(old_block['key'].to_numpy())]
+        new_best = new_block[first_records(new_block['key'].to_numpy())]
+        common = new_best.merge(old_best, on='key', suffixes=('_new', '_old'))
+        metrics['states_old'] += len(old_best)
+        metrics['states_new'] += len(new_best)
+        metrics['common_states'] += len(common)
+        metrics['new_states'] += len(new_best) - len(common)
+        metrics['policy_changes'] += int((common['column_new'] != common['column_old']).sum())
+
+        # compare the Q values of the (state, action) pairs contained in both checkpoints
+        actions = new_block.merge(old_block, on=['key', 'column'], suffixes=('_new', '_old'))
+        abs_dq = (actions['q_new'] - actions['q_old']).abs()
+        metrics['common_actions'] += len(actions)
+        metrics['sum_abs_dq'] += float(abs_dq.sum())
+        if len(abs_dq) > 0: metrics['max_abs_dq'] = max(metrics['max_abs_dq'], float(abs_dq.max()))
+
+    return metrics
+
+
+def analyze_agent(models_path: Path, block_size: int=DEFAULT_BLOCK_SIZE):
+
+    # compare each checkpoint with its predecessor
+    rows = []
+    checkpoints = find_checkpoints(models_path)
+    for (old_episode, old_path), (new_episode, new_path) in zip(checkpoints[:-1], checkpoints[1:]):
+        metrics = compare_checkpoints(open_checkpoint(old_path), open_checkpoint(new_path), block_size)
+        rows.append({
+            dh.AGENT: models_path.name,
+            dh.EPISODE_FROM: old_episode,
+            dh.EPISODE: new_episode,
+            dh.STATES: metrics['states_new'],
+            dh.NEW_STATES: metrics['new_states'],
+            dh.POLICY_CHANGES: metrics['policy_changes'],
+            dh.POLICY_CHANGE_RATE: metrics['policy_changes'] / max(metrics['common_states'], 1),
+            dh.MEAN_ABS_DQ: metrics['sum_abs_dq'] / max(metrics['common_actions'], 1),
+            dh.MAX_ABS_DQ: metrics['max_abs_dq']
+        })
+        print('compared {} with {}'.format(old_path.name, new_path.name))
+
+    return rows
+
+
+def analyze_experiment(experiment_path: Path, block_size: int=DEFAULT_BLOCK_SIZE):
+
+    # analyze the checkpoints of all agents trained in the experiment
+    models_path = experiment_path / 'train' / 'models'
+    if not models_path.exists(): raise ValueError('No trained models found in {}!'.format(models_path))
+    rows = []
+    for agent_models_path in sorted(models_path.iterdir()):
+        if agent_models_path.is_dir(): rows += analyze_agent(agent_models_path, block_size)
+
+    # write the metrics next to the experiment's logs
+    metrics_path = experiment_path / 'train' / dh.CONVERGENCE_CSV
+    pd.DataFrame(rows, columns=dh.CONVERGENCE_HEADERS).to_csv(metrics_path, index=False)
+    print('wrote Q table convergence metrics to {}'.format(metrics_path))
+
+
+def main():
+
+    # make sure that at least one experiment is specified
+    if len(sys.argv) < 2: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<experiment_dir> [<experiment_dir> ...]\n"
+        + "Each experiment needs the trained checkpoints in train/models/<agent>/<agent>_<episode>.csv\n"
+        + "(train with the checkpoint_interval setting to keep more than the final checkpoint)")
+
+    for experiment_dir in sys.argv[1:]:
+        analyze_experiment(Path(experiment_dir))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('qtable_convergence'):
+        main()
@@ -0,0 +1,56 @@
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from pathlib import Path
+
+import data_helper as dh
+import experiment_index as ei
+import instrumentation as ins
+
+
+def plot_qtable_convergence(convergence_path, image_path):
+    # Read the checkpoint comparisons of the experiment (written by qtable_convergence.py)
+    convergence_df = dh.get_convergence_df_from_csv(convergence_path)
+
+    # Create one subplot for the policy changes and one for the Q value changes
+    figure, (policy_ax, dq_ax) = plt.subplots(2, 1, sharex=True, figsize=(8, 8))
+
+    # Plot the metrics of each agent over the episode of the newer checkpoint
+    for agent, agent_df in convergence_df.groupby(dh.AGENT, sort=True):
+        agent_df = agent_df.sort_values(dh.EPISODE)
+        policy_ax.plot(agent_df[dh.EPISODE], agent_df[dh.POLICY_CHANGE_RATE], marker='o', label=agent)
+        dq_ax.plot(agent_df[dh.EPISODE], agent_df[dh.MEAN_ABS_DQ], marker='o', label=agent)
+
+    # Set the axis labels
+    policy_ax.set_ylabel('policy change rate')
+    dq_ax.set_ylabel('mean |delta Q|')
+    dq_ax.set_xlabel(dh.EPISODE)
+
+    # Show legend
+    policy_ax.legend()
+
+    # Save plot as image and release the figure
+    figure.savefig(image_path)
+    plt.close(figure)
+
+
+if __name__=='__main__':
+    with ins.instrumented_run('qtable_convergence_plotter'):
+        # Create path to experiments directory
+        experiments_path = Path(Path().cwd().parents[0] / 'experiments')
+
+        # Collect the plots to be rendered (one plot per experiment with convergence metrics)
+        jobs = []
+        for experiment in ei.build_experiment_index(experiments_path):
+            convergence_path = experiment.path / 'train' / dh.CONVERGENCE_CSV
+            if not convergence_path.exists():
+                continue
+
+            # Only render plots that are older than their convergence metrics
+            image_path = experiment.plot_path('qtable_convergence', 'qtable_convergence.png')
+            if ei.needs_rendering(image_path, [convergence_path]):
+                jobs.append((convergence_path, image_path))
+
+        # Render all outdated plots in parallel
+        ei.render_plots(plot_qtable_convergence, jobs)
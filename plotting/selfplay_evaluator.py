@@ -0,0 +1,174 @@
+
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+import numpy as np
+import sys, os, json
+
+import state_codec as sc
+import connect_n as cn
+from critical_path_detection import CsvAgent
+import instrumentation as ins
+
+
+ARG_GAMES = '--games'
+ARG_EPSILON_A = '--epsilon-a'
+ARG_EPSILON_B = '--epsilon-b'
+ARG_JOBS = '--jobs'
+ARG_SEED = '--seed'
+ALL_ARG_SPECIFIERS = [ARG_GAMES, ARG_EPSILON_A, ARG_EPSILON_B, ARG_JOBS, ARG_SEED]
+RANDOM_PLAYER = 'random'
+DEFAULT_NUM_GAMES = 10000
+GAMES_PER_BATCH = 10000
+
+USAGE_MESSAGE = """Usage:
+python3 selfplay_evaluator.py <settings.json> <qtable_a.csv|random> <qtable_b.csv|random>
+    [--games <count>] [--epsilon-a <epsilon>] [--epsilon-b <epsilon>] [--jobs <workers>] [--seed <seed>]
+
+The game settings (rows, columns, win_conn) are read from the settings file.
+Q tables can be csv files or binary Q tables, 'random' picks a random legal column each turn.
+Semi-greedy players pick their second best action with the given epsilon probability.
+"""
+
+# game results per board
+RUNNING = 0
+WIN_SIDE_A = cn.SIDE_A
+WIN_SIDE_B = cn.SIDE_B
+TIE = 3
+
+
+class RandomPlayer(object):
+
+    def choose_columns(self, fields, legal, rng: np.random.Generator):
+        return cn.random_legal_columns(legal, rng)
+
+
+class QTablePlayer(object):
+
+    def __init__(self, agent: CsvAgent, epsilon: float=0.0):
+
+        # make sure the epsilon is a valid probability
+        if epsilon < 0 or epsilon > 1: raise ValueError('Invalid arguments! Epsilon needs to be within [0; 1]!')
+        self.agent = agent
+        self.epsilon = epsilon
+
+
+    def choose_columns(self, fields, legal, rng: np.random.Generator):
+
+        # look up the greedy columns of all boards at once
+        keys = sc.fields_to_keys(fields)
+        columns = self.agent.best_columns_from_keys(keys)
+
+        # semi-greedy: play the second best action in epsilon case (if there is one)
+        if self.epsilon > 0:
+            second_columns = self.agent.second_best_columns_from_keys(keys)
+            is_explore = (rng.random(len(keys)) < self.epsilon) & (second_columns >= 0)
+            columns = np.where(is_explore, second_columns, columns)
+
+        # states unknown to the Q table get a random legal column
+        is_unknown = columns < 0
+        is_unknown[~is_unknown] = ~legal[np.flatnonzero(~is_unknown), columns[~is_unknown]]
+        if is_unknown.any():
+            columns[is_unknown] = cn.random_legal_columns(legal[is_unknown], rng)
+
+        return columns
+
+
+def play_games(player_a, player_b, num_games: int, rows: int, cols: int, win_conn: int, rng: np.random.Generator):
+
+    # initialize all boards at once
+    fields = cn.initial_boards(num_games, rows, cols)
+    heights = np.zeros((num_games, cols), dtype=np.int64)
+    board_ids = np.arange(num_games)
+    results = np.full(num_games, RUNNING, dtype=np.int8)
+
+    # let both sides draw alternatingly on all running boards
+    for turn in range(rows * cols):
+        side, player = (cn.SIDE_A, player_a) if turn % 2 == 0 else (cn.SIDE_B, player_b)
+        columns = player.choose_columns(fields, cn.legal_moves(fields), rng)
+        cn.drop_stones(fields, heights, columns, side)
+
+        # finish the won games and only keep the running boards
+        is_win = cn.is_connect_n(fields, side, win_conn)
+        results[board_ids[is_win]] = side
+        fields, heights, board_ids = fields[~is_win], heights[~is_win], board_ids[~is_win]
+        if len(board_ids) == 0: break
+
+    # all boards still running are entirely occupied
+    results[board_ids] = TIE
+    return results
+
+
+# the players are inherited by the forked worker processes (no pickling of the Q tables)
+_worker_players = None
+
+def play_games_worker(num_games: int, game_settings: dict, seed_sequence: np.random.SeedSequence):
+
+    player_a, player_b = _worker_players
+    results = play_games(player_a, player_b, num_games, game_settings['rows'],
+        game_settings['columns'], game_settings['win_conn'], np.random.default_rng(seed_sequence))
+    return np.bincount(results, minlength=TIE + 1)
+
+
+def evaluate(player_a, player_b, game_settings: dict, num_games: int=DEFAULT_NUM_GAMES,
+        num_workers: int=os.cpu_count(), seed: int=None):
+
+    # split the games into batches with independent random streams
+    global _worker_players
+    _worker_players = (player_a, player_b)
+    batch_sizes = [min(GAMES_PER_BATCH, num_games - i) for i in range(0, num_games, GAMES_PER_BATCH)]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+
+    # play the batches on all cores (forked workers share the loaded Q tables copy-on-write)
+    if num_workers > 1 and len(batch_sizes) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('fork')) as pool:
+            counts = list(pool.map(play_games_worker, batch_sizes, [game_settings] * len(batch_sizes), seed_sequences))
+    else:
+        counts = [play_games_worker(size, game_settings, seeds) for size, seeds in zip(batch_sizes, seed_sequences)]
+
+    counts = np.sum(counts, axis=0)
+    return {'games': num_games, 'wins_a': int(counts[WIN_SIDE_A]),
+        'wins_b': int(counts[WIN_SIDE_B]), 'ties': int(counts[TIE])}
+
+
+def create_player(player_arg: str, epsilon: float):
+
+    # create a random player or load the Q table
+    if player_arg == RANDOM_PLAYER: return RandomPlayer()
+    if not os.path.isfile(player_arg): raise ValueError('Invalid arguments! Q-Table {} could not be found!'.format(player_arg))
+    return QTablePlayer(CsvAgent(player_arg, None), epsilon)
+
+
+def get_arg_value(arg: str, default):
+    return type(default)(sys.argv[sys.argv.index(arg) + 1]) if arg in sys.argv else default
+
+
+def main():
+
+    # validate script arguments
+    if len(sys.argv) < 4 or sys.argv[1] in ALL_ARG_SPECIFIERS: raise ValueError('Invalid arguments! ' + USAGE_MESSAGE)
+    settings_path, player_a_arg, player_b_arg = sys.argv[1:4]
+    if not os.path.isfile(settings_path): raise ValueError('Invalid arguments! Settings file {} could not be found!'.format(settings_path))
+
+    # parse script arguments
+    with open(settings_path, 'r') as file:
+        game_settings = json.load(file)['game_settings']
+    num_games = get_arg_value(ARG_GAMES, DEFAULT_NUM_GAMES)
+    num_workers = get_arg_value(ARG_JOBS, os.cpu_count())
+    seed = int(sys.argv[sys.argv.index(ARG_SEED) + 1]) if ARG_SEED in sys.argv else None
+
+    # load the players and play all games
+    player_a = create_player(player_a_arg, get_arg_value(ARG_EPSILON_A, 0.0))
+    player_b = create_player(player_b_arg, get_arg_value(ARG_EPSILON_B, 0.0))
+    results = evaluate(player_a, player_b, game_settings, num_games, num_workers, seed)
+
+    # print the results in the same format as the training sessions
+    print('inference results: {} games played, side A wins {}, side B wins {}, ties {}'.format(
+        results['games'], results['wins_a'], results['wins_b'], results['ties']))
+    print('win rates: side A {:.4f}, side B {:.4f}, ties {:.4f}'.format(
+        results['wins_a'] / num_games, results['wins_b'] / num_games, results['ties'] / num_games))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('selfplay_evaluator'):
+        main()
@@ -0,0 +1,225 @@
+
+import numpy as np
+
+
+# The game states are exported by GameStateHashFactory.ToBase64Hash as Base64 strings
+# of the bytes [max rows, max columns, fields...] with 2 bits per field (4 fields per byte,
+# first field in the highest bits, field index = row * columns + column, row 0 at the bottom).
+# This module converts whole columns of those hashes in bulk NumPy operations to:
+#   - raw hash bytes:  uint8 array of shape (n, num_bytes)
+#   - packed keys:     uint64 array (big-endian byte order, if num_bytes <= 8)
+#                      or fixed-width bytes array 'S{num_bytes}' (larger boards)
+#   - field arrays:    uint8 array of shape (n, rows, columns) with 0 = none, 1 = side A, 2 = side B
+# Both key kinds sort in the same order as the raw hash bytes, so they can be used
+# for np.unique, np.searchsorted and sort-merge joins.
+
+BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+BASE64_LOOKUP = np.full(256, 255, dtype=np.uint8)
+BASE64_LOOKUP[np.frombuffer(BASE64_ALPHABET, dtype=np.uint8)] = np.arange(64, dtype=np.uint8)
+BASE64_LOOKUP[ord('=')] = 0
+
+FIELD_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+MAX_INT_KEY_BYTES = 8
+
+
+def num_hash_bytes(rows: int, cols: int):
+    # header bytes + 4 fields per byte (last byte zero-padded)
+    return 2 + (rows * cols + 3) // 4
+
+
+def key_dtype(rows: int, cols: int):
+    num_bytes = num_hash_bytes(rows, cols)
+    return np.dtype(np.uint64) if num_bytes <= MAX_INT_KEY_BYTES else np.dtype(('S', num_bytes))
+
+
+def hashes_to_bytes(hashes):
+
+    # view the Base64 strings as a (n, hash length) character matrix
+    chars = np.asarray(hashes, dtype='S')
+    hash_len = chars.dtype.itemsize
+    if len(chars) == 0: return np.zeros((0, 0), dtype=np.uint8)
+    if hash_len % 4 != 0: raise ValueError('Invalid Base64 hashes! Hash length must be a multiple of 4.')
+    chars = chars.view(np.uint8).reshape(len(chars), hash_len)
+
+    # translate the characters to 6-bit values (padding characters count as zeros)
+    sextets = BASE64_LOOKUP[chars]
+    if (sextets == 255).any(): raise ValueError('Invalid Base64 hashes! Hashes must have equal length and use the Base64 alphabet.')
+
+    # merge every 4 sextets into 3 bytes
+    sextets = sextets.reshape(len(chars), -1, 4).astype(np.uint32)
+    groups = (sextets[:, :, 0] << 18) | (sextets[:, :, 1] << 12) | (sextets[:, :, 2] << 6) | sextets[:, :, 3]
+    raw = np.stack([groups >> 16, groups >> 8, groups], axis=2).astype(np.uint8).reshape(len(chars), -1)
+
+    # cut off the bytes encoded by the padding characters
+    padding = hash_len - len(chars[0].tobytes().rstrip(b'='))
+    return raw[:, :raw.shape[1] - padding]
+
+
+def bytes_to_hashes(raw):
+
+    # pad the bytes to full groups of 3 bytes
+    raw = np.asarray(raw, dtype=np.uint8)
+    num_rows, num_bytes = raw.shape
+    if num_rows == 0: return np.zeros(0, dtype='U')
+    padding = -num_bytes % 3
+    groups = np.concatenate([raw, np.zeros((num_rows, padding), dtype=np.uint8)], axis=1)
+    groups = groups.reshape(num_rows, -1, 3).astype(np.uint32)
+    groups = (groups[:, :, 0] << 16) | (groups[:, :, 1] << 8) | groups[:, :, 2]
+
+    # split every group into 4 sextets and translate them to Base64 characters
+    sextets = np.stack([groups >> 18, groups >> 12, groups >> 6, groups], axis=2) & 0x3F
+    chars = np.frombuffer(BASE64_ALPHABET, dtype=np.uint8)[sextets].reshape(num_rows, -1)
+    if padding > 0: chars[:, -padding:] = ord('=')
+
+    return np.ascontiguousarray(chars).view(('S', chars.shape[1])).ravel().astype('U')
+
+
+def bytes_to_keys(raw):
+
+    # pack small hashes as big-endian integers, keep larger ones as fixed-width bytes
+    raw = np.ascontiguousarray(raw, dtype=np.uint8)
+    num_rows, num_bytes = raw.shape
+    if num_bytes > MAX_INT_KEY_BYTES: return raw.view(('S', num_bytes)).ravel()
+
+    padded = np.zeros((num_rows, MAX_INT_KEY_BYTES), dtype=np.uint8)
+    padded[:, MAX_INT_KEY_BYTES - num_bytes:] = raw
+    return padded.view('>u8').ravel().astype(np.uint64)
+
+
+def keys_to_bytes(keys):
+
+    # fixed-width bytes keys already are the raw hash bytes (pandas turns them into objects
+    # without the trailing zero bytes, so their width is restored from the board size header)
+    keys = np.asarray(keys)
+    if keys.dtype == object and len(keys) > 0 and isinstance(keys[0], bytes):
+        keys = keys.astype(('S', num_hash_bytes(keys[0][0], keys[0][1])))
+    if keys.dtype.kind == 'S':
+        return np.frombuffer(keys.tobytes(), dtype=np.uint8).reshape(len(keys), keys.dtype.itemsize)
+
+    # integer keys: the leading (non-zero) byte always holds the amount of rows
+    if len(keys) == 0: return np.zeros((0, 0), dtype=np.uint8)
+    num_bytes = (int(keys[0]).bit_length() + 7) // 8
+    raw = keys.astype('>u8').view(np.uint8).reshape(len(keys), MAX_INT_KEY_BYTES)
+    return raw[:, MAX_INT_KEY_BYTES - num_bytes:]
+
+
+def bytes_to_fields(raw):
+
+    # read the board size from the header bytes (all hashes share the same board size)
+    raw = np.asarray(raw, dtype=np.uint8)
+    if len(raw) == 0: return np.zeros((0, 0, 0), dtype=np.uint8)
+    rows, cols = int(raw[0, 0]), int(raw[0, 1])
+
+    # unpack 4 fields of 2 bits from each byte
+    fields = (raw[:, 2:, None] >> FIELD_SHIFTS) & 0x3
+    return fields.reshape(len(raw), -1)[:, :rows * cols].reshape(len(raw), rows, cols)
+
+
+def fields_to_bytes(fields):
+
+    # flatten the boards and zero-pad them to full bytes
+    fields = np.asarray(fields, dtype=np.uint8)
+    num_rows, rows, cols = fields.shape
+    num_bytes = num_hash_bytes(rows, cols)
+    flat = np.zeros((num_rows, (num_bytes - 2) * 4), dtype=np.uint8)
+    flat[:, :rows * cols] = fields.reshape(num_rows, -1)
+
+    # pack 4 fields of 2 bits into each byte and prepend the header bytes
+    packed = np.bitwise_or.reduce(flat.reshape(num_rows, -1, 4) << FIELD_SHIFTS, axis=2).astype(np.uint8)
+    header = np.tile(np.array([rows, cols], dtype=np.uint8), (num_rows, 1))
+    return np.concatenate([header, packed], axis=1)
+
+
+def apply_actions(fields, columns):
+
+    # determine the acting side of each board (side A moves when both sides put the same amount of stones)
+    fields = np.array(fields, dtype=np.uint8)
+    num_rows, rows, cols = fields.shape
+    columns = np.asarray(columns, dtype=np.int64)
+    num_stones = np.count_nonzero(fields.reshape(num_rows, -1), axis=1)
+    sides = np.where(num_stones % 2 == 0, 1, 2).astype(np.uint8)
+
+    # drop each stone onto the lowest free field of its column
+    heights = np.count_nonzero(fields, axis=1)
+    drop_rows = heights[np.arange(num_rows), columns]
+    if (drop_rows >= rows).any(): raise ValueError('Invalid actions! Column is already entirely occupied!')
+    fields[np.arange(num_rows), drop_rows, columns] = sides
+    return fields
+
+
+def board_size(keys):
+
+    # all keys share the board size stored in the header bytes (rows, columns)
+    raw = keys_to_bytes(np.asarray(keys)[:1])
+    if len(raw) == 0: raise ValueError('Invalid arguments! Cannot determine the board size of an empty key array!')
+    return int(raw[0, 0]), int(raw[0, 1])
+
+
+def mirror_keys(keys):
+    # reflect the boards at their vertical center axis (column c becomes column - 1 - c)
+    if len(keys) == 0: return np.asarray(keys)
+    return fields_to_keys(keys_to_fields(keys)[:, :, ::-1])
+
+
+def canonical_keys(keys):
+
+    # the canonical form of a state is the smaller key of the state and its mirror image
+    keys = np.asarray(keys)
+    mirrored = mirror_keys(keys)
+    is_mirrored = mirrored < keys
+    return np.where(is_mirrored, mirrored, keys), is_mirrored
+
+
+def mirror_columns(columns, is_mirrored, cols: int):
+    # remap the columns of mirrored states (negative columns mark missing actions and are kept)
+    columns = np.asarray(columns, dtype=np.int64)
+    return np.where(np.asarray(is_mirrored) & (columns >= 0), cols - 1 - columns, columns)
+
+
+def keys_to_blobs(keys):
+
+    # split the raw hash bytes into one bytes object per state (e.g. SQLite BLOB parameters)
+    raw = keys_to_bytes(keys)
+    if len(raw) == 0: return []
+    data, width = raw.tobytes(), raw.shape[1]
+    return [data[i:i + width] for i in range(0, len(data), width)]
+
+
+def blobs_to_keys(blobs):
+
+    # join equally sized bytes objects back into packed keys
+    blobs = list(blobs)
+    if len(blobs) == 0: return np.zeros(0, dtype=np.uint64)
+    raw = np.frombuffer(b''.join(blobs), dtype=np.uint8).reshape(len(blobs), -1)
+    return bytes_to_keys(raw)
+
+
+# convenience conversions between hashes, keys and fields
+
+def hashes_to_keys(hashes):
+    return bytes_to_keys(hashes_to_bytes(hashes))
+
+
+def keys_to_hashes(keys):
+    return bytes_to_hashes(keys_to_bytes(keys))
+
+
+def hashes_to_fields(hashes):
+    return bytes_to_fields(hashes_to_bytes(hashes))
+
+
+def fields_to_hashes(fields):
+    return bytes_to_hashes(fields_to_bytes(fields))
+
+
+def keys_to_fields(keys):
+    return bytes_to_fields(keys_to_bytes(keys))
+
+
+def fields_to_keys(fields):
+    return bytes_to_keys(fields_to_bytes(fields))
+
+
+def canonical_hashes(hashes):
+    keys, is_mirrored = canonical_keys(hashes_to_keys(hashes))
+    return keys_to_hashes(keys), is_mirrored
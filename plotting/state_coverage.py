@@ -0,0 +1,152 @@
+
+import pandas as pd
+import numpy as np
+import sys, os
+
+import state_codec as sc
+import binary_qtable as bq
+from critical_path_detection import GameTree
+import instrumentation as ins
+
+
+# The coverage of a state source (a Q table or a DynaQ experience dump written by RingBufferSerializer)
+# is a boolean mask over the state ids of the game tree. The states of the source are streamed chunk by
+# chunk as packed integer keys and resolved by binary search on the sorted state keys of the CSR index,
+# so the memory is bounded by the game tree index (memory-mapped) plus one byte per state and source.
+# Only states with legal moves are counted, as terminal states never occur in a Q table.
+
+DEFAULT_CHUNK_SIZE = 1000000
+QTABLE_COLUMNS = 5
+EXPERIENCE_COLUMNS = 6
+UNION = 'union'
+
+ARG_CANONICAL = '--canonical'
+ARG_UNCOVERED = '--uncovered'
+ARG_REPORT = '--report'
+ARG_CHUNK_SIZE = '--chunk-size'
+ALL_ARG_SPECIFIERS = [ARG_UNCOVERED, ARG_REPORT, ARG_CHUNK_SIZE]
+
+
+def state_depths(game_tree: GameTree, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # the depth of a state is its amount of stones
+    depths = np.zeros(len(game_tree.state_keys), dtype=np.int16)
+    for start in range(0, len(depths), chunk_size):
+        fields = sc.keys_to_fields(np.asarray(game_tree.state_keys[start:start + chunk_size]))
+        depths[start:start + len(fields)] = np.count_nonzero(fields.reshape(len(fields), -1), axis=1)
+    return depths
+
+
+def read_source_keys(path_source: str, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # binary Q tables already hold packed keys
+    if bq.is_binary_qtable(path_source):
+        keys = bq.BinaryQTable(path_source).keys
+        for start in range(0, len(keys), chunk_size): yield np.asarray(keys[start:start + chunk_size])
+        return
+
+    # Q tables list the state before each action, experience dumps list the states before and after each action
+    with open(path_source, 'r') as file:
+        first_line = file.readline()
+    num_columns = first_line.count(',') + 1
+    if len(first_line.strip()) == 0: return
+    if num_columns not in [QTABLE_COLUMNS, EXPERIENCE_COLUMNS]:
+        raise ValueError('Invalid state source {}! Expected a Q table or an experience dump.'.format(path_source))
+    use_columns = [0] if num_columns == QTABLE_COLUMNS else [0, 1]
+
+    # stream the state hashes chunk by chunk
+    for chunk in pd.read_csv(path_source, header=None, usecols=use_columns, chunksize=chunk_size, dtype=str):
+        for column in use_columns: yield sc.hashes_to_keys(chunk[column].to_numpy())
+
+
+def mark_coverage(game_tree: GameTree, path_source: str, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # mark the game tree states occuring in the source (canonical trees are looked up by canonical states)
+    is_covered = np.zeros(len(game_tree.state_keys), dtype=bool)
+    num_unknown = 0
+    for keys in read_source_keys(path_source, chunk_size):
+        if game_tree.canonical: keys = sc.canonical_keys(keys)[0]
+        state_ids = game_tree.state_ids(keys)
+        is_covered[state_ids[state_ids >= 0]] = True
+        num_unknown += int(np.count_nonzero(state_ids < 0))
+
+    print('marked {} states of {} ({} occurences not in the game tree)'.format(
+        int(np.count_nonzero(is_covered)), path_source, num_unknown))
+    return is_covered
+
+
+def coverage_by_depth(depths, is_decision, coverages: dict):
+
+    # count the reachable decision states and the covered ones of each source by depth
+    num_depths = int(depths.max(initial=0)) + 1
+    report = pd.DataFrame({'depth': np.arange(num_depths),
+        'states': np.bincount(depths[is_decision], minlength=num_depths)})
+    for name, is_covered in coverages.items():
+        report[name] = np.bincount(depths[is_decision & is_covered], minlength=num_depths)
+        report[name + '_ratio'] = report[name] / report['states'].clip(lower=1)
+    report = report[report['states'] > 0]
+
+    # append the totals over all depths
+    total = report.sum(numeric_only=True)
+    total['depth'] = -1
+    for name in coverages: total[name + '_ratio'] = total[name] / max(total['states'], 1)
+    count_columns = ['depth', 'states'] + list(coverages)
+    return pd.concat([report, total.to_frame().T], ignore_index=True).astype({name: int for name in count_columns})
+
+
+def write_uncovered(game_tree: GameTree, depths, is_uncovered, path_output: str, chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # export the uncovered states with their depths chunk by chunk (sorted by state key)
+    state_ids = np.flatnonzero(is_uncovered)
+    with open(path_output, 'w') as file:
+        file.write('state,depth\n')
+        for start in range(0, len(state_ids), chunk_size):
+            chunk_ids = state_ids[start:start + chunk_size]
+            pd.DataFrame({'state': sc.keys_to_hashes(np.asarray(game_tree.state_keys[chunk_ids])),
+                'depth': depths[chunk_ids]}).to_csv(file, header=False, index=False)
+    print('wrote {} uncovered states to {}'.format(len(state_ids), path_output))
+
+
+def main():
+
+    # make sure that the game tree and at least one state source are specified
+    args = []
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        if not arg.startswith('--') and sys.argv[i - 1] not in ALL_ARG_SPECIFIERS: args.append(arg)
+    if len(args) < 2: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<transitions.csv | edge shards dir> <qtable.csv | qtable.nwq | experience.csv> [...] "
+        + "[--canonical] [--uncovered <uncovered.csv>] [--report <coverage.csv>] [--chunk-size <rows>]")
+
+    # parse script args
+    path_transitions, paths_sources = args[0], args[1:]
+    chunk_size = int(sys.argv[sys.argv.index(ARG_CHUNK_SIZE) + 1]) if ARG_CHUNK_SIZE in sys.argv else DEFAULT_CHUNK_SIZE
+    if not os.path.exists(path_transitions): raise ValueError("Transitions could not be found!")
+    for path_source in paths_sources:
+        if not os.path.isfile(path_source): raise ValueError("State source {} could not be found!".format(path_source))
+
+    # mark the covered states of each source (and of all sources together)
+    game_tree = GameTree(path_transitions, ARG_CANONICAL in sys.argv)
+    offsets = np.asarray(game_tree.offsets)
+    is_decision = offsets[1:] > offsets[:-1]
+    depths = state_depths(game_tree, chunk_size)
+    coverages = {path_source: mark_coverage(game_tree, path_source, chunk_size) for path_source in paths_sources}
+    is_covered = np.logical_or.reduce(list(coverages.values()))
+    if len(coverages) > 1: coverages[UNION] = is_covered
+
+    # report the coverage by depth (depth -1 = total)
+    report = coverage_by_depth(depths, is_decision, coverages)
+    print(report.to_string(index=False))
+    if ARG_REPORT in sys.argv:
+        path_report = sys.argv[sys.argv.index(ARG_REPORT) + 1]
+        report.to_csv(path_report, index=False)
+        print('wrote coverage report to {}'.format(path_report))
+
+    # export the decision states not covered by any source
+    if ARG_UNCOVERED in sys.argv:
+        write_uncovered(game_tree, depths, is_decision & ~is_covered, sys.argv[sys.argv.index(ARG_UNCOVERED) + 1], chunk_size)
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('state_coverage'):
+        main()
@@ -0,0 +1,197 @@
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import sys, os, glob, struct
+
+import state_codec as sc
+import connect_n as cn
+import instrumentation as ins
+
+
+# The game tree is generated breadth-first, one depth (= amount of stones) after another.
+# States are packed into uint64 codes holding the 2-bit fields in the same bit layout as the
+# field bytes of the Base64 hashes (first field in the highest bits), so up to 32 fields are supported.
+# States at the same depth can only be reached at that depth, so each depth's frontier is
+# deduplicated on its own (transposition table) while the edges are streamed to shard files.
+
+MAX_FIELDS = 32
+DEFAULT_CHUNK_SIZE = 1000000
+
+# binary edge shard layout: header, sorted state keys before (codec keys), state keys after
+EDGE_SHARD_EXT = '.nwe'
+EDGE_SHARD_MAGIC = b'NWEDG'
+EDGE_SHARD_VERSION = 1
+EDGE_SHARD_HEADER = struct.Struct('<5sHBBcxIq')
+EDGE_SHARDS_INDEX = 'shards.txt'
+
+ARG_JOBS = '--jobs'
+ARG_CHUNK_SIZE = '--chunk-size'
+ARG_CSV = '--csv'
+
+
+def field_shifts(rows: int, cols: int):
+    num_field_bytes = sc.num_hash_bytes(rows, cols) - 2
+    return (8 * num_field_bytes - 2 * (np.arange(rows * cols) + 1)).astype(np.uint64)
+
+
+def codes_to_keys(codes, rows: int, cols: int):
+
+    # prepend the header bytes (rows, columns) to the packed fields
+    codes = np.asarray(codes, dtype=np.uint64)
+    num_field_bytes = sc.num_hash_bytes(rows, cols) - 2
+    raw = codes.astype('>u8').view(np.uint8).reshape(len(codes), 8)[:, 8 - num_field_bytes:]
+    header = np.tile(np.array([rows, cols], dtype=np.uint8), (len(codes), 1))
+    return sc.bytes_to_keys(np.concatenate([header, raw], axis=1))
+
+
+def expand_states(codes, depth: int, rows: int, cols: int, win_conn: int, shard_path: str):
+
+    # unpack the fields of the (sorted, unique) states and determine the column heights
+    codes = np.asarray(codes, dtype=np.uint64)
+    shifts = field_shifts(rows, cols)
+    fields = ((codes[:, None] >> shifts) & np.uint64(0x3)).astype(np.uint8).reshape(len(codes), rows, cols)
+    heights = cn.column_heights(fields)
+    side = np.uint64(cn.SIDE_A if depth % 2 == 0 else cn.SIDE_B)
+
+    # drop a stone into each free column (children ordered by parent, then by column)
+    legal = heights < rows
+    drop_fields = np.minimum(heights, rows - 1) * cols + np.arange(cols)
+    children = codes[:, None] | (side << shifts[drop_fields])
+    parents, children = np.broadcast_to(codes[:, None], children.shape)[legal], children[legal]
+
+    # detect the children winning for the acting side by comparing them against all win lines
+    lines = cn.win_lines(rows, cols, win_conn)
+    line_masks = np.bitwise_or.reduce(np.uint64(0x3) << shifts[lines], axis=1)
+    line_patterns = np.bitwise_or.reduce(side << shifts[lines], axis=1)
+    is_win = ((children[:, None] & line_masks) == line_patterns).any(axis=1)
+    is_terminal = is_win | (depth + 1 == rows * cols)
+
+    # stream the edges to the shard file and return the children to be expanded next
+    write_edge_shard(shard_path, codes_to_keys(parents, rows, cols), codes_to_keys(children, rows, cols), rows, cols)
+    return np.unique(children[~is_terminal])
+
+
+def write_edge_shard(shard_path: str, before_keys, after_keys, rows: int, cols: int):
+
+    # write both key arrays aligned to 8 bytes, so they can be memory-mapped in place
+    key_type = before_keys.dtype
+    header = EDGE_SHARD_HEADER.pack(EDGE_SHARD_MAGIC, EDGE_SHARD_VERSION, rows, cols,
+        key_type.kind.encode('ascii'), key_type.itemsize, len(before_keys))
+    with open(shard_path, 'wb') as file:
+        file.write(header)
+        file.write(b'\0' * (-len(header) % 8))
+        for array in [before_keys, after_keys]:
+            file.write(array.tobytes())
+            file.write(b'\0' * (-array.nbytes % 8))
+
+
+def read_edge_shard(shard_path: str):
+
+    # make sure the file is an edge shard of the expected version
+    with open(shard_path, 'rb') as file:
+        header = file.read(EDGE_SHARD_HEADER.size)
+    magic, version, rows, cols, key_kind, key_width, num_edges = EDGE_SHARD_HEADER.unpack(header)
+    if magic != EDGE_SHARD_MAGIC or version != EDGE_SHARD_VERSION:
+        raise ValueError('Invalid edge shard! {} has an unknown format!'.format(shard_path))
+
+    # memory-map the state keys before and after each edge
+    key_type = np.dtype(np.uint64) if key_kind == b'u' else np.dtype(('S', key_width))
+    offset = EDGE_SHARD_HEADER.size + (-EDGE_SHARD_HEADER.size % 8)
+    arrays = []
+    for _ in range(2):
+        array = np.memmap(shard_path, dtype=key_type, mode='r', offset=offset, shape=(num_edges,)) \
+            if num_edges > 0 else np.zeros(0, dtype=key_type)
+        offset += array.nbytes + (-array.nbytes % 8)
+        arrays.append(array)
+
+    return arrays[0], arrays[1]
+
+
+def list_edge_shards(shards_dir: str):
+
+    # only completely generated game trees have a shard index
+    index_path = os.path.join(shards_dir, EDGE_SHARDS_INDEX)
+    if not os.path.isfile(index_path): raise ValueError('Invalid game tree! {} is missing the shard index!'.format(shards_dir))
+    with open(index_path, 'r') as file:
+        return [os.path.join(shards_dir, line.strip()) for line in file if line.strip()]
+
+
+def read_edge_shards(shards_dir: str):
+
+    # iterate over the edges of all shards (one shard at a time)
+    for shard_path in list_edge_shards(shards_dir):
+        yield read_edge_shard(shard_path)
+
+
+def write_transitions_csv(shards_dir: str, path_csv: str):
+
+    # export the edges in the transitions.csv format of nWins.Mappings (state before, state after)
+    with open(path_csv, 'w') as file:
+        for before_keys, after_keys in read_edge_shards(shards_dir):
+            if len(before_keys) == 0: continue
+            lines = np.char.add(np.char.add(sc.keys_to_hashes(before_keys), ','), sc.keys_to_hashes(after_keys))
+            file.write('\n'.join(lines.tolist()) + '\n')
+
+    print('wrote transitions to {}'.format(path_csv))
+
+
+def generate_game_tree(rows: int, cols: int, win_conn: int, shards_dir: str,
+        num_workers: int=os.cpu_count(), chunk_size: int=DEFAULT_CHUNK_SIZE):
+
+    # make sure that the states fit into the packed integer codes
+    if rows * cols > MAX_FIELDS: raise ValueError('Invalid arguments! Boards with more than {} fields are not supported!'.format(MAX_FIELDS))
+    if win_conn < 1: raise ValueError('Invalid arguments! win_conn needs to be positive!')
+    os.makedirs(shards_dir, exist_ok=True)
+    index_path = os.path.join(shards_dir, EDGE_SHARDS_INDEX)
+    if os.path.isfile(index_path): os.remove(index_path)
+    for old_shard in glob.glob(os.path.join(shards_dir, '*' + EDGE_SHARD_EXT)): os.remove(old_shard)
+
+    # expand the game tree depth by depth, starting at the empty board
+    frontier = np.zeros(1, dtype=np.uint64)
+    shard_names = []
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for depth in range(rows * cols):
+            if len(frontier) == 0: break
+
+            # split the frontier into chunks, each chunk is expanded into its own shard
+            chunks = [frontier[i:i + chunk_size] for i in range(0, len(frontier), chunk_size)]
+            names = ['edges_{:02d}_{:05d}{}'.format(depth, i, EDGE_SHARD_EXT) for i in range(len(chunks))]
+            paths = [os.path.join(shards_dir, name) for name in names]
+            num_chunks = len(chunks)
+            children = list(pool.map(expand_states, chunks, [depth] * num_chunks, [rows] * num_chunks,
+                [cols] * num_chunks, [win_conn] * num_chunks, paths))
+            shard_names += names
+
+            # deduplicate the next frontier (the same state can be reached from several parents)
+            print('expanded {} states at depth {}'.format(len(frontier), depth))
+            del chunks
+            frontier = np.unique(np.concatenate(children))
+
+    # the shard index marks the game tree as complete
+    with open(index_path, 'w') as file:
+        file.write('\n'.join(shard_names) + '\n')
+
+    print('wrote game tree to {}'.format(shards_dir))
+
+
+def main():
+
+    # make sure that the board settings and the output directory are specified
+    if len(sys.argv) < 5: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<rows> <columns> <win_conn> <out_dir> [--jobs <workers>] [--chunk-size <states>] [--csv <transitions.csv>]\n"
+        + "The edges are written to sorted binary shard files in out_dir, --csv additionally exports them as transitions csv.")
+
+    # parse script args
+    rows, cols, win_conn = int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3])
+    shards_dir = sys.argv[4]
+    num_workers = int(sys.argv[sys.argv.index(ARG_JOBS) + 1]) if ARG_JOBS in sys.argv else os.cpu_count()
+    chunk_size = int(sys.argv[sys.argv.index(ARG_CHUNK_SIZE) + 1]) if ARG_CHUNK_SIZE in sys.argv else DEFAULT_CHUNK_SIZE
+
+    generate_game_tree(rows, cols, win_conn, shards_dir, num_workers, chunk_size)
+    if ARG_CSV in sys.argv: write_transitions_csv(shards_dir, sys.argv[sys.argv.index(ARG_CSV) + 1])
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('state_space_generator'):
+        main()
@@ -0,0 +1,253 @@
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import multiprocessing as mp
+from pathlib import Path
+import pandas as pd
+import numpy as np
+import sys, os, json
+
+import state_codec as sc
+import selfplay_evaluator as se
+import qtable_convergence as qc
+import binary_qtable as bq
+import instrumentation as ins
+
+
+# Round-robin tournament of the final Q tables of all experiments. Each Q table is reduced once to its
+# greedy and second best action per state and copied into a shared memory block; the worker processes
+# attach to the blocks instead of loading the tables themselves, so the memory doesn't grow with the
+# amount of workers. Every ordered pair of agents plays (both sides), the pair results are aggregated
+# into win / tie matrices and Elo ratings (Bradley-Terry model fitted on all games, ties count half).
+
+DEFAULT_EPSILON = 0.1
+DEFAULT_NUM_GAMES = 10000
+ELO_BASE = 1500
+ELO_SCALE = 400
+BT_ITERATIONS = 1000
+BT_TOLERANCE = 1e-10
+RANDOM_AGENT = 'random'
+QTABLE_CACHE_DIR = 'qtable_cache'
+
+ARG_GAMES = '--games'
+ARG_EPSILON = '--epsilon'
+ARG_JOBS = '--jobs'
+ARG_SEED = '--seed'
+ARG_RANDOM = '--random'
+ALL_ARG_SPECIFIERS = [ARG_GAMES, ARG_EPSILON, ARG_JOBS, ARG_SEED]
+
+
+def find_final_models(experiments_path: Path):
+
+    # the final model of each agent is its checkpoint with the highest episode
+    # (or the continuously overwritten {agent}_0 model if the training was never stopped)
+    final_models = {}
+    for models_path in sorted(experiments_path.rglob('train/models')):
+        for agent_path in sorted(path for path in models_path.iterdir() if path.is_dir()):
+            checkpoints = qc.find_checkpoints(agent_path)
+            latest_paths = [agent_path / (agent_path.name + '_0' + ext) for ext in ['.nwq', '.csv']]
+            model_path = checkpoints[-1][1] if len(checkpoints) > 0 else next((path for path in latest_paths if path.exists()), None)
+            if model_path is None: continue
+            final_models[agent_path.relative_to(experiments_path).as_posix().replace('/train/models', '')] = model_path
+    return final_models
+
+
+def share_policy(model_path: Path, binary_path: Path):
+
+    # reduce the Q table to its greedy and second best columns per state (sorted by state key);
+    # csv models are converted to the given binary path, so the experiments tree stays untouched
+    qtable = qc.open_checkpoint(model_path, binary_path)
+    keys, columns, _ = qtable.policy()
+    second_keys, second_columns = qtable.second_best_policy()
+    aligned_second_columns = np.full(len(keys), -1, dtype=np.int8)
+    aligned_second_columns[np.searchsorted(keys, second_keys)] = second_columns
+
+    # copy the policy into one shared memory block: keys, greedy columns, second best columns
+    shared = shared_memory.SharedMemory(create=True, size=max(keys.nbytes + 2 * len(keys), 1))
+    descriptor = {'name': shared.name, 'states': len(keys), 'key_dtype': keys.dtype.str,
+        'board_size': sc.board_size(keys) if len(keys) > 0 else None}
+    policy = SharedPolicy(descriptor, shared)
+    policy.keys[:], policy.columns[:], policy.second_columns[:] = keys, columns, aligned_second_columns
+    return shared, descriptor
+
+
+class SharedPolicy(object):
+
+    def __init__(self, descriptor: dict, shared: shared_memory.SharedMemory=None):
+
+        # attach to the shared memory block (without copying it)
+        if shared is None: shared = shared_memory.SharedMemory(name=descriptor['name'])
+        self.shared = shared
+        num_states, key_dtype = descriptor['states'], np.dtype(descriptor['key_dtype'])
+        self.keys = np.ndarray((num_states,), dtype=key_dtype, buffer=shared.buf)
+        self.columns = np.ndarray((num_states,), dtype=np.int8, buffer=shared.buf, offset=self.keys.nbytes)
+        self.second_columns = np.ndarray((num_states,), dtype=np.int8, buffer=shared.buf, offset=self.keys.nbytes + num_states)
+
+
+    def lookup_columns(self, keys, policy_columns):
+
+        # binary search the states (-1 if unknown)
+        keys = np.asarray(keys, dtype=self.keys.dtype)
+        rows = np.searchsorted(self.keys, keys)
+        rows[rows == len(self.keys)] = 0
+        found = self.keys[rows] == keys if len(self.keys) > 0 else np.zeros(len(keys), dtype=bool)
+        return np.where(found, policy_columns[rows], -1).astype(np.int64)
+
+
+    def best_columns_from_keys(self, keys):
+        return self.lookup_columns(keys, self.columns)
+
+
+    def second_best_columns_from_keys(self, keys):
+        return self.lookup_columns(keys, self.second_columns)
+
+
+# the shared policies attached by each worker process (agent index -> player)
+_worker_players = None
+
+def attach_policies(descriptors: list, epsilon: float):
+    global _worker_players
+    _worker_players = [se.RandomPlayer() if descriptor is None else se.QTablePlayer(SharedPolicy(descriptor), epsilon)
+        for descriptor in descriptors]
+
+
+def play_pair(index_a: int, index_b: int, num_games: int, game_settings: dict, seed_sequence: np.random.SeedSequence):
+
+    # play a batch of games of agent index_a (side A) against agent index_b (side B)
+    results = se.play_games(_worker_players[index_a], _worker_players[index_b], num_games, game_settings['rows'],
+        game_settings['columns'], game_settings['win_conn'], np.random.default_rng(seed_sequence))
+    counts = np.bincount(results, minlength=se.TIE + 1)
+    return index_a, index_b, int(counts[se.WIN_SIDE_A]), int(counts[se.WIN_SIDE_B]), int(counts[se.TIE])
+
+
+def run_tournament(descriptors: list, game_settings: dict, num_games: int=DEFAULT_NUM_GAMES,
+        epsilon: float=DEFAULT_EPSILON, num_workers: int=os.cpu_count(), seed: int=None):
+
+    # split the games of each ordered pair into batches with independent random streams
+    pairs = [(a, b) for a in range(len(descriptors)) for b in range(len(descriptors)) if a != b]
+    batch_sizes = [min(se.GAMES_PER_BATCH, num_games - i) for i in range(0, num_games, se.GAMES_PER_BATCH)]
+    jobs = [(a, b, size) for a, b in pairs for size in batch_sizes]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(jobs))
+
+    # play all batches in the process pool (each worker attaches to the shared policies once)
+    if num_workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context('spawn'),
+                initializer=attach_policies, initargs=(descriptors, epsilon)) as pool:
+            results = list(pool.map(play_pair, *zip(*jobs), [game_settings] * len(jobs), seed_sequences, chunksize=4))
+    else:
+        attach_policies(descriptors, epsilon)
+        results = [play_pair(a, b, size, game_settings, seeds) for (a, b, size), seeds in zip(jobs, seed_sequences)]
+
+    # sum up the batches of each pair
+    results = pd.DataFrame(results, columns=['index_a', 'index_b', 'wins_a', 'wins_b', 'ties'])
+    return results.groupby(['index_a', 'index_b'], as_index=False).sum()
+
+
+def bradley_terry_ratings(results: pd.DataFrame, num_agents: int):
+
+    # scores of each agent against each other agent over both sides (ties count half)
+    wins = np.zeros((num_agents, num_agents))
+    np.add.at(wins, (results['index_a'], results['index_b']), results['wins_a'] + 0.5 * results['ties'])
+    np.add.at(wins, (results['index_b'], results['index_a']), results['wins_b'] + 0.5 * results['ties'])
+
+    # one virtual tie per pair keeps the strengths finite for unbeaten / winless agents
+    games = wins + wins.T + np.where(np.eye(num_agents) == 1, 0, 1)
+    wins = wins + np.where(np.eye(num_agents) == 1, 0, 0.5)
+
+    # fit the strengths with the minorization-maximization algorithm
+    strengths = np.ones(num_agents)
+    for _ in range(BT_ITERATIONS):
+        denominators = (games / (strengths[:, None] + strengths[None, :])).sum(axis=1)
+        updated = wins.sum(axis=1) / denominators
+        updated /= np.exp(np.log(updated).mean())
+        converged = np.abs(updated - strengths).max() < BT_TOLERANCE
+        strengths = updated
+        if converged: break
+
+    # convert the strengths to the Elo scale (the mean rating is the Elo base)
+    return ELO_BASE + ELO_SCALE * np.log10(strengths)
+
+
+def write_results(agent_names: list, results: pd.DataFrame, output_path: Path):
+
+    # long format: one row per ordered pair
+    output_path.mkdir(parents=True, exist_ok=True)
+    games = results['wins_a'] + results['wins_b'] + results['ties']
+    pairs = pd.DataFrame({'agent_a': [agent_names[i] for i in results['index_a']],
+        'agent_b': [agent_names[i] for i in results['index_b']], 'games': games,
+        'wins_a': results['wins_a'], 'wins_b': results['wins_b'], 'ties': results['ties']})
+    pairs.to_csv(output_path / 'tournament_pairs.csv', index=False)
+
+    # N x N matrices: row agent plays side A against the column agent on side B
+    for name, values in [('win_matrix', results['wins_a'] / games), ('tie_matrix', results['ties'] / games)]:
+        matrix = np.full((len(agent_names), len(agent_names)), np.nan)
+        matrix[results['index_a'].to_numpy(), results['index_b'].to_numpy()] = values.to_numpy()
+        pd.DataFrame(matrix, index=agent_names, columns=agent_names).to_csv(output_path / (name + '.csv'))
+
+    # ratings sorted from the strongest to the weakest agent
+    ratings = pd.DataFrame({'agent': agent_names, 'elo': bradley_terry_ratings(results, len(agent_names))})
+    ratings = ratings.sort_values('elo', ascending=False, kind='stable').reset_index(drop=True)
+    ratings.to_csv(output_path / 'ratings.csv', index=False)
+    print(ratings.to_string())
+    print('wrote tournament results to {}'.format(output_path))
+
+
+def get_arg_value(arg: str, default):
+    return type(default)(sys.argv[sys.argv.index(arg) + 1]) if arg in sys.argv else default
+
+
+def main():
+
+    # make sure that the settings, the experiments directory and the output directory are specified
+    args = []
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        if not arg.startswith('--') and sys.argv[i - 1] not in ALL_ARG_SPECIFIERS: args.append(arg)
+    if len(args) < 3: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<settings.json> <experiments_dir> <output_dir> [--games <games per ordered pair>] [--epsilon <epsilon>] "
+        + "[--jobs <workers>] [--seed <seed>] [--random]\n"
+        + "The game settings (rows, columns, win_conn) are read from the settings file, --random adds a random agent.")
+
+    # parse script args
+    settings_path, experiments_path, output_path = args[0], Path(args[1]), Path(args[2])
+    with open(settings_path, 'r') as file:
+        game_settings = json.load(file)['game_settings']
+    num_games = get_arg_value(ARG_GAMES, DEFAULT_NUM_GAMES)
+    epsilon = get_arg_value(ARG_EPSILON, DEFAULT_EPSILON)
+    num_workers = get_arg_value(ARG_JOBS, os.cpu_count())
+    seed = int(sys.argv[sys.argv.index(ARG_SEED) + 1]) if ARG_SEED in sys.argv else None
+
+    # load each final model once into shared memory (models of other board sizes can't take part),
+    # the binary conversions of csv models are cached in the output directory
+    cache_path = output_path / QTABLE_CACHE_DIR
+    cache_path.mkdir(parents=True, exist_ok=True)
+    shared_blocks, agent_names, descriptors = [], [], []
+    try:
+        for agent_name, model_path in find_final_models(experiments_path).items():
+            shared, descriptor = share_policy(model_path, cache_path / (agent_name.replace('/', '__') + bq.BINARY_QTABLE_EXT))
+            shared_blocks.append(shared)
+            if descriptor['board_size'] != (game_settings['rows'], game_settings['columns']):
+                print('skipped {}, its board size {} differs from the settings'.format(model_path, descriptor['board_size']))
+                continue
+            agent_names.append(agent_name)
+            descriptors.append(descriptor)
+            print('shared {} states of {}'.format(descriptor['states'], model_path))
+        if ARG_RANDOM in sys.argv:
+            agent_names.append(RANDOM_AGENT)
+            descriptors.append(None)
+        if len(descriptors) < 2: raise ValueError('A tournament requires at least two agents, found {}!'.format(len(descriptors)))
+
+        # play all ordered pairs and write the matrices and ratings
+        results = run_tournament(descriptors, game_settings, num_games, epsilon, num_workers, seed)
+        write_results(agent_names, results, output_path)
+
+    # release the shared memory blocks
+    finally:
+        for shared in shared_blocks:
+            shared.close()
+            shared.unlink()
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('tournament'):
+        main()
@@ -0,0 +1,240 @@
+
+import pandas as pd
+import numpy as np
+from datetime import datetime
+from pathlib import Path
+import sys, os, re
+
+import instrumentation as ins
+
+
+# The console logs of entrypoint.sh (log_<settings>_<YYYY-mm-dd_HH-MM-SS>.txt) hold one block per epoch:
+#   stored model to temp files
+#   starting training episode <from> - <to>
+#   \rtraining progress: 0 %\rtraining progress: 10 % ...
+#   \rinference progress: 0 % ...
+#   inference results: <games> games played, side A wins <a>, side B wins <b>, ties <t>
+# The progress lines are rewritten with carriage returns, so only the last segment of each line counts.
+# Plain log files carry no timestamps, so their throughput is derived from the start time in the
+# file name and the file's mtime. Logs with timestamped lines (e.g. docker logs --timestamps) also
+# yield the duration of each phase: the models are saved between the inference results and the
+# 'stored model' line, training ends with the training progress line and inference with the
+# inference progress line.
+
+LOG_FILE_PATTERN = re.compile(r'^log_(?P<settings>.*)_(?P<started>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.txt$')
+LOG_FILE_TIME_FORMAT = '%Y-%m-%d_%H-%M-%S'
+TIMESTAMP_PATTERN = re.compile(r'^(?P<time>\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2})(?P<fraction>\.\d+)?(?P<zone>Z|[+-]\d{2}:?\d{2})?\s')
+EPOCH_PATTERN = re.compile(r'^starting training episode (?P<episode_from>\d+) - (?P<episode_to>\d+)')
+PROGRESS_PATTERN = re.compile(r'^(?P<phase>training|inference) progress: \d+ %')
+RESULTS_PATTERN = re.compile(r'^inference results: (?P<games>\d+) games played, side A wins (?P<wins_a>\d+), '
+    + r'side B wins (?P<wins_b>\d+), ties (?P<ties>\d+)')
+STORED_MODEL_LINE = 'stored model to temp files'
+
+DEFAULT_TOLERANCE = 0.1
+EPOCH_COLUMNS = ['log', 'epoch', 'episode_from', 'episode_to', 'training_games', 'inference_games',
+    'wins_a', 'wins_b', 'ties', 'save_seconds', 'training_seconds', 'inference_seconds', 'complete']
+
+ARG_EPOCHS = '--epochs'
+ARG_SUMMARY = '--summary'
+ARG_TOLERANCE = '--tolerance'
+ALL_ARG_SPECIFIERS = [ARG_EPOCHS, ARG_SUMMARY, ARG_TOLERANCE]
+
+
+def split_timestamp(line: str):
+
+    # strip a leading ISO 8601 timestamp from the line (naive timestamps are read as UTC)
+    match = TIMESTAMP_PATTERN.match(line)
+    if match is None: return None, line
+    fraction = (match.group('fraction') or '.0')[:7]
+    zone = (match.group('zone') or '+00:00').replace('Z', '+00:00')
+    if ':' not in zone: zone = zone[:3] + ':' + zone[3:]
+    timestamp = datetime.fromisoformat(match.group('time').replace(' ', 'T') + fraction + zone)
+    return timestamp, line[match.end():]
+
+
+def read_log_lines(log_path: Path):
+
+    # stream the raw lines (binary mode, so carriage returns don't split the lines),
+    # keeping only the text after the last carriage return of each line
+    with open(log_path, 'rb') as file:
+        for raw_line in file:
+            timestamp, text = split_timestamp(raw_line.decode('utf-8', errors='replace').rstrip('\r\n'))
+            yield timestamp, text.split('\r')[-1].strip()
+
+
+def seconds_between(start: datetime, end: datetime):
+    return (end - start).total_seconds() if start is not None and end is not None else np.nan
+
+
+def parse_log(log_path: Path):
+
+    # reconstruct the epochs from the events of the log
+    epochs, epoch = [], None
+    first_time, last_time, last_results_time, last_stored_time, save_seconds = None, None, None, None, np.nan
+    for timestamp, text in read_log_lines(log_path):
+        if timestamp is not None:
+            first_time = timestamp if first_time is None else first_time
+            last_time = timestamp
+
+        # the models are stored right before each epoch (the first time right after the start)
+        if text == STORED_MODEL_LINE:
+            last_stored_time = timestamp
+            save_seconds = seconds_between(last_results_time, timestamp)
+            continue
+
+        # a new epoch starts with its training phase
+        match = EPOCH_PATTERN.match(text)
+        if match is not None:
+            episode_from, episode_to = int(match.group('episode_from')), int(match.group('episode_to'))
+            epoch = {'log': log_path.name, 'epoch': len(epochs), 'episode_from': episode_from, 'episode_to': episode_to,
+                'training_games': episode_to - episode_from, 'inference_games': 0, 'wins_a': 0, 'wins_b': 0, 'ties': 0,
+                'save_seconds': save_seconds, 'training_seconds': np.nan, 'inference_seconds': np.nan, 'complete': False,
+                'start_time': timestamp if timestamp is not None else last_stored_time, 'training_end_time': None}
+            epochs.append(epoch)
+            save_seconds = np.nan
+            continue
+        if epoch is None: continue
+
+        # the progress lines end with their phase (the inference starts when the training ends)
+        match = PROGRESS_PATTERN.match(text)
+        if match is not None:
+            if match.group('phase') == 'training':
+                epoch['training_end_time'] = timestamp
+                epoch['training_seconds'] = seconds_between(epoch['start_time'], timestamp)
+            else:
+                epoch['inference_seconds'] = seconds_between(epoch['training_end_time'], timestamp)
+            continue
+
+        # the inference results complete the epoch
+        match = RESULTS_PATTERN.match(text)
+        if match is not None:
+            epoch.update({'inference_games': int(match.group('games')), 'wins_a': int(match.group('wins_a')),
+                'wins_b': int(match.group('wins_b')), 'ties': int(match.group('ties')), 'complete': True})
+            last_results_time = timestamp
+
+    epochs_df = pd.DataFrame(epochs).reindex(columns=EPOCH_COLUMNS)
+    return epochs_df, first_time, last_time
+
+
+def log_file_times(log_path: Path):
+
+    # the start time is part of the file name, the last write is the file's mtime (both local time)
+    match = LOG_FILE_PATTERN.match(log_path.name)
+    settings = match.group('settings') if match is not None else log_path.stem
+    started = datetime.strptime(match.group('started'), LOG_FILE_TIME_FORMAT).astimezone() if match is not None else None
+    modified = datetime.fromtimestamp(os.path.getmtime(log_path)).astimezone()
+    return settings, started, modified
+
+
+def summarize_run(log_path: Path, epochs_df: pd.DataFrame, first_time: datetime, last_time: datetime):
+
+    # prefer the timestamps of the lines, fall back to the file name and mtime
+    settings, started, modified = log_file_times(log_path)
+    has_line_times = first_time is not None
+    started, ended = (first_time, last_time) if has_line_times else (started, modified)
+    duration = seconds_between(started, ended)
+
+    # sum up the games of the complete epochs
+    complete = epochs_df[epochs_df['complete'].astype(bool)]
+    training_games, inference_games = int(complete['training_games'].sum()), int(complete['inference_games'].sum())
+    timed = complete.dropna(subset=['training_seconds', 'inference_seconds'])
+
+    return {
+        'log': log_path.name,
+        'settings': settings,
+        'started': started,
+        'timing': 'lines' if has_line_times else ('file' if started is not None else 'none'),
+        'epochs': len(complete),
+        'training_games': training_games,
+        'inference_games': inference_games,
+        'duration_seconds': duration,
+        'games_per_second': (training_games + inference_games) / duration if duration > 0 else np.nan,
+        'training_games_per_second': timed['training_games'].sum() / timed['training_seconds'].sum()
+            if len(timed) > 0 and timed['training_seconds'].sum() > 0 else np.nan,
+        'inference_games_per_second': timed['inference_games'].sum() / timed['inference_seconds'].sum()
+            if len(timed) > 0 and timed['inference_seconds'].sum() > 0 else np.nan,
+        'mean_save_seconds': epochs_df['save_seconds'].astype(float).mean()
+    }
+
+
+def flag_regressions(summary: pd.DataFrame, tolerance: float=DEFAULT_TOLERANCE):
+
+    # compare the training throughput of each run (overall throughput if the phases are unknown)
+    # with the median of the earlier runs of the same settings, or of all earlier runs without any;
+    # the overall throughput includes inference and saves, so each kind only has baselines of its own kind
+    summary = summary.sort_values('started', kind='stable', na_position='first').reset_index(drop=True)
+    throughput = summary['training_games_per_second'].fillna(summary['games_per_second'])
+    throughput_kinds = np.where(summary['training_games_per_second'].notna(), 'training', 'overall')
+    baselines, baseline_kinds = [], []
+    for i in range(len(summary)):
+        same_kind = throughput[:i][throughput_kinds[:i] == throughput_kinds[i]]
+        earlier = same_kind[summary['settings'][:i] == summary['settings'][i]].dropna()
+        kind = 'settings'
+        if len(earlier) == 0: earlier, kind = same_kind.dropna(), 'all'
+        baselines.append(earlier.median() if len(earlier) > 0 else np.nan)
+        baseline_kinds.append(kind if len(earlier) > 0 else None)
+
+    summary['throughput'] = throughput
+    summary['throughput_kind'] = throughput_kinds
+    summary['baseline'] = baselines
+    summary['baseline_kind'] = baseline_kinds
+    summary['regression'] = summary['throughput'] < (1 - tolerance) * summary['baseline']
+    return summary
+
+
+def find_log_files(paths: list):
+
+    # collect the log files (directories are searched recursively)
+    log_paths = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir(): log_paths.extend(sorted(path.rglob('log_*.txt')))
+        elif path.is_file(): log_paths.append(path)
+        else: raise ValueError('Log file or directory {} could not be found!'.format(path))
+    return log_paths
+
+
+def main():
+
+    # make sure that at least one log file or directory is specified
+    args = []
+    for i, arg in enumerate(sys.argv[1:], start=1):
+        if arg not in ALL_ARG_SPECIFIERS and sys.argv[i - 1] not in ALL_ARG_SPECIFIERS: args.append(arg)
+    if len(args) < 1: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<log file | logs dir> [...] [--epochs <epochs.csv>] [--summary <summary.csv>] [--tolerance <fraction>]")
+
+    # parse script args
+    tolerance = float(sys.argv[sys.argv.index(ARG_TOLERANCE) + 1]) if ARG_TOLERANCE in sys.argv else DEFAULT_TOLERANCE
+    log_paths = find_log_files(args)
+
+    # parse the logs one by one (streamed, so the memory doesn't grow with the log size)
+    all_epochs, summaries = [], []
+    for log_path in log_paths:
+        epochs_df, first_time, last_time = parse_log(log_path)
+        all_epochs.append(epochs_df)
+        summaries.append(summarize_run(log_path, epochs_df, first_time, last_time))
+    print('parsed {} training logs'.format(len(log_paths)))
+    if len(summaries) == 0: return
+
+    # print the throughput of all runs and flag the regressions
+    summary = flag_regressions(pd.DataFrame(summaries), tolerance)
+    print(summary.drop(columns=['started']).to_string(index=False))
+    for _, run in summary[summary['regression']].iterrows():
+        print('throughput regression: {} plays {:.1f} {} games/s, the median of earlier runs ({}) is {:.1f} games/s'.format(
+            run['log'], run['throughput'], run['throughput_kind'], run['baseline_kind'], run['baseline']))
+
+    # export the epochs and the run summaries
+    if ARG_EPOCHS in sys.argv:
+        path_epochs = sys.argv[sys.argv.index(ARG_EPOCHS) + 1]
+        pd.concat(all_epochs, ignore_index=True).to_csv(path_epochs, index=False)
+        print('wrote epochs to {}'.format(path_epochs))
+    if ARG_SUMMARY in sys.argv:
+        path_summary = sys.argv[sys.argv.index(ARG_SUMMARY) + 1]
+        summary.to_csv(path_summary, index=False)
+        print('wrote run summaries to {}'.format(path_summary))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('training_log_parser'):
+        main()
@@ -1,91 +1,70 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import errno
 import os
 from pathlib import Path
 
 import data_helper as dh
+import experiment_index as ei
+import winrate_store as ws
+import instrumentation as ins
 
-if __name__=='__main__':
-    # Create path to experiments directory
-    experiments_path = Path(Path().cwd().parents[0] / 'experiments')
-
-    # Loop through all training directories
-    for train_directory_path in experiments_path.rglob("*"):
-        # check if train_directory_path is directory
-        if not train_directory_path.is_dir():
-            continue
-        
-        # Loop through experiment directories
-        for experiment_directory_path in train_directory_path.rglob("*"):
-            # check if experiment_directory_path is directory
-            if not experiment_directory_path.is_dir():
-                continue
-
-            # Create path to train/logs
-            logs_path = experiment_directory_path / 'train/logs'
-
-            # loop through win rates directories in logs
-            for content_path in logs_path.rglob("*"):
-                # check if content is directory
-                if not content_path.is_dir():
-                    continue
-
-                # Create file path to win_rates.csv
-                win_rates_path = content_path / 'win_rates.csv'
-
-                # Check if win rate csv exists
-                if not win_rates_path.exists():
-                    raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), win_rates_path)
-
-                # Read dataframe from csv file
-                winrate_df = dh.get_winrate_df_from_csv(win_rates_path)
 
-                # Create new plot
-                plt.figure()
+def plot_winrates(winrate_df, image_path):
+    # Create new plot
+    figure = plt.figure()
 
-                # Plot Win Rate A
-                plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.WINRATE_A], label=dh.WINRATE_A)
+    # Plot Win Rate A
+    plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.WINRATE_A], label=dh.WINRATE_A)
 
-                # Plot Win Rate B
-                plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.WINRATE_B], label=dh.WINRATE_B)
+    # Plot Win Rate B
+    plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.WINRATE_B], label=dh.WINRATE_B)
 
-                # Plot Tie Rate
-                plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.TIE_RATE], label=dh.TIE_RATE)
+    # Plot Tie Rate
+    plt.plot(winrate_df[dh.EPISODE], winrate_df[dh.TIE_RATE], label=dh.TIE_RATE)
 
-                # Set ylim between 0 and 1
-                plt.ylim(0.0, 1.0)
+    # Set ylim between 0 and 1
+    plt.ylim(0.0, 1.0)
 
-                # Set xlim left 0
-                plt.xlim(left=0)
+    # Set xlim left 0
+    plt.xlim(left=0)
 
-                # Set the x and y axis label
-                plt.xlabel(dh.EPISODE)
-                plt.ylabel('win/tie rate')
+    # Set the x and y axis label
+    plt.xlabel(dh.EPISODE)
+    plt.ylabel('win/tie rate')
 
-                # Show legend
-                plt.legend()
+    # Show legend
+    plt.legend()
 
-                # Create path to plots directory
-                plots_path = experiment_directory_path /'plots'
+    # Save plot as image and release the figure
+    plt.savefig(image_path)
+    plt.close(figure)
 
-                # Check plot directory is available
-                if not plots_path.exists():
-                    os.mkdir(plots_path)
-
-                # Create path to winrate directory
-                win_rates_path = Path(plots_path / 'winrate')
-
-                # Check winrate directory is available
-                if not win_rates_path.exists():
-                    os.mkdir(win_rates_path)
-
-                # Get image name from source directroy
-                image_name = content_path.name + '.png'
-
-                # Create image path
-                image_path = win_rates_path / image_name
-
-                # Save plot as image
-                plt.savefig(image_path)
 
+if __name__=='__main__':
+    with ins.instrumented_run('winrate_plotter'):
+        # Create path to experiments directory
+        experiments_path = Path(Path().cwd().parents[0] / 'experiments')
+
+        # Collect the plots to be rendered (one plot per run of each experiment)
+        jobs = []
+        experiments = ei.build_experiment_index(experiments_path)
+        for experiment in experiments:
+            for run_path, win_rates_path in zip(experiment.run_paths, experiment.win_rates_paths()):
+                # Get image path from source directory
+                image_path = experiment.plot_path('winrate', run_path.name + '.png')
+
+                # Only render plots that are older than their win rates
+                if ei.needs_rendering(image_path, [win_rates_path]):
+                    jobs.append(((experiment.name, run_path.name), image_path))
+
+        # Read the win rates of the outdated runs from the win rate store (one row per episode from agent A's view)
+        if len(jobs) > 0:
+            store = ws.load_winrate_store(experiments_path, experiments)
+            store = store[store[dh.SIDE] == dh.SIDE_A]
+            runs = dict(tuple(store.groupby([dh.EXPERIMENT, dh.RUN], observed=True)))
+            jobs = [(runs[run_key], image_path) for run_key, image_path in jobs]
+
+        # Render all outdated plots in parallel
+        ei.render_plots(plot_winrates, jobs)
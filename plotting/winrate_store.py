@@ -0,0 +1,110 @@
+
+import pandas as pd
+import pickle, os, sys
+from pathlib import Path
+
+import data_helper as dh
+import experiment_index as ei
+import instrumentation as ins
+
+
+# The win rate store holds all runs of all experiments in one long-format table with one row
+# per logged inference and agent of a run (agent A = first name of the <A>_vs_<B> run directory).
+# It is cached as a pickle file; only the win_rates.csv files whose mtime or size changed are re-read.
+
+STORE_CACHE_NAME = '.winrate_store.pkl'
+STORE_CACHE_VERSION = 1
+STORE_COLUMNS = [dh.EXPERIMENT, dh.RUN, dh.AGENT, dh.SIDE, dh.LEARNING_STEPS, dh.EPISODE,
+    dh.WINRATE_A, dh.WINRATE_B, dh.TIE_RATE, dh.WIN_RATE]
+CATEGORY_COLUMNS = [dh.EXPERIMENT, dh.RUN, dh.AGENT, dh.SIDE]
+
+
+def read_run(win_rates_path: Path, experiment_name: str):
+
+    # read the win rates of the run (episodes as cumulative sum of the learning steps)
+    winrate_df = dh.get_winrate_df_from_csv(win_rates_path)
+    agent_names = win_rates_path.parent.name.split('_vs_')
+    if len(agent_names) != 2: raise ValueError('Invalid run directory! {} is not named <A>_vs_<B>!'.format(win_rates_path.parent))
+
+    # stack the rows of both agents, each tagged with its own win rate
+    run_df = pd.concat([
+        winrate_df.assign(**{dh.AGENT: agent_names[0], dh.SIDE: dh.SIDE_A, dh.WIN_RATE: winrate_df[dh.WINRATE_A]}),
+        winrate_df.assign(**{dh.AGENT: agent_names[1], dh.SIDE: dh.SIDE_B, dh.WIN_RATE: winrate_df[dh.WINRATE_B]})
+    ], ignore_index=True)
+    run_df[dh.EXPERIMENT] = experiment_name
+    run_df[dh.RUN] = win_rates_path.parent.name
+    return run_df[STORE_COLUMNS]
+
+
+def file_signature(path: Path):
+    file_stat = os.stat(path)
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+def load_cache(cache_path: Path):
+
+    # start with an empty cache if it is missing, unreadable or outdated
+    try:
+        with open(cache_path, 'rb') as file:
+            cache = pickle.load(file)
+        if cache.get('version') == STORE_CACHE_VERSION: return cache
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+    return {'version': STORE_CACHE_VERSION, 'runs': {}}
+
+
+def load_winrate_store(experiments_path: Path, experiments: list=None, cache_path: Path=None):
+
+    # index the experiments (unless the caller already did) and load the cached runs
+    experiments = ei.build_experiment_index(experiments_path) if experiments is None else experiments
+    cache_path = experiments_path / STORE_CACHE_NAME if cache_path is None else cache_path
+    cache = load_cache(cache_path)
+
+    # only re-read the runs whose win_rates.csv changed since they were cached
+    runs = {}
+    num_reloaded = 0
+    for experiment in experiments:
+        for win_rates_path in experiment.win_rates_paths():
+            if not win_rates_path.exists(): continue
+            key, signature = win_rates_path.relative_to(experiments_path).as_posix(), file_signature(win_rates_path)
+            cached = cache['runs'].get(key)
+            if cached is not None and cached[0] == signature:
+                runs[key] = cached
+            else:
+                with ins.phase('read win rates'):
+                    runs[key] = (signature, read_run(win_rates_path, experiment.name))
+                    ins.add_rows(len(runs[key][1]))
+                num_reloaded += 1
+
+    # persist the refreshed cache (runs of deleted files are dropped)
+    if num_reloaded > 0 or len(runs) != len(cache['runs']):
+        with open(cache_path, 'wb') as file:
+            pickle.dump({'version': STORE_CACHE_VERSION, 'runs': runs}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    print('loaded win rate store: {} runs, {} re-read from csv'.format(len(runs), num_reloaded))
+
+    # concatenate all runs into one columnar table
+    if len(runs) == 0: return pd.DataFrame(columns=STORE_COLUMNS)
+    with ins.phase('concat win rate store'):
+        store = pd.concat([run_df for _, run_df in runs.values()], ignore_index=True)
+        store[CATEGORY_COLUMNS] = store[CATEGORY_COLUMNS].astype('category')
+        ins.add_rows(len(store))
+    return store
+
+
+def main():
+
+    # make sure that the experiments directory is specified
+    if len(sys.argv) < 2: raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "<experiments_dir> [<store.csv>]\n"
+        + "Refreshes the cached win rate store and optionally exports it as csv file.")
+
+    store = load_winrate_store(Path(sys.argv[1]))
+    if len(sys.argv) > 2:
+        store.to_csv(sys.argv[2], index=False)
+        print('wrote win rate store to {}'.format(sys.argv[2]))
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('winrate_store'):
+        main()
@@ -0,0 +1,267 @@
+
+import asyncio
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import math, os, sys
+
+import data_helper as dh
+import experiment_index as ei
+import convergence_metrics as cm
+import instrumentation as ins
+
+
+# Follow mode for running trainings: each win_rates.csv is tailed by byte offset, so a poll only
+# reads the rows appended since the last poll. A partially written last line is buffered until its
+# line break arrives. Truncated or replaced files (e.g. a restarted training) are re-read from the start.
+# All runs are polled from one asyncio loop; a dashboard image per experiment is only re-rendered
+# when one of its runs received new rows.
+
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_DISCOVERY_INTERVAL = 30.0
+DASHBOARD_KIND = 'live'
+DASHBOARD_IMAGE = 'dashboard.png'
+
+ARG_INTERVAL = '--interval'
+ARG_ONCE = '--once'
+
+
+class RunTail(object):
+
+    def __init__(self, win_rates_path: Path, thresholds: list=cm.DEFAULT_THRESHOLDS):
+        self.path = win_rates_path
+        self.name = win_rates_path.parent.name
+        self.thresholds = thresholds
+        self.reset()
+
+
+    def reset(self, file_id=None):
+
+        # forget the read position and all rows read so far
+        self.file_id = file_id
+        self.offset = 0
+        self.partial = b''
+        self.episodes, self.win_rates_a, self.win_rates_b, self.tie_rates = [], [], [], []
+        self.episode = 0
+        self.best_win_rates = [0.0, 0.0]
+        self.first_crossings = [[None] * len(self.thresholds) for _ in range(2)]
+        self.num_invalid = 0
+        self.is_dirty = True
+
+
+    def poll(self):
+
+        # nothing to read yet if the training didn't log its first inference
+        try:
+            file_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0
+
+        # start over if the file was replaced or truncated
+        file_id = (file_stat.st_dev, file_stat.st_ino)
+        if file_id != self.file_id or file_stat.st_size < self.offset:
+            self.reset(file_id)
+        if file_stat.st_size == self.offset: return 0
+
+        # read the appended bytes, keeping an unterminated last line for the next poll
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = self.partial + file.read(file_stat.st_size - self.offset)
+        self.offset += len(data) - len(self.partial)
+        lines = data.split(b'\n')
+        self.partial = lines.pop()
+
+        # parse the complete lines and update the series and metrics incrementally
+        num_rows = 0
+        for line in lines:
+            if self.append_row(line): num_rows += 1
+        self.is_dirty |= num_rows > 0
+        return num_rows
+
+
+    def append_row(self, line: bytes):
+
+        # rows are formatted as <learningSteps>,<winRateA>,<winRateB>,<tieRate> (skip malformed rows)
+        try:
+            learning_steps, win_rate_a, win_rate_b, tie_rate = line.decode('ascii').strip().split(',')
+            learning_steps, win_rates = int(learning_steps), [float(win_rate_a), float(win_rate_b)]
+            tie_rate = float(tie_rate)
+        except ValueError:
+            if len(line.strip()) > 0: self.num_invalid += 1
+            return False
+
+        # episodes are the cumulative sum of the learning steps
+        self.episode += learning_steps
+        self.episodes.append(self.episode)
+        self.win_rates_a.append(win_rates[0])
+        self.win_rates_b.append(win_rates[1])
+        self.tie_rates.append(tie_rate)
+
+        # keep the best win rate and the first episode exceeding each threshold (same rule as convergence_metrics)
+        for side, win_rate in enumerate(win_rates):
+            if win_rate <= self.best_win_rates[side]: continue
+            self.best_win_rates[side] = win_rate
+            crossings = self.first_crossings[side]
+            for i, threshold in enumerate(self.thresholds):
+                if crossings[i] is None and win_rate > threshold: crossings[i] = self.episode
+        return True
+
+
+    def snapshot(self):
+
+        # copy the series, so the dashboard can be rendered while the loop keeps on polling
+        return {
+            'name': self.name,
+            dh.EPISODE: list(self.episodes),
+            dh.WINRATE_A: list(self.win_rates_a),
+            dh.WINRATE_B: list(self.win_rates_b),
+            dh.TIE_RATE: list(self.tie_rates),
+            'best': list(self.best_win_rates),
+            'crossings': [list(crossings) for crossings in self.first_crossings]
+        }
+
+
+def format_crossing(thresholds: list, crossings: list):
+
+    # show the highest threshold exceeded so far and when it was first exceeded
+    reached = [(threshold, episode) for threshold, episode in zip(thresholds, crossings) if episode is not None]
+    return '>{:.2f} @ {}'.format(*reached[-1]) if len(reached) > 0 else '-'
+
+
+def render_dashboard(experiment_name: str, snapshots: list, thresholds: list, image_path: Path):
+
+    # one subplot per run, arranged in a grid
+    num_cols = min(len(snapshots), 3)
+    num_rows = max(math.ceil(len(snapshots) / max(num_cols, 1)), 1)
+    figure, axes = plt.subplots(num_rows, max(num_cols, 1), figsize=(6 * max(num_cols, 1), 4 * num_rows), squeeze=False)
+
+    for ax, run in zip(axes.flat, snapshots):
+
+        # plot the win and tie rates of the run
+        ax.plot(run[dh.EPISODE], run[dh.WINRATE_A], label=dh.WINRATE_A)
+        ax.plot(run[dh.EPISODE], run[dh.WINRATE_B], label=dh.WINRATE_B)
+        ax.plot(run[dh.EPISODE], run[dh.TIE_RATE], label=dh.TIE_RATE)
+        ax.set_ylim(0.0, 1.0)
+        ax.set_xlim(left=0)
+        ax.set_xlabel(dh.EPISODE)
+        ax.set_ylabel('win/tie rate')
+        ax.legend(loc='lower right')
+
+        # show the latest episode and the convergence metrics of both agents in the title
+        ax.set_title('{} (episode {})\nA: best {:.2f}, {} | B: best {:.2f}, {}'.format(
+            run['name'], run[dh.EPISODE][-1] if len(run[dh.EPISODE]) > 0 else 0,
+            run['best'][0], format_crossing(thresholds, run['crossings'][0]),
+            run['best'][1], format_crossing(thresholds, run['crossings'][1])), fontsize='small')
+
+    # hide the unused subplots of the grid
+    for ax in list(axes.flat)[len(snapshots):]: ax.set_visible(False)
+
+    # write the dashboard to a temporary file first, so viewers never see a partially written image
+    figure.suptitle(experiment_name)
+    figure.tight_layout()
+    temp_path = image_path.with_name(image_path.stem + '.tmp' + image_path.suffix)
+    figure.savefig(temp_path)
+    plt.close(figure)
+    os.replace(temp_path, image_path)
+
+
+class WinRateTail(object):
+
+    def __init__(self, experiments_path: Path, thresholds: list=cm.DEFAULT_THRESHOLDS,
+                 poll_interval: float=DEFAULT_POLL_INTERVAL, discovery_interval: float=DEFAULT_DISCOVERY_INTERVAL):
+        self.experiments_path = experiments_path
+        self.thresholds = thresholds
+        self.poll_interval = poll_interval
+        self.discovery_interval = discovery_interval
+        self.experiments = {}
+        self.runs = {}
+
+        # pyplot is not thread-safe, so all dashboards are rendered by one background thread
+        self.render_executor = ThreadPoolExecutor(max_workers=1)
+
+
+    def discover(self):
+
+        # register the experiments and runs that appeared since the last scan
+        num_new = 0
+        for experiment in ei.build_experiment_index(self.experiments_path):
+            self.experiments[experiment.name] = experiment
+            runs = self.runs.setdefault(experiment.name, {})
+            for win_rates_path in experiment.win_rates_paths():
+                if win_rates_path in runs: continue
+                runs[win_rates_path] = RunTail(win_rates_path, self.thresholds)
+                num_new += 1
+        return num_new
+
+
+    def poll(self):
+
+        # read the appended rows of all runs, returning the experiments whose data changed
+        for runs in self.runs.values():
+            for run in runs.values(): run.poll()
+        return [name for name, runs in self.runs.items() if any(run.is_dirty for run in runs.values())]
+
+
+    async def render(self, experiment_name: str):
+
+        # snapshot the changed experiment and render it without blocking the polling
+        runs = self.runs[experiment_name].values()
+        snapshots = [run.snapshot() for run in sorted(runs, key=lambda run: run.name)]
+        for run in runs: run.is_dirty = False
+        image_path = self.experiments[experiment_name].plot_path(DASHBOARD_KIND, DASHBOARD_IMAGE)
+        await asyncio.get_running_loop().run_in_executor(self.render_executor,
+            render_dashboard, experiment_name, snapshots, self.thresholds, image_path)
+        print('rendered dashboard of {} to {}'.format(experiment_name, image_path))
+
+
+    async def follow(self, once: bool=False):
+
+        # poll all runs in a fixed interval and rescan the experiments for new runs once in a while
+        loop = asyncio.get_running_loop()
+        last_discovery = -math.inf
+        rendering = {}
+        while True:
+            if loop.time() - last_discovery >= self.discovery_interval:
+                num_new = self.discover()
+                if num_new > 0: print('following {} new runs'.format(num_new))
+                last_discovery = loop.time()
+
+            # re-render the dashboards with new rows (at most one pending render per experiment)
+            for experiment_name in self.poll():
+                task = rendering.get(experiment_name)
+                if task is None or task.done():
+                    rendering[experiment_name] = asyncio.create_task(self.render(experiment_name))
+
+            if once: break
+            await asyncio.sleep(self.poll_interval)
+
+        # wait for the pending renders before leaving
+        await asyncio.gather(*rendering.values())
+
+
+def main():
+
+    # parse script args (the experiments directory defaults to the one the plotters use)
+    args = [arg for i, arg in enumerate(sys.argv[1:], start=1) if not arg.startswith('--') and sys.argv[i - 1] != ARG_INTERVAL]
+    experiments_path = Path(args[0]) if len(args) > 0 else Path(Path().cwd().parents[0] / 'experiments')
+    poll_interval = float(sys.argv[sys.argv.index(ARG_INTERVAL) + 1]) if ARG_INTERVAL in sys.argv else DEFAULT_POLL_INTERVAL
+    if not experiments_path.is_dir(): raise ValueError("Invalid arguments! Call this script with following arguments: \n"
+        + "[<experiments_dir>] [--interval <seconds>] [--once]\n"
+        + "Experiments directory {} could not be found!".format(experiments_path))
+
+    # follow the win rates of all runs until the script gets interrupted
+    tail = WinRateTail(experiments_path, poll_interval=poll_interval)
+    try:
+        asyncio.run(tail.follow(once=ARG_ONCE in sys.argv))
+    except KeyboardInterrupt:
+        print('stopped following {}'.format(experiments_path))
+    finally:
+        tail.render_executor.shutdown()
+
+
+ # run the main script
+if __name__ == '__main__':
+    with ins.instrumented_run('winrate_tail'):
+        main()
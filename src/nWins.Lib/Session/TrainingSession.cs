@@ -91,8 +91,8 @@ public class TrainingSession : ITrainingSession
             training = false;
             // store training results on exit
             Console.WriteLine("exiting training session, storing final models ...");
-            if (Settings.ConfigAgentA.IsTrainable) { File.Move(Settings.ConfigAgentA.GetModelPath(0), Settings.ConfigAgentA.GetModelPath(episode)); }
-            if (Settings.ConfigAgentB.IsTrainable) { File.Move(Settings.ConfigAgentB.GetModelPath(0), Settings.ConfigAgentB.GetModelPath(episode)); }
+            if (Settings.ConfigAgentA.IsTrainable) { storeFinalModel(Settings.ConfigAgentA, episode); }
+            if (Settings.ConfigAgentB.IsTrainable) { storeFinalModel(Settings.ConfigAgentB, episode); }
             Console.WriteLine("Stored models to file");
         });
 
@@ -109,6 +109,13 @@ public class TrainingSession : ITrainingSession
                 writeModelToTempStorage();
 
                 Console.WriteLine("stored model to temp files");
+
+                // keep a copy of the models as episode-tagged checkpoint (the temp files are overwritten each interval)
+                if (Settings.CheckpointInterval > 0 && episode > 0 && episode % Settings.CheckpointInterval == 0)
+                {
+                    writeCheckpoints(episode);
+                    Console.WriteLine($"stored checkpoints of episode { episode }");
+                }
                 Console.WriteLine($"starting training episode { episode } - { episode + Settings.TrainingInterval }");
 
                 // switch agents to training mode
@@ -201,6 +208,20 @@ public class TrainingSession : ITrainingSession
         }
     }
 
+    private static void storeFinalModel(ITrainableAgentSettings config, int episode)
+    {
+        // replace the checkpoint of the same episode (if any), it holds the same model
+        if (episode > 0) { File.Delete(config.GetModelPath(episode)); }
+        File.Move(config.GetModelPath(0), config.GetModelPath(episode));
+    }
+
+    private void writeCheckpoints(int episode)
+    {
+        // copy the models stored to temp files (the final models are renamed to the same paths on exit)
+        if (Settings.ConfigAgentA.IsTrainable) { File.Copy(Settings.ConfigAgentA.GetModelPath(0), Settings.ConfigAgentA.GetModelPath(episode), true); }
+        if (Settings.ConfigAgentB.IsTrainable) { File.Copy(Settings.ConfigAgentB.GetModelPath(0), Settings.ConfigAgentB.GetModelPath(episode), true); }
+    }
+
     private void updateInferenceMode()
     {
         // if only one agent is trainable: make the trainable agent greedy and the non-trainable agent semi-greedy
@@ -31,6 +31,11 @@ public interface ITrainingSettings
     /// The amount of games played during one inference phase.
     /// </summary>
     int InferenceInterval { get; set; }
+
+    /// <summary>
+    /// The amount of games after which the current models are kept as episode-tagged checkpoints (0 = only at exit).
+    /// </summary>
+    int CheckpointInterval { get; set; }
 }
 
 /// <summary>
@@ -59,4 +64,7 @@ public class TrainingSettings : ITrainingSettings
 
     [JsonProperty("inference_interval")]
     public int InferenceInterval { get; set; } = 10000;
+
+    [JsonProperty("checkpoint_interval")]
+    public int CheckpointInterval { get; set; } = 0;
 }
@@ -1,4 +1,5 @@
 using System;
+using System.Collections.Generic;
 using System.IO;
 using Microsoft.Data.Sqlite;
 using nWins.Lib.Core;
@@ -20,6 +21,9 @@ public class QTableSQLite
 
     private SqliteConnection _connection;
 
+    // whether the agent type tables are keyed by Base64 strings (legacy layout + speedup.sql) instead of raw hash bytes
+    private Dictionary<AgentType, bool> _hasTextKeys = new Dictionary<AgentType, bool>();
+
     /// <summary>
     /// Retrieve the best action for the given state. If the state is not in the cache, -1 is returned.
     /// </summary>
@@ -30,19 +34,64 @@ public class QTableSQLite
     {
         if (_connection.State != System.Data.ConnectionState.Open) { _connection.Open(); }
 
+        // look up the state itself first
+        var bestAction = queryBestColumn(agentType, state);
+        if (bestAction >= 0) { return bestAction; }
+
+        // canonical databases only store one state of each pair of mirror images,
+        // so look up the mirrored state and mirror its best column back
+        bestAction = queryBestColumn(agentType, mirrorState(state));
+        return bestAction >= 0 ? state.MaxColumns - 1 - bestAction : -1;
+    }
+
+    private int queryBestColumn(AgentType agentType, IGameState state)
+    {
         var bestAction = -1;
         var command = _connection.CreateCommand();
+
+        // the optimized tables store exactly one best column per state, keyed by the raw hash bytes;
+        // the legacy speedup tables store all columns of a state, keyed by the Base64 hash
+        var hash = GameStateHashFactory.ToBase64Hash(state);
         command.CommandText = $"SELECT Column "
             + $"FROM NwinsQtable_{(int)agentType} "
-            + $"WHERE HashBefore = '{GameStateHashFactory.ToBase64Hash(state)}' "
+            + $"WHERE HashBefore = $hashBefore "
             + $"ORDER BY QValue DESC "
             + $"LIMIT 1";
-        
+        if (hasTextKeys(agentType)) { command.Parameters.AddWithValue("$hashBefore", hash); }
+        else { command.Parameters.AddWithValue("$hashBefore", Convert.FromBase64String(hash)); }
+
         using (var reader = command.ExecuteReader())
         {
-            reader.Read();
-            bestAction = reader.GetInt32(0);
+            if (reader.Read()) { bestAction = reader.GetInt32(0); }
         }
         return bestAction;
     }
+
+    private bool hasTextKeys(AgentType agentType)
+    {
+        // determine the key type of each table once (empty tables are treated as optimized ones)
+        if (!_hasTextKeys.TryGetValue(agentType, out var isText))
+        {
+            var command = _connection.CreateCommand();
+            command.CommandText = $"SELECT typeof(HashBefore) FROM NwinsQtable_{(int)agentType} LIMIT 1";
+            isText = command.ExecuteScalar() as string == "text";
+            _hasTextKeys[agentType] = isText;
+        }
+        return isText;
+    }
+
+    private static IGameState mirrorState(IGameState state)
+    {
+        // reflect the board at its vertical center axis (column c becomes column max columns - 1 - c)
+        var fields = new GameSide[state.Fields.Length];
+        for (int row = 0; row < state.MaxRows; row++)
+        {
+            for (int col = 0; col < state.MaxColumns; col++)
+            {
+                fields[row * state.MaxColumns + col] = state.Fields[row * state.MaxColumns + state.MaxColumns - 1 - col];
+            }
+        }
+
+        return GameStateFactory.CreateState(state.MaxRows, state.MaxColumns, fields);
+    }
 }